@@ -0,0 +1,176 @@
+""" Echo benchmark of the event loop backends.
+
+Runs a PyTAPS echo listener and a number of PyTAPS clients on one event
+loop, which send messages back and forth over TCP and UDP, once for each
+event loop backend, and prints the round trips per second.
+
+    python benchmarks/echo.py --connections 8 --messages 2000 --size 64
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import time
+
+sys.path.append(sys.path[0] + "/..")
+import pytaps as taps  # noqa: E402
+from pytaps.eventloop import import_uvloop  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def transport_properties(protocol):
+    properties = taps.TransportProperties()
+    if protocol == "tcp":
+        properties.require("reliability")
+    else:
+        properties.prohibit("reliability")
+        properties.ignore("congestion-control")
+        properties.ignore("preserve-order")
+    return properties
+
+
+class EchoServer:
+    async def handle_connection_received(self, connection):
+        connection.on_received(self.handle_received)
+        connection.on_received_partial(self.handle_received_partial)
+        await connection.receive(min_incomplete_length=1)
+
+    async def handle_received(self, data, context, connection):
+        await connection.receive(min_incomplete_length=1)
+        await connection.send_message(data)
+
+    async def handle_received_partial(self, data, context, end_of_message,
+                                      connection):
+        await connection.receive(min_incomplete_length=1)
+        await connection.send_message(data)
+
+
+class EchoClient:
+    def __init__(self, loop):
+        self.loop = loop
+        self.connection = None
+        self.ready = loop.create_future()
+        self.waiter = None
+        self.missing = 0
+        self.lost = 0
+
+    async def handle_ready(self, connection):
+        self.connection = connection
+        connection.on_received(self.handle_received)
+        connection.on_received_partial(self.handle_received_partial)
+        self.ready.set_result(connection)
+
+    async def handle_initiate_error(self):
+        self.ready.set_exception(Exception("Initiate error"))
+
+    async def handle_received(self, data, context, connection):
+        self.got(len(data))
+
+    async def handle_received_partial(self, data, context, end_of_message,
+                                      connection):
+        self.got(len(data))
+
+    def got(self, length):
+        self.missing -= length
+        if self.missing > 0:
+            # Stream data may arrive in pieces
+            self.loop.create_task(
+                self.connection.receive(min_incomplete_length=1))
+        elif self.waiter and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def run(self, messages, payload):
+        for i in range(messages):
+            self.missing = len(payload)
+            self.waiter = self.loop.create_future()
+            await self.connection.send_message(payload)
+            await self.connection.receive(min_incomplete_length=1)
+            try:
+                await asyncio.wait_for(self.waiter, 1)
+            except asyncio.TimeoutError:
+                self.lost += 1
+
+
+async def echo(protocol, args):
+    """ Returns the number of round trips per second and the number
+        of lost messages
+    """
+    loop = asyncio.get_running_loop()
+    port = free_port()
+    local_endpoint = taps.LocalEndpoint()
+    local_endpoint.with_address("127.0.0.1")
+    local_endpoint.with_port(port)
+    server = EchoServer()
+    listening = taps.Preconnection(
+        local_endpoint=local_endpoint,
+        transport_properties=transport_properties(protocol))
+    listening.on_connection_received(server.handle_connection_received)
+    listener = await listening.listen()
+    while not listener.listening():
+        await asyncio.sleep(0.01)
+
+    clients = []
+    for i in range(args.connections):
+        remote_endpoint = taps.RemoteEndpoint()
+        remote_endpoint.with_address("127.0.0.1")
+        remote_endpoint.with_port(port)
+        client = EchoClient(loop)
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote_endpoint,
+            transport_properties=transport_properties(protocol))
+        preconnection.on_ready(client.handle_ready)
+        preconnection.on_initiate_error(client.handle_initiate_error)
+        await preconnection.initiate()
+        await client.ready
+        clients.append(client)
+
+    payload = b"x" * args.size
+    start = time.perf_counter()
+    await asyncio.gather(*[client.run(args.messages, payload)
+                           for client in clients])
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.connection.close()
+    listener.stop()
+    await asyncio.sleep(0)
+    round_trips = args.connections * args.messages
+    return round_trips / elapsed, sum(client.lost for client in clients)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="PyTAPS echo benchmark.")
+    ap.add_argument("--connections", "-c", type=int, default=8)
+    ap.add_argument("--messages", "-n", type=int, default=2000)
+    ap.add_argument("--size", "-s", type=int, default=64)
+    ap.add_argument("--backend", "-b", action="append",
+                    choices=["asyncio", "uvloop"],
+                    help="backend to run, all installed ones by default")
+    ap.add_argument("--protocol", "-p", action="append",
+                    choices=["tcp", "udp"],
+                    help="protocol to run, both by default")
+    args = ap.parse_args()
+    # Only log errors, so that logging does not dominate the results
+    taps.configure_logging(level="ERROR")
+
+    backends = args.backend or ["asyncio"]
+    if not args.backend:
+        if import_uvloop():
+            backends.append("uvloop")
+        else:
+            print("uvloop is not installed, only running asyncio.")
+    print("%-8s %-4s %14s %6s" % ("backend", "", "round trips/s", "lost"))
+    for backend in backends:
+        # Requesting uvloop without having it falls back to asyncio
+        backend = taps.get_loop_backend(backend)
+        for protocol in args.protocol or ["tcp", "udp"]:
+            rate, lost = taps.run(echo(protocol, args), backend=backend)
+            print("%-8s %-4s %14.0f %6d" % (backend, protocol, rate, lost))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+""" Connection establishment and racing benchmark.
+
+Initiates PyTAPS connections to a host name that a fake resolver maps to
+documentation addresses. An event loop that simulates the paths to these
+addresses delays each connection attempt, then connects it to a local
+listener, refuses it, or blackholes it, i.e., never answers. Reports the
+time until the connection is ready, the connection attempts that were
+wasted on candidates that did not win, and the sockets still open once
+the race has settled, for each scenario with a cold and a warm racing
+history.
+
+    python benchmarks/racing.py --iterations 20 --output racing.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import socket
+import sys
+import time
+
+sys.path.append(sys.path[0] + "/..")
+import pytaps as taps  # noqa: E402
+from pytaps import racing  # noqa: E402
+
+HOST_NAME = "racing.example"
+PORT = 443
+
+# Paths as (address, seconds until the attempt completes, outcome), where
+# the outcome is "accept", "refuse" or "blackhole", plus the seconds
+# until the AAAA and the A answer arrive
+SCENARIOS = {
+    "all-fast": {
+        "paths": [("2001:db8::1", 0.005, "accept"),
+                  ("192.0.2.1", 0.005, "accept")],
+    },
+    "ipv6-blackhole": {
+        "paths": [("2001:db8::1", 0, "blackhole"),
+                  ("2001:db8::2", 0, "blackhole"),
+                  ("192.0.2.1", 0.005, "accept")],
+    },
+    "ipv6-slow": {
+        "paths": [("2001:db8::1", 0.3, "accept"),
+                  ("192.0.2.1", 0.02, "accept")],
+    },
+    "slow-aaaa": {
+        "paths": [("2001:db8::1", 0.005, "accept"),
+                  ("192.0.2.1", 0.005, "accept")],
+        "aaaa_delay": 0.2,
+    },
+    "many-refused": {
+        "paths": [("2001:db8::%d" % i, 0.02, "refuse") for i in range(1, 5)] +
+                 [("192.0.2.%d" % i, 0.02, "refuse") for i in range(1, 4)] +
+                 [("192.0.2.4", 0.02, "accept")],
+    },
+    "mixed-delays": {
+        "paths": [("2001:db8::1", 0.15, "accept"),
+                  ("2001:db8::2", 0, "blackhole"),
+                  ("192.0.2.1", 0.08, "accept"),
+                  ("192.0.2.2", 0.01, "refuse")],
+        "aaaa_delay": 0.03,
+    },
+}
+
+
+class FakeResolver:
+    """ Answers AAAA and A queries for the paths of a scenario,
+        each after its own delay
+    """
+
+    def __init__(self, paths, aaaa_delay=0, a_delay=0):
+        self.paths = paths
+        self.delays = {socket.AF_INET6: aaaa_delay, socket.AF_INET: a_delay}
+
+    async def getaddrinfo(self, host, port, family=0, type=0, proto=0,
+                          flags=0):
+        await asyncio.sleep(self.delays.get(family, 0))
+        answers = []
+        for address, delay, outcome in self.paths:
+            address_family = racing.address_family(address)
+            if family in (0, address_family):
+                sockaddr = (address, port, 0, 0) \
+                    if address_family == socket.AF_INET6 else (address, port)
+                answers.append((address_family, type, proto, "", sockaddr))
+        return answers
+
+
+class Server(asyncio.Protocol):
+    """ Local listener that connections to accepting paths end up at
+    """
+    open = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        Server.open.add(self)
+
+    def connection_lost(self, exc):
+        Server.open.discard(self)
+
+
+class SimulatedLoop(asyncio.SelectorEventLoop):
+    """ Event loop that simulates the paths to fake addresses
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.paths = {}
+        self.server_port = None
+        # Attempts that have neither failed nor turned into a transport
+        self.attempts_open = 0
+        self.transports = []
+
+    async def create_connection(self, protocol_factory, host=None, port=None,
+                                **kwargs):
+        if host not in self.paths:
+            return await super().create_connection(protocol_factory, host,
+                                                   port, **kwargs)
+        delay, outcome = self.paths[host]
+        # A socket is taken while the attempt is running
+        self.attempts_open += 1
+        try:
+            await asyncio.sleep(delay)
+            if outcome == "blackhole":
+                await self.create_future()
+            if outcome == "refuse":
+                raise ConnectionRefusedError("Refused by simulated path")
+            transport, protocol = await super().create_connection(
+                protocol_factory, "127.0.0.1", self.server_port, **kwargs)
+        finally:
+            self.attempts_open -= 1
+        self.transports.append(transport)
+        return transport, protocol
+
+    def open_sockets(self):
+        self.transports = [transport for transport in self.transports
+                           if not transport.is_closing()]
+        return len(self.transports) + self.attempts_open
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def reset_history():
+    taps.get_racing_history().flush()
+    racing.rtt_estimator.srtt = None
+    racing.rtt_estimator.rttvar = None
+
+
+async def establish(loop, resolver, settle):
+    """ Races one connection and returns the time until it was ready,
+        its connection attempts and the sockets left open besides it
+    """
+    remote_endpoint = taps.RemoteEndpoint()
+    remote_endpoint.with_hostname(HOST_NAME)
+    remote_endpoint.with_port(PORT)
+    properties = taps.TransportProperties()
+    properties.require("reliability")
+    preconnection = taps.Preconnection(
+        remote_endpoint=remote_endpoint, transport_properties=properties,
+        event_loop=loop, resolver=resolver)
+    ready = loop.create_future()
+
+    async def handle_ready(connection):
+        ready.set_result(time.perf_counter())
+
+    async def handle_initiate_error():
+        ready.set_result(None)
+
+    preconnection.on_ready(handle_ready)
+    preconnection.on_initiate_error(handle_initiate_error)
+    start = time.perf_counter()
+    connection = await preconnection.initiate()
+    end = await asyncio.wait_for(ready, 30)
+    # Give the losing attempts time to be cancelled or closed
+    await asyncio.sleep(settle)
+    established = end is not None
+    leftover = loop.open_sockets() + len(Server.open) - 2 * established
+    result = {
+        "ready_seconds": end - start if established else None,
+        "attempts": connection.metrics.racing_attempts,
+        "wasted_attempts": connection.metrics.racing_attempts -
+        established,
+        "open_sockets": leftover,
+    }
+    if established:
+        connection.close()
+    # Leaked sockets would stay open, so do not wait for them forever
+    deadline = time.perf_counter() + 5
+    while (Server.open or loop.open_sockets()) and \
+            time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    return result
+
+
+async def run_scenario(name, scenario, history, args):
+    loop = asyncio.get_running_loop()
+    loop.paths = dict((address, (delay, outcome))
+                      for address, delay, outcome in scenario["paths"])
+    resolver = FakeResolver(scenario["paths"],
+                            scenario.get("aaaa_delay", 0),
+                            scenario.get("a_delay", 0))
+    reset_history()
+    runs = []
+    for i in range(args.iterations):
+        if history == "cold":
+            reset_history()
+        runs.append(await establish(loop, resolver, args.settle))
+    times = [run["ready_seconds"] for run in runs
+             if run["ready_seconds"] is not None]
+    return {
+        "scenario": name,
+        "history": history,
+        "iterations": len(runs),
+        "failed": len(runs) - len(times),
+        "ready_ms": {
+            "p50": percentile(times, 0.5) * 1000 if times else None,
+            "p90": percentile(times, 0.9) * 1000 if times else None,
+            "max": max(times) * 1000 if times else None,
+        },
+        "attempts": sum(run["attempts"] for run in runs) / len(runs),
+        "wasted_attempts": sum(run["wasted_attempts"]
+                               for run in runs) / len(runs),
+        "open_sockets": sum(run["open_sockets"] for run in runs),
+    }
+
+
+async def run_all(args):
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(Server, "127.0.0.1", 0)
+    loop.server_port = server.sockets[0].getsockname()[1]
+    results = []
+    for name in args.scenario:
+        for history in args.history:
+            result = await run_scenario(name, SCENARIOS[name], history, args)
+            ready = result["ready_ms"]
+            print("%-16s %-5s %8.1f %8.1f %8.1f %9.2f %7.2f %5d %6d" % (
+                name, history, ready["p50"] or 0, ready["p90"] or 0,
+                ready["max"] or 0, result["attempts"],
+                result["wasted_attempts"], result["failed"],
+                result["open_sockets"]))
+            results.append(result)
+    server.close()
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="PyTAPS connection establishment benchmark.")
+    ap.add_argument("--scenario", "-s", nargs="+", choices=list(SCENARIOS),
+                    default=list(SCENARIOS))
+    ap.add_argument("--history", nargs="+", choices=["cold", "warm"],
+                    default=["cold", "warm"],
+                    help="forget the racing history before every "
+                    "connection, or keep it")
+    ap.add_argument("--iterations", "-n", type=int, default=10)
+    ap.add_argument("--settle", type=float, default=0.3,
+                    help="seconds to wait after ready before counting "
+                    "open sockets")
+    ap.add_argument("--output", "-o", help="file to write the JSON to")
+    args = ap.parse_args()
+    # Only log errors, so that logging does not dominate the results
+    taps.configure_logging(level="ERROR")
+
+    print("%-16s %-5s %8s %8s %8s %9s %7s %5s %6s" % (
+        "scenario", "hist", "p50 ms", "p90 ms", "max ms", "attempts",
+        "wasted", "fail", "leaked"))
+    loop = SimulatedLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(run_all(args))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    report = {
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
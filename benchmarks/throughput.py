@@ -0,0 +1,389 @@
+""" Throughput and latency benchmark suite.
+
+Starts a PyTAPS echo listener and PyTAPS clients in one process, for every
+combination of protocol, framer, message size and number of connections.
+Each client keeps a window of messages in flight and measures the time
+until each one has been echoed. Prints a table and writes the results as
+JSON, which can be compared against an earlier run to catch regressions.
+
+    python benchmarks/throughput.py --sizes 16 1024 65536 1048576 \\
+        --connections 1 100 --output results.json
+    python benchmarks/throughput.py --compare results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import struct
+import sys
+import time
+from collections import deque
+
+from echo import EchoServer, free_port, transport_properties
+import pytaps as taps  # noqa: E402
+
+# Largest payload that fits into a UDP datagram over IPv4
+MAX_DATAGRAM_SIZE = 65507
+# Number of connections initiated at the same time
+INITIATE_BATCH = 256
+
+
+class LengthPrefixFramer(taps.SyncFramer):
+    """ Frames each message with a four byte length
+    """
+
+    def frame(self, data, context, eom):
+        return [struct.pack("!I", len(data)), data]
+
+    def deframe(self, connection):
+        buffer, context, eom = connection.parse()
+        if len(buffer) < 4:
+            raise taps.DeframingFailed
+        length = struct.unpack_from("!I", buffer)[0]
+        if len(buffer) < 4 + length:
+            raise taps.DeframingFailed
+        return context, bytes(buffer[4:4 + length]), 4 + length, True
+
+
+class Client:
+    """ Sends messages and keeps up to window of them in flight,
+        recording the round trip time of each one
+    """
+
+    def __init__(self, loop, payload, messages, window, message_based,
+                 iterate=False):
+        self.loop = loop
+        self.payload = payload
+        self.messages = messages
+        self.window = window
+        # Whether every delivery is a whole message
+        self.message_based = message_based
+        # Whether to iterate over messages() instead of using callbacks
+        self.iterate = iterate
+        self.connection = None
+        self.ready = loop.create_future()
+        self.done = loop.create_future()
+        self.sent_times = deque()
+        self.latencies = []
+        self.sent = 0
+        self.completed = 0
+        self.partial = 0
+        # Time the last echo arrived
+        self.last = None
+
+    async def handle_ready(self, connection):
+        self.connection = connection
+        connection.on_received(self.handle_received)
+        connection.on_received_partial(self.handle_received_partial)
+        if not self.ready.done():
+            self.ready.set_result(connection)
+
+    async def handle_initiate_error(self):
+        if not self.ready.done():
+            self.ready.set_exception(Exception("Initiate error"))
+
+    async def handle_received(self, data, context, connection):
+        await self.delivered(len(data))
+
+    async def handle_received_partial(self, data, context, end_of_message,
+                                      connection):
+        await self.delivered(len(data))
+
+    async def start(self):
+        if self.iterate:
+            self.loop.create_task(self.receive_messages())
+        else:
+            await self.connection.receive(min_incomplete_length=1)
+        for i in range(min(self.window, self.messages)):
+            await self.send()
+
+    async def receive_messages(self):
+        async for data, context in self.connection.messages():
+            await self.delivered(len(data))
+            if self.completed >= self.messages:
+                return
+
+    async def send(self):
+        self.sent += 1
+        self.sent_times.append(time.perf_counter())
+        await self.connection.send_message(self.payload)
+
+    async def delivered(self, length):
+        now = time.perf_counter()
+        if self.message_based:
+            echoed = 1
+        else:
+            # Stream data arrives in pieces of any size
+            echoed, self.partial = divmod(self.partial + length,
+                                          len(self.payload))
+        for i in range(echoed):
+            self.latencies.append(now - self.sent_times.popleft())
+        self.completed += echoed
+        self.last = now
+        if self.completed >= self.messages:
+            if not self.done.done():
+                self.done.set_result(None)
+            return
+        if not self.iterate:
+            await self.connection.receive(min_incomplete_length=1)
+        for i in range(echoed):
+            if self.sent < self.messages:
+                await self.send()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def wait_for_clients(clients, timeout):
+    """ Waits until all clients are done, or until none has made
+        progress for timeout seconds, e.g., because datagrams got lost
+    """
+    pending = [client.done for client in clients]
+    while True:
+        progress = sum(client.completed for client in clients)
+        done, pending = await asyncio.wait(pending, timeout=timeout)
+        if not pending:
+            return
+        if sum(client.completed for client in clients) == progress:
+            return
+
+
+async def run_config(protocol, framed, size, connections, args):
+    """ Returns the results of one configuration
+    """
+    loop = asyncio.get_running_loop()
+    port = free_port()
+    local_endpoint = taps.LocalEndpoint()
+    local_endpoint.with_address("127.0.0.1")
+    local_endpoint.with_port(port)
+    listening = taps.Preconnection(
+        local_endpoint=local_endpoint,
+        transport_properties=transport_properties(protocol))
+    if framed:
+        listening.add_framer(LengthPrefixFramer())
+    listening.on_connection_received(
+        EchoServer().handle_connection_received)
+    listener = await listening.listen()
+    while not listener.listening():
+        await asyncio.sleep(0.01)
+
+    # Spread the messages across the connections
+    per_connection = max(1, args.messages // connections)
+    payload = b"x" * size
+    clients = []
+    start = time.perf_counter()
+    for first in range(0, connections, INITIATE_BATCH):
+        batch = []
+        for i in range(first, min(first + INITIATE_BATCH, connections)):
+            remote_endpoint = taps.RemoteEndpoint()
+            remote_endpoint.with_address("127.0.0.1")
+            remote_endpoint.with_port(port)
+            client = Client(loop, payload, per_connection, args.window,
+                            framed or protocol == "udp",
+                            args.receive == "iterator")
+            preconnection = taps.Preconnection(
+                remote_endpoint=remote_endpoint,
+                transport_properties=transport_properties(protocol))
+            if framed:
+                preconnection.add_framer(LengthPrefixFramer())
+            preconnection.on_ready(client.handle_ready)
+            preconnection.on_initiate_error(client.handle_initiate_error)
+            await preconnection.initiate()
+            batch.append(client)
+        await asyncio.wait_for(
+            asyncio.gather(*[client.ready for client in batch]),
+            args.timeout * 10)
+        clients.extend(batch)
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client.start() for client in clients])
+    await wait_for_clients(clients, args.timeout)
+    # Waiting for lost messages does not count
+    elapsed = max([client.last for client in clients
+                   if client.last is not None] or
+                  [time.perf_counter()]) - start
+
+    for client in clients:
+        client.connection.close()
+    listener.stop()
+    listener.close_connections()
+    await asyncio.sleep(0.01)
+
+    completed = sum(client.completed for client in clients)
+    sent = sum(client.sent for client in clients)
+    latencies = sorted(latency for client in clients
+                       for latency in client.latencies)
+    return {
+        "messages": completed,
+        "lost": sent - completed,
+        "seconds": elapsed,
+        "setup_seconds": setup,
+        "msgs_per_s": completed / elapsed,
+        "mb_per_s": completed * size / elapsed / 1e6,
+        "latency_ms": dict(
+            (name, latency * 1000 if latency is not None else None)
+            for name, latency in (
+                ("p50", percentile(latencies, 0.5)),
+                ("p90", percentile(latencies, 0.9)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else None))),
+    }
+
+
+def raise_file_limit(connections):
+    """ Each connection takes a socket on both ends
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = connections * 2 + 64
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (
+            hard if hard == resource.RLIM_INFINITY else
+            min(max(needed, soft), hard), hard))
+
+
+async def run_suite(args):
+    results = []
+    for protocol in args.protocol:
+        for framer in args.framer:
+            for size in args.sizes:
+                for connections in args.connections:
+                    result = {
+                        "protocol": protocol,
+                        "framer": framer,
+                        "size": size,
+                        "connections": connections,
+                        "window": args.window,
+                        "receive": args.receive,
+                    }
+                    overhead = 4 if framer == "length" else 0
+                    if protocol == "udp" and \
+                            size + overhead > MAX_DATAGRAM_SIZE:
+                        result["skipped"] = "too large for a datagram"
+                    else:
+                        try:
+                            result.update(await run_config(
+                                protocol, framer == "length", size,
+                                connections, args))
+                        except Exception as err:
+                            result["skipped"] = "failed: " + repr(err)
+                    print_result(result)
+                    results.append(result)
+    return results
+
+
+def print_result(result):
+    prefix = "%-4s %-6s %8d %6d" % (result["protocol"], result["framer"],
+                                    result["size"], result["connections"])
+    if "skipped" in result:
+        print(prefix + "   skipped, " + result["skipped"])
+        return
+    latency = result["latency_ms"]
+    print(prefix + " %10.0f %9.2f %8.3f %8.3f %8.3f %6d" % (
+        result["msgs_per_s"], result["mb_per_s"], latency["p50"] or 0,
+        latency["p99"] or 0, latency["max"] or 0, result["lost"]))
+
+
+def key_of(result):
+    return (result["protocol"], result["framer"], result["size"],
+            result["connections"], result["window"],
+            result.get("receive", "callbacks"))
+
+
+def compare(results, baseline, tolerance):
+    """ Returns the configurations whose message rate dropped by more
+        than tolerance compared to a baseline run
+    """
+    before = dict((key_of(result), result) for result in baseline
+                  if "skipped" not in result)
+    regressions = []
+    for result in results:
+        old = before.get(key_of(result))
+        if old is None or "skipped" in result:
+            continue
+        if result["msgs_per_s"] < old["msgs_per_s"] * (1 - tolerance):
+            regressions.append((key_of(result), old["msgs_per_s"],
+                                result["msgs_per_s"]))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="PyTAPS throughput and latency benchmark suite.")
+    ap.add_argument("--protocol", "-p", nargs="+", default=["tcp", "udp"],
+                    choices=["tcp", "udp"])
+    ap.add_argument("--framer", "-f", nargs="+", default=["none", "length"],
+                    choices=["none", "length"])
+    ap.add_argument("--sizes", "-s", nargs="+", type=int,
+                    default=[16, 1024, 65536])
+    ap.add_argument("--connections", "-c", nargs="+", type=int,
+                    default=[1, 100])
+    ap.add_argument("--messages", "-n", type=int, default=2000,
+                    help="messages per configuration, spread across "
+                    "the connections")
+    ap.add_argument("--window", "-w", type=int, default=1,
+                    help="messages in flight per connection")
+    ap.add_argument("--receive", "-r", default="callbacks",
+                    choices=["callbacks", "iterator"],
+                    help="receive with receive() and callbacks, or by "
+                    "iterating over connection.messages()")
+    ap.add_argument("--timeout", "-t", type=float, default=2.0,
+                    help="seconds without progress after which the "
+                    "missing messages count as lost")
+    ap.add_argument("--backend", "-b", choices=["asyncio", "uvloop"])
+    ap.add_argument("--output", "-o", help="file to write the JSON to")
+    ap.add_argument("--compare", help="JSON of an earlier run to compare "
+                    "with, exits with 1 on regressions")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="drop in messages per second that counts as "
+                    "a regression")
+    args = ap.parse_args()
+    # Only log errors, so that logging does not dominate the results
+    taps.configure_logging(level="ERROR")
+    # Receives still pending on closed connections are
+    # reported when they get collected
+    logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+    raise_file_limit(max(args.connections))
+
+    backend = taps.get_loop_backend(args.backend)
+    print("%-4s %-6s %8s %6s %10s %9s %8s %8s %8s %6s" % (
+        "", "framer", "size", "conns", "msgs/s", "MB/s", "p50 ms",
+        "p99 ms", "max ms", "lost"))
+    results = taps.run(run_suite(args), backend=backend)
+    report = {
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": backend,
+        "messages": args.messages,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"],
+                                  args.tolerance)
+        for key, old, new in regressions:
+            print("Regression in %s: %.0f -> %.0f msgs/s" % (
+                "/".join(str(part) for part in key), old, new))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
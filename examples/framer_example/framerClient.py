@@ -21,7 +21,7 @@ class TestFramer(taps.Framer):
 
     async def handle_received_data(self, connection):
         byte_stream, context, eom = connection.parse()
-        byte_stream = byte_stream.decode()
+        byte_stream = bytes(byte_stream).decode()
         logger.info("Deframing " + byte_stream)
         try:
             tlv = byte_stream.split("/")
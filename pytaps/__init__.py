@@ -1,9 +1,19 @@
 from .connection import Connection
 from .endpoint import LocalEndpoint, RemoteEndpoint
-from .framer import Framer, DeframingFailed
+from .eventloop import run, set_loop_backend, get_loop_backend
+from .framer import Framer, SyncFramer, DeframingFailed
 from .listener import Listener
+from .loops import LoopPool
+from .metrics import Metrics, MetricsExporter, get_metrics_registry
 from .multicast import do_join
+from .pool import ConnectionPool
 from .preconnection import Preconnection
+from .racing import RacingHistory, get_racing_history
+from .resolver import Resolver, get_resolver
 from .securityParameters import SecurityParameters
-from .transportProperties import TransportProperties, PreferenceLevel
-from .utility import print_time, ConnectionState, setup_logger
\ No newline at end of file
+from .sharding import ShardedListener
+from .tls import TlsSessionCache
+from .tracing import TraceEvent, TraceRecorder, get_tracer, log_sink
+from .transportProperties import TransportProperties, PreferenceLevel, DropPolicy
+from .utility import print_time, ConnectionState, setup_logger, \
+    configure_logging
\ No newline at end of file
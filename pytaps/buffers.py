@@ -0,0 +1,216 @@
+from collections import deque
+
+from .transportProperties import DropPolicy
+from .utility import *
+
+logger = setup_logger(__name__, "blue")
+
+# Initial capacity of a receive buffer in bytes
+RECV_BUFFER_INITIAL_SIZE = 64 * 1024
+# Capacity above which a receive buffer frees its memory once it is empty
+RECV_BUFFER_IDLE_SIZE = 4 * RECV_BUFFER_INITIAL_SIZE
+# Default number of datagrams a receive queue can hold
+RECV_QUEUE_CAPACITY = 1024
+
+
+class ReceiveBuffer:
+    """ Growable reception buffer for stream based transports.
+
+        Data is appended at the end of a preallocated bytearray and
+        consumed from the front by advancing a read cursor, so neither
+        appending nor consuming copies the data that is still buffered.
+        The unread region is only moved to a fresh bytearray when the
+        buffer runs out of space at its end, which happens rarely.
+
+        No memory is allocated until data arrives. The new bytearray is
+        sized from the initial size again, so the buffer shrinks once
+        the data that made it grow has been consumed, and a buffer that
+        has grown large is freed as soon as it is empty.
+
+        Views returned by view() stay valid until the read cursor is
+        advanced past them.
+
+    Attributes:
+        initial_size (integer, optional):
+                Initial capacity of the buffer in bytes.
+    """
+
+    def __init__(self, initial_size=RECV_BUFFER_INITIAL_SIZE):
+        self.initial_size = initial_size
+        # Allocated on the first append
+        self._buf = bytearray()
+        # Position of the first unread byte
+        self._start = 0
+        # Position after the last buffered byte
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def capacity(self):
+        """ Returns the number of bytes currently allocated.
+        """
+        return len(self._buf)
+
+    def append(self, data):
+        """ Appends newly received data to the end of the buffer.
+
+        Attributes:
+            data (bytes-like, required):
+                The data to append.
+        """
+        length = len(data)
+        if self._end + length > len(self._buf):
+            self._compact(length)
+        # Same-size slice assignment never resizes the bytearray, so
+        # memoryviews handed out earlier remain valid
+        self._buf[self._end:self._end + length] = data
+        self._end += length
+
+    def view(self, length=-1):
+        """ Returns a memoryview of (at most length) unread bytes without
+            copying them.
+
+        Attributes:
+            length (integer, optional):
+                Maximum number of bytes to return, -1 for all.
+        """
+        end = self._end
+        if 0 <= length < end - self._start:
+            end = self._start + length
+        return memoryview(self._buf)[self._start:end]
+
+    def advance(self, length):
+        """ Moves the read cursor forward, discarding length bytes.
+
+        Attributes:
+            length (integer, required):
+                Number of bytes that have been consumed.
+        """
+        self._start = min(self._start + length, self._end)
+        if self._start == self._end:
+            # Buffer is empty, start writing at the front again
+            self.clear()
+
+    def read(self, length=-1):
+        """ Returns (at most length) unread bytes as a bytes object and
+            advances the read cursor past them.
+
+        Attributes:
+            length (integer, optional):
+                Maximum number of bytes to return, -1 for all.
+        """
+        with self.view(length) as data_view:
+            data = bytes(data_view)
+        self.advance(len(data))
+        return data
+
+    def clear(self):
+        """ Discards all buffered data.
+        """
+        self._start = 0
+        self._end = 0
+        if len(self._buf) > max(self.initial_size, RECV_BUFFER_IDLE_SIZE):
+            # Views handed out earlier keep the old bytearray alive
+            self._buf = bytearray()
+
+    def _compact(self, needed):
+        # Move the unread bytes to the front of a new bytearray, sized
+        # from the initial size so that it grows or shrinks with the data
+        # that is still unread. A new bytearray is allocated instead of
+        # moving the data in place, as a framer may still hold a view of
+        # the old one.
+        unread = self._end - self._start
+        size = self.initial_size
+        while unread + needed > size // 2:
+            size *= 2
+        new_buf = bytearray(size)
+        new_buf[:unread] = memoryview(self._buf)[self._start:self._end]
+        logger.debug("Compacted receive buffer, %d bytes unread, capacity %d",
+                     unread, size)
+        self._buf = new_buf
+        self._start = 0
+        self._end = unread
+
+
+class DatagramQueue:
+    """ Bounded reception queue for message based transports.
+
+        Holds at most capacity datagrams and, if max_bytes is set, at
+        most max_bytes bytes. Once the queue is full, new
+        datagrams are handled according to the drop policy: DROP_OLDEST
+        discards the datagram at the head of the queue, DROP_NEWEST
+        discards the arriving datagram. With PAUSE_READING, the
+        transport is expected to pause reading once full() is true,
+        datagrams still arriving after that are discarded like with
+        DROP_NEWEST.
+
+    Attributes:
+        capacity (integer, optional):
+                Maximum number of datagrams to hold.
+        policy (DropPolicy, optional):
+                What to do with new datagrams once the queue is full.
+        max_bytes (integer, optional):
+                Maximum number of bytes to hold.
+    """
+
+    def __init__(self, capacity=RECV_QUEUE_CAPACITY,
+                 policy=DropPolicy.DROP_OLDEST, max_bytes=None):
+        self._queue = deque()
+        self.capacity = capacity
+        self.policy = policy
+        self.max_bytes = max_bytes
+        # Number of bytes currently held
+        self.size = 0
+        # Number of datagrams dropped because the queue was full
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def full(self):
+        return len(self._queue) >= self.capacity or (
+            self.max_bytes is not None and self.size >= self.max_bytes)
+
+    def _fits(self, length):
+        return len(self._queue) < self.capacity and (
+            self.max_bytes is None or self.size + length <= self.max_bytes)
+
+    def put(self, datagram):
+        """ Adds a datagram to the end of the queue, dropping one
+            datagram if the queue is full. Returns False if the new
+            datagram has been dropped.
+
+        Attributes:
+            datagram (bytes, required):
+                The datagram to add.
+        """
+        length = len(datagram)
+        if not self._fits(length):
+            if self.policy is DropPolicy.DROP_OLDEST:
+                while self._queue and not self._fits(length):
+                    self.size -= len(self._queue.popleft())
+                    self.dropped += 1
+            if not self._fits(length):
+                self.dropped += 1
+                return False
+        self._queue.append(datagram)
+        self.size += length
+        return True
+
+    def peek(self):
+        """ Returns the datagram at the head of the queue
+            without removing it.
+        """
+        return self._queue[0]
+
+    def get(self):
+        """ Removes and returns the datagram at the head of the queue.
+        """
+        datagram = self._queue.popleft()
+        self.size -= len(datagram)
+        return datagram
+
+    def clear(self):
+        self._queue.clear()
+        self.size = 0
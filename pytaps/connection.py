@@ -1,11 +1,12 @@
 import socket
 import netifaces
 
+from .metrics import Metrics, metrics_registry
+from .racing import HappyEyeballs
+from .tracing import Tracer
 from .transports import *
 
 logger = setup_logger(__name__)
-# Wait for 100 ms between connection attempts when racing
-RACING_DELAY = 0.1
 
 
 class Connection:
@@ -25,18 +26,29 @@ class Connection:
         self.security_parameters = preconnection.security_parameters
         self.security_context = preconnection.security_context
         self.loop = preconnection.loop
+        self.resolver = preconnection.resolver
         self.active = False
         self.framer = preconnection.framer
-        self.sleeper_for_racing = SleepClassForRacing()
         self.pending = []
-        # Security Context for SSL
-        self.security_context = None
+        # Sessions to resume TLS connections with
+        self.tls_sessions = preconnection.tls_sessions
         # Current state of the connection object
         self.state = ConnectionState.ESTABLISHING
         # List of possible underlying transports
         self.transports = []
         self.protocol = None
         self.multicast_open = False
+        # Pool to which the connection is returned on release
+        self.pool = None
+        self.pool_key = None
+        # Counters of this connection, also counted for the listener
+        # or preconnection it came from
+        self.metrics = Metrics(preconnection.metrics)
+        metrics_registry.track_connection(self)
+        # Tracer to report the phases of setting up the connection to,
+        # the one of the preconnection unless on_trace() has been used
+        self.tracer = preconnection.tracer
+        self.own_tracer = None
 
         # Callbacks
         self.writer = None
@@ -58,157 +70,97 @@ class Connection:
     async def race(self):
         # This is an active connection attempt
         self.active = True
+        span = self.tracer.start(self, "candidates")
         # Create the set of possible protocol candidates
         protocol_candidates = create_candidates(self)
 
         if len(protocol_candidates) == 0:
-            logger.CRITICAL("Candidate set is empty, aborting")
+            if span:
+                span.end(candidates=0)
+            logger.critical("Candidate set is empty, aborting")
+            self.state = ConnectionState.CLOSED
             if self.initiate_error:
                 self.loop.create_task(self.initiate_error())
             return
 
-        if self.remote_endpoint.host_name:
-            # Resolve address
-            # FIXME: Unfortunately, asyncio getaddrinfo does not
-            # FIXME: allow to resolve on specific interfaces
-            # FIXME: Consider migrating to something better, e.g., getdns
-            remote_info = await self.loop.getaddrinfo(
-                self.remote_endpoint.host_name, self.remote_endpoint.port)
-            # Concat v6 and v4 address lists, making sure we try v6 first
-            remote_addrs_v6 = list(
-                set([
-                    info[4][0] for info in remote_info
-                    if info[0] == socket.AddressFamily.AF_INET6]
-                    )
-            )
-            remote_addrs_v4 = list(
-                set([
-                    info[4][0] for info in remote_info
-                    if info[0] == socket.AddressFamily.AF_INET]
-                    )
-            )
-            remote_addrs = remote_addrs_v6 + remote_addrs_v4
-            logger.info("Resolved " + str(self.remote_endpoint.host_name) +
-                        " to " + str(remote_addrs))
-
-        else:
-            remote_addrs = self.remote_endpoint.address
-            logger.info("Not resolving - using address " +
-                        str(self.remote_endpoint.address) + " --> " +
-                        str(remote_addrs))
-
-        if self.local_endpoint:
+        local_addresses = None
+        if self.local_endpoint and self.local_endpoint.interface:
             # Local interface specified -->
             # try local addresses on that interface
-            for local_interface in self.local_endpoint.interface:
+            interfaces = self.local_endpoint.interface
+            if isinstance(interfaces, str):
+                interfaces = [interfaces]
+            local_addresses = {socket.AF_INET6: [], socket.AF_INET: []}
+            for local_interface in interfaces:
                 try:
                     # Unfortunately, link-local IPv6 addresses don't work
                     # because they're broken in
                     # asyncio: https://bugs.python.org/issue35545
-                    local_v6_addrs = [entry['addr']
-                                      for entry in netifaces.ifaddresses
-                                      (local_interface)[netifaces.AF_INET6]
-                                      if entry['addr'][:4] != "fe80"]
-                    local_v4_addrs = [entry['addr']
-                                      for entry in netifaces.ifaddresses
-                                      (local_interface)[netifaces.AF_INET]]
-                    logger.info("Trying addresses of local interface " +
-                                str(self.local_endpoint.interface) + " --> " +
-                                str(local_v6_addrs) + ", " +
-                                str(local_v4_addrs), color)
+                    interface_addresses = netifaces.ifaddresses(
+                        local_interface)
+                    local_addresses[socket.AF_INET6] += [
+                        entry['addr'] for entry in
+                        interface_addresses.get(netifaces.AF_INET6, [])
+                        if entry['addr'][:4] != "fe80"]
+                    local_addresses[socket.AF_INET] += [
+                        entry['addr'] for entry in
+                        interface_addresses.get(netifaces.AF_INET, [])]
                 except ValueError as err:
                     logger.critical("Cannot get IP addresses for " +
-                                    str(self.local_endpoint.interface) + ": " +
-                                    str(err), color)
-                    # TODO throw error
-            # Build candidate set for racing
-            # based on combinations of protocol, local and remote IP address
-            candidate_set = [protocol + (remote_address,) + (local_address,)
-                             for remote_address in remote_addrs_v6
-                             for protocol in protocol_candidates
-                             for local_address in local_v6_addrs]
-            candidate_set += [protocol + (remote_address,) + (local_address,)
-                              for remote_address in remote_addrs_v4
-                              for protocol in protocol_candidates
-                              for local_address in local_v4_addrs]
-            logger.info("Final Candidates: " + str(candidate_set))
-
-        else:
-            # Build candidate set for racing
-            # based on combinations of protocol and remote IP address
-            candidate_set = [protocol + (address,)
-                             for address in remote_addrs
-                             for protocol in protocol_candidates]
-
-        # Attempt to establish a connection with each candidate
-        for candidate in candidate_set:
-
-            if self.state == ConnectionState.ESTABLISHED:
-                logger.info("Connection established -- stop racing")
-                break
-
-            logger.info("Trying candidate protocol: " + str(candidate[0]) +
-                        " and remote address: " + str(candidate[2]) +
-                        (" and local address: " + str(candidate[3])
-                         if len(candidate) > 3 else ""))
-            if len(candidate) > 3:
-                # bind to a specific local address
-                local_address_to_use = (candidate[3], None)
-                self.local_endpoint.address = candidate[3]
-            else:
-                local_address_to_use = None
-
-            if candidate[0] == 'udp':
-                self.protocol = 'udp'
-                logger.info("Creating UDP connect task with remote addr " +
-                            str(candidate[2]) + ", port " +
-                            str(self.remote_endpoint.port))
-                self.remote_endpoint.address = candidate[2]
-
-                # Create a datagram endpoint
-                self.loop.create_task(
-                    self.loop.create_datagram_endpoint(
-                        lambda: UdpTransport(
-                            connection=self,
-                            remote_endpoint=self.remote_endpoint),
-                        remote_addr=(self.remote_endpoint.address,
-                                     self.remote_endpoint.port),
-                        local_addr=local_address_to_use))
-
-                logger.info("Not racing multiple addrs for UDP" +
-                            " -- stop racing")
-                break
-
-            elif candidate[0] == 'tcp':
-                self.protocol = 'tcp'
-                logger.info("Creating TCP connect task to " + candidate[2] +
-                            ".")
-                self.remote_endpoint.address = candidate[2]
-                # If the protocol is tcp, create a asyncio connection
-                self.loop.create_task(
-                    self.loop.create_connection(
-                        lambda: TcpTransport(
-                            connection=self,
-                            remote_endpoint=self.remote_endpoint),
-                        self.remote_endpoint.address,
-                        self.remote_endpoint.port,
-                        ssl=self.security_context,
-                        server_hostname=(
-                            self.remote_endpoint.host_name
-                            if self.security_context else None),
-                        local_addr=local_address_to_use))
-                # Wait before starting next connection attempt
-                await self.sleeper_for_racing.sleep(RACING_DELAY)
+                                    str(local_interface) + ": " + str(err))
+            logger.info("Trying addresses of local interface " +
+                        str(self.local_endpoint.interface) + " --> " +
+                        str(local_addresses))
+        if span:
+            span.end(candidates=len(protocol_candidates))
+
+        # Race candidates of all combinations of protocol,
+        # remote and local address
+        await HappyEyeballs(self, protocol_candidates, local_addresses).run()
 
     async def send_message(self, data):
         """ Attempts to send data on the connection.
             Attributes:
                 data (string, required):
-                    Data to be send.
+                    Data to be send. Without a framer, a list of
+                    bytes-like objects is sent as one message
+                    without joining them first.
         """
         if isinstance(data, str):
             data = data.encode()
-        return self.transports[0].send(data)
+        transport = self.transports[0]
+        # Block while the send buffer is above its high water mark
+        if transport.writing_paused:
+            await transport.drain()
+        return transport.send(data)
+
+    async def send_messages(self, messages):
+        """ Attempts to send a batch of messages on the connection,
+            framing them in one pass and writing them with as few
+            system calls as possible. Returns the list of
+            message references.
+            Attributes:
+                messages (iterable, required):
+                    Messages to be send.
+        """
+        transport = self.transports[0]
+        if transport.writing_paused:
+            await transport.drain()
+        return transport.send_batch(
+            [data.encode() if isinstance(data, str) else data
+             for data in messages])
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        """ Sets the high and low water marks of the send buffer.
+            Once more than high bytes are buffered, send_message()
+            blocks until the buffer has drained below low bytes.
+        Attributes:
+            high (integer, optional):
+                High water mark in bytes.
+            low (integer, optional):
+                Low water mark in bytes.
+        """
+        self.transports[0].set_write_buffer_limits(high, low)
 
     async def receive(self, min_incomplete_length=float("inf"), max_length=-1):
         """ Queues the reception of a message.
@@ -221,6 +173,49 @@ class Connection:
         """
         self.transports[0].receive(min_incomplete_length, max_length)
 
+    async def receive_message(self, min_incomplete_length=1, max_length=-1):
+        """ Waits for the next message and returns its data, or None
+            once the connection has been closed or the peer has finished
+            sending and all data has been read. Unlike receive(), the
+            message is returned right away if it has already arrived,
+            without scheduling tasks or calling the received callbacks.
+            Without a framer, TCP returns as soon as min_incomplete_length
+            bytes have arrived.
+        Attributes:
+            min_incomplete_length (integer, optional):
+                The minimum length an incomplete message
+                needs to have.
+            max_length (integer, optional):
+                The maximum length a message can have.
+        """
+        message = await self.transports[0].next_message(
+            min_incomplete_length, max_length)
+        if message is None:
+            return None
+        return message[0]
+
+    async def messages(self, min_incomplete_length=1, max_length=-1):
+        """ Iterates over the received messages as tuples of data and
+            message context, until the connection has been closed or
+            the peer has finished sending, like receive_message():
+
+                async for data, context in connection.messages():
+                    ...
+        Attributes:
+            min_incomplete_length (integer, optional):
+                The minimum length an incomplete message
+                needs to have.
+            max_length (integer, optional):
+                The maximum length a message can have.
+        """
+        while True:
+            # The transport changes if the connection is handed off
+            message = await self.transports[0].next_message(
+                min_incomplete_length, max_length)
+            if message is None:
+                return
+            yield message[0], message[1]
+
     def close(self):
         """ Attempts to close the connection, issues a closed event
         on success.
@@ -230,11 +225,54 @@ class Connection:
         self.loop.create_task(self.transports[0].close())
         self.state = ConnectionState.CLOSING
 
+    def release(self):
+        """ Returns the connection to the pool of its Preconnection,
+        so that a later initiate() can reuse it. The connection is closed
+        instead if it was not initiated from a pool, or if it cannot be
+        reused.
+        """
+        if self.pool is None or not self.pool.release(self):
+            self.close()
+
+    def session_reused(self):
+        """ Returns whether the connection has resumed an earlier TLS
+        session instead of doing a full handshake, or None if it does
+        not use TLS.
+        """
+        transport = self.transports[0].transport if self.transports else None
+        ssl_object = transport.get_extra_info("ssl_object") \
+            if transport else None
+        if ssl_object is None:
+            return None
+        return ssl_object.session_reused
+
+    def dropped_messages(self):
+        """ Returns the number of received messages that have been
+            dropped because the reception queue of the connection
+            was full.
+        """
+        return getattr(self.transports[0].recv_buffer, "dropped", 0)
+
+    def datagram_stats(self):
+        """ Returns counters of a UDP connection: the number of
+            datagrams sent, the number of send calls that took, the
+            number of calls saved by batching, and whether segmentation
+            offload is used. If datagrams are read in batches, also the
+            number of datagrams received and of batches they came in.
+            Returns None for other transports.
+        """
+        transport = self.transports[0]
+        if not hasattr(transport, "datagram_stats"):
+            return None
+        return transport.datagram_stats()
+
     def parse(self, min_incomplete_length=0, max_length=0):
         """ Returns the message buffer of the
-            connection.
+            connection. For stream based transports, this is a
+            memoryview of the buffered data which is only valid
+            until the framer has deframed the message.
         """
-        return self.transports[0].recv_buffer, None, False
+        return self.transports[0].parse(min_incomplete_length, max_length)
 
     # Events for active open
     def on_ready(self, callback):
@@ -259,6 +297,21 @@ class Connection:
         """
         self.initiate_error = callback
 
+    def on_trace(self, sink):
+        """ Adds a sink for the trace events of this connection, i.e.,
+            the timed phases of setting it up and its first bytes.
+            Events of a connection that is being initiated reach the
+            sink if it is added right after initiate() returns.
+
+        Attributes:
+            sink (function, required): Function called with each
+                TraceEvent, must not block.
+        """
+        if self.own_tracer is None:
+            self.own_tracer = Tracer(self.tracer)
+            self.tracer = self.own_tracer
+        self.tracer.add_sink(sink)
+
     # Events for sending messages
     def on_sent(self, callback):
         """ Set callback for sent events that get thrown if a message has been
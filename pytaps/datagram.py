@@ -0,0 +1,286 @@
+import errno
+import socket
+import struct
+import sys
+
+from .utility import *
+
+logger = setup_logger(__name__, "blue")
+
+# Default maximum number of datagrams read per readiness event
+RECV_BATCH_SIZE = 64
+# Size of the reception buffer, large enough for any UDP datagram
+RECV_DATAGRAM_SIZE = 65535
+# UDP generic segmentation offload (Linux 4.18 and later), not
+# defined by the socket module of all Python versions
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+# Limits of the kernel for one segmented send
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+# Errors a send reports for an ICMP message the socket received for an
+# earlier datagram, they do not mean that the current send failed
+ICMP_ERRORS = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH)
+
+
+class BatchedDatagramReader:
+    """ Reads datagrams from the socket of an asyncio datagram transport
+        in batches, instead of letting asyncio call datagram_received()
+        once per datagram.
+
+        Whenever the socket becomes readable, up to batch_size datagrams
+        are read with non-blocking recvmsg_into() calls into one
+        preallocated buffer, and handed to the protocol's
+        datagrams_received() as one list of (data, address) tuples.
+        A protocol with a receive_room() method is asked before each
+        batch how many datagrams it can take, the others are left in
+        the socket's buffer.
+
+        Use attach() to create a reader, it returns None where batched
+        reading is not available, e.g., on event loops that do not
+        support add_reader(). The transport is then left alone.
+
+    Attributes:
+        loop (eventLoop, required):
+                Event loop of the transport.
+        transport (DatagramTransport, required):
+                Transport to take over reading from.
+        protocol (object, required):
+                Object with a datagrams_received(batch) method, an
+                error_received(exc) method and, optionally, a
+                receive_room() method that returns the number of
+                datagrams it can take, or None if there is no limit.
+        batch_size (integer, optional):
+                Maximum number of datagrams per batch.
+    """
+
+    def __init__(self, loop, transport, protocol, batch_size=RECV_BATCH_SIZE):
+        self.loop = loop
+        self.transport = transport
+        self.protocol = protocol
+        self.batch_size = batch_size
+        self.room = getattr(protocol, "receive_room", None)
+        self.buffer = bytearray(RECV_DATAGRAM_SIZE)
+        self.view = memoryview(self.buffer)
+        # asyncio does not expose the socket itself, so read from a
+        # duplicate of it
+        self.sock = transport.get_extra_info("socket").dup()
+        self.sock.setblocking(False)
+        self.reading = False
+        # Number of readiness events and datagrams, for statistics
+        self.batches = 0
+        self.datagrams = 0
+
+    @classmethod
+    def attach(cls, loop, transport, protocol, batch_size=RECV_BATCH_SIZE):
+        """ Takes over reading from transport and returns the reader,
+            or None if batched reading is not available.
+        """
+        if batch_size <= 1 or not hasattr(socket.socket, "recvmsg_into") \
+                or transport.get_extra_info("socket") is None:
+            return None
+        try:
+            reader = cls(loop, transport, protocol, batch_size)
+        except (AttributeError, OSError):
+            # Other event loops, e.g., uvloop, may not hand out
+            # a socket that can be duplicated
+            return None
+        # Stop asyncio from reading the same socket
+        try:
+            transport.pause_reading()
+        except (AttributeError, NotImplementedError):
+            reader.sock.close()
+            return None
+        try:
+            reader.resume()
+        except NotImplementedError:
+            reader.sock.close()
+            transport.resume_reading()
+            return None
+        logger.info("Reading up to " + str(batch_size) +
+                    " datagrams per batch.")
+        return reader
+
+    def pause(self):
+        if self.reading:
+            self.loop.remove_reader(self.sock.fileno())
+            self.reading = False
+
+    def resume(self):
+        if not self.reading and self.sock.fileno() >= 0:
+            self.loop.add_reader(self.sock.fileno(), self.read_ready)
+            self.reading = True
+
+    def close(self):
+        self.pause()
+        self.sock.close()
+
+    def read_ready(self):
+        limit = self.batch_size
+        if self.room is not None:
+            room = self.room()
+            if room is not None:
+                limit = min(limit, room)
+        batch = []
+        recvmsg_into = self.sock.recvmsg_into
+        buffers = [self.buffer]
+        view = self.view
+        for i in range(limit):
+            if not self.reading:
+                break
+            try:
+                nbytes, ancdata, flags, addr = recvmsg_into(buffers)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self.protocol.error_received(exc)
+                break
+            if flags & socket.MSG_TRUNC:
+                logger.warning("Truncated datagram from %s", addr)
+            batch.append((bytes(view[:nbytes]), addr))
+        if batch:
+            self.batches += 1
+            self.datagrams += len(batch)
+            self.protocol.datagrams_received(batch)
+
+
+def gso_supported(sock):
+    """ Returns whether the kernel segments UDP datagrams for sock
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+    except OSError:
+        return False
+    return True
+
+
+class BatchedDatagramSender:
+    """ Sends batches of datagrams directly on the socket of an asyncio
+        datagram transport, with as few system calls as possible.
+
+        Where the kernel supports UDP generic segmentation offload,
+        consecutive datagrams of the same size are handed to the kernel
+        with one sendmsg() call, which splits them into datagrams again.
+        The last datagram of such a run may be shorter. Otherwise, each
+        datagram is sent with its own call, without going through the
+        event loop.
+
+        Use attach() to create a sender, it returns None where sending
+        directly is not available.
+
+    Attributes:
+        transport (DatagramTransport, required):
+                Transport whose socket to send on.
+        sock (socket, optional):
+                Duplicate of the transport's socket to use, e.g., the one
+                of a BatchedDatagramReader. One is created otherwise.
+    """
+
+    def __init__(self, transport, sock=None):
+        self.transport = transport
+        self.owns_socket = sock is None
+        if sock is None:
+            sock = transport.get_extra_info("socket").dup()
+            sock.setblocking(False)
+        self.sock = sock
+        self.gso = gso_supported(sock)
+
+    @classmethod
+    def attach(cls, transport, sock=None):
+        """ Returns a sender for transport,
+            or None if sending directly is not available.
+        """
+        if not hasattr(socket.socket, "sendmsg") or \
+                transport.get_extra_info("socket") is None:
+            return None
+        try:
+            sender = cls(transport, sock)
+        except (AttributeError, OSError):
+            return None
+        logger.info("Sending datagrams directly, segmentation offload: " +
+                    str(sender.gso))
+        return sender
+
+    def close(self):
+        if self.owns_socket:
+            self.sock.close()
+
+    def send(self, datagrams, address=None):
+        """ Sends as many datagrams as possible without blocking. Returns
+            the number of datagrams sent and the number of system calls
+            used. Datagrams that have not been sent yet must be sent
+            after these, through the transport.
+
+            An OSError other than one for a full send buffer is raised
+            with the number of datagrams sent and of system calls used
+            before it attached as its sent and calls attributes.
+
+        Attributes:
+            datagrams (list, required):
+                Datagrams to send, as bytes-like objects.
+            address (tuple, optional):
+                Address to send to, if the socket is not connected.
+        """
+        sent = 0
+        calls = 0
+        total = len(datagrams)
+        try:
+            while sent < total:
+                run = self.segment_run(datagrams, sent) if self.gso else 1
+                calls += 1
+                if run > 1:
+                    try:
+                        self.send_segmented(datagrams[sent:sent + run],
+                                            address)
+                    except OSError as exc:
+                        if exc.errno not in (errno.EIO, errno.EINVAL):
+                            raise
+                        # The interface cannot segment, stop trying
+                        logger.warning("UDP segmentation offload failed: " +
+                                       str(exc))
+                        self.gso = False
+                        continue
+                elif address is None:
+                    self.sock.send(datagrams[sent])
+                else:
+                    self.sock.sendto(datagrams[sent], address)
+                sent += run
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as exc:
+            exc.sent = sent
+            exc.calls = calls
+            raise
+        return sent, calls
+
+    @staticmethod
+    def segment_run(datagrams, start):
+        """ Returns how many datagrams from start on can be sent
+            with one segmented send
+        """
+        size = len(datagrams[start])
+        if size == 0:
+            return 1
+        end = start + 1
+        limit = min(len(datagrams), start + GSO_MAX_SEGMENTS)
+        total = size
+        while end < limit:
+            length = len(datagrams[end])
+            if length > size or total + length > GSO_MAX_BYTES:
+                break
+            total += length
+            end += 1
+            if length < size:
+                # Only the last segment may be shorter
+                break
+        return end - start
+
+    def send_segmented(self, datagrams, address):
+        ancdata = [(SOL_UDP, UDP_SEGMENT,
+                    struct.pack("=H", len(datagrams[0])))]
+        if address is None:
+            self.sock.sendmsg(datagrams, ancdata)
+        else:
+            self.sock.sendmsg(datagrams, ancdata, 0, address)
@@ -0,0 +1,124 @@
+import os
+
+from .utility import *
+
+logger = setup_logger(__name__, "yellow")
+
+# Environment variable to choose the event loop implementation with
+LOOP_BACKEND_ENV = "PYTAPS_LOOP"
+# "auto" uses uvloop if it is installed, and asyncio's loop otherwise
+LOOP_BACKENDS = ("auto", "asyncio", "uvloop")
+
+# Backend set with set_loop_backend(), takes precedence over the environment
+loop_backend = None
+
+
+def import_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        return None
+    return uvloop
+
+
+def set_loop_backend(backend):
+    """ Sets the event loop implementation that PyTAPS creates loops with,
+        "auto", "asyncio" or "uvloop". None goes back to the one set in
+        the PYTAPS_LOOP environment variable, or "auto".
+    """
+    global loop_backend
+    if backend is not None and backend not in LOOP_BACKENDS:
+        raise ValueError("Unknown event loop backend: " + str(backend))
+    loop_backend = backend
+
+
+def get_loop_backend(backend=None):
+    """ Returns the name of the event loop implementation to use, "asyncio"
+        or "uvloop", falling back to asyncio if uvloop is not installed.
+
+    Attributes:
+        backend (string, optional):
+                Backend to use instead of the configured one.
+    """
+    backend = backend or loop_backend or \
+        os.environ.get(LOOP_BACKEND_ENV) or "auto"
+    if backend not in LOOP_BACKENDS:
+        logger.warning("Unknown event loop backend " + str(backend) +
+                       ", using asyncio.")
+        return "asyncio"
+    if backend == "asyncio":
+        return backend
+    if import_uvloop() is None:
+        if backend == "uvloop":
+            logger.warning("uvloop is not installed, using asyncio.")
+        return "asyncio"
+    return "uvloop"
+
+
+def new_event_loop(backend=None):
+    """ Creates an event loop of the configured implementation.
+    """
+    if get_loop_backend(backend) == "uvloop":
+        return import_uvloop().new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def install_loop_backend(backend=None):
+    """ Makes asyncio create loops of the configured implementation,
+        e.g., for asyncio.run() or asyncio.get_event_loop(). Returns
+        the name of the implementation.
+    """
+    backend = get_loop_backend(backend)
+    if backend == "uvloop":
+        asyncio.set_event_loop_policy(import_uvloop().EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(None)
+    logger.info("Using " + backend + " event loop.")
+    return backend
+
+
+def cancel_all_tasks(loop):
+    tasks = [task for task in asyncio.all_tasks(loop) if not task.done()]
+    if not tasks:
+        return
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(
+        asyncio.gather(*tasks, return_exceptions=True))
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            loop.call_exception_handler({
+                "message": "unhandled exception during pytaps.run()",
+                "exception": task.exception(),
+                "task": task,
+            })
+
+
+def run(main, backend=None):
+    """ Runs a coroutine on a new event loop of the configured
+        implementation until it is done, like asyncio.run(), and
+        returns its result.
+
+    Attributes:
+        main (coroutine, required):
+                Coroutine to run, e.g., one that starts a listener
+                and then waits for it to be stopped.
+        backend (string, optional):
+                Event loop implementation to use instead of the
+                configured one.
+    """
+    loop = new_event_loop(backend)
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            cancel_all_tasks(loop)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            # Let calls to the default executor finish, loop.close() does
+            # not wait for its threads
+            if hasattr(loop, "shutdown_default_executor"):
+                loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
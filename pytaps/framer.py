@@ -14,8 +14,8 @@ class Framer:
                         one of the current thread is used by default
     """
 
-    def __init__(self, event_loop=asyncio.get_event_loop()):
-        self.loop = event_loop
+    def __init__(self, event_loop=None):
+        self.loop = event_loop or current_loop()
         self.fail_connection = None
         self.connection = None
 
@@ -59,7 +59,11 @@ class Framer:
             has sufficient data to deframe a message, it should
             either call advance_receive_cursor() and deliver() or
             deliver_and_advance_receive_cursor() which combines
-            both functions.
+            both functions. For stream based transports, parse()
+            returns a memoryview of the reception buffer, whose
+            memory is reused once the receive cursor has been
+            advanced, so messages must be copied, e.g., with
+            bytes(), before that.
 
         Attributes:
             connection (connection, required):
@@ -97,3 +101,63 @@ class Framer:
                 The framed message.
         """
         self.connection.send_data(data, -1)
+
+
+class SyncFramer(Framer):
+    """The TAPS Framer class for framers that do not need to wait for
+    anything while framing or deframing, e.g., length-prefix framers.
+
+    Instead of the new_sent_message() and handle_received_data()
+    coroutines, a SyncFramer implements the regular functions frame() and
+    deframe(), which are called inline whenever data is sent or received.
+
+    Attributes:
+        event_loop (eventLoop, optional):
+                        Event loop on which all coroutines and callbacks
+                        will be scheduled, if none if given the
+                        one of the current thread is used by default
+    """
+
+    async def start(self, connection):
+        return
+
+    def frame(self, data, context, eom):
+        """ Function that gets called when a new message
+            has been queued for sending by the application.
+            Returns the framed message.
+
+        Attributes:
+            data (string, required):
+                The data that is to be framed.
+            context (context, required):
+                The message context.
+            eom (boolean, required):
+                Marks whether or not this was marked
+                as end of message by the application.
+        """
+        raise NotImplementedError
+
+    def deframe(self, connection):
+        """ Function that gets called when new data
+            has arrived on the connection. The framer should
+            call parse() to get access to the buffer and return
+            a tuple of context, message, length of the message in
+            the buffer and end of message, or raise DeframingFailed
+            if the buffer does not hold a complete message yet.
+            For stream based transports, parse() returns a memoryview
+            of the reception buffer, whose memory is reused once the
+            message has been deframed, so the message must be a copy,
+            e.g., made with bytes(), not a slice of that view.
+
+        Attributes:
+            connection (connection, required):
+                The connection object on which new data has
+                arrived.
+        """
+        raise NotImplementedError
+
+    async def new_sent_message(self, data, context, eom):
+        return self.frame(data, context, eom)
+
+    async def handle_received_data(self, connection):
+        return self.deframe(connection)
@@ -1,12 +1,18 @@
 import ipaddress
+import weakref
 
 import netifaces
 
 from .connection import Connection
+from .metrics import Metrics, metrics_registry
 from .multicast import do_join, do_leave
+from .resolver import get_resolver
+from .tls import get_security_context
 from .transports import *
 
 logger = setup_logger(__name__, "cyan")
+# Records of events that happen for every datagram
+packet_log = HotPath(logger)
 
 
 class Listener:
@@ -25,12 +31,33 @@ class Listener:
         self.remote_endpoint = preconnection.remote_endpoint
         self.transport_properties = preconnection.transport_properties
         self.security_parameters = preconnection.security_parameters
-        self.security_context = preconnection.security_context
         self.loop = preconnection.loop
+        self.resolver = preconnection.resolver
         self.framer = preconnection.framer
-        self.security_context = None
+        # Accepting TLS connections requires a server side context
+        if self.security_parameters and self.security_parameters.identity:
+            self.security_context = get_security_context(
+                self.security_parameters, server_side=True)
+        else:
+            self.security_context = None
+        # Servers do not resume sessions of their own
+        self.tls_sessions = None
         self.active_ports = {}
         self.protocol = None
+        # Whether to share the address with other listeners, e.g.,
+        # the workers of a ShardedListener
+        self.reuse_port = False
+        self.servers = []
+        self.endpoints = []
+        self.connections_received = 0
+        # Handlers of received TCP connections
+        self.stream_handlers = weakref.WeakSet()
+        # LoopPool to hand received TCP connections to, if any
+        self.loop_pool = None
+        # Counters of all connections received by this listener
+        self.metrics = Metrics(preconnection.metrics)
+        metrics_registry.track_listener(self)
+        self.tracer = preconnection.tracer
 
         # Callbacks
         self.stopped = preconnection.stopped
@@ -53,7 +80,7 @@ class Listener:
 
         if self.remote_endpoint:
             if not self.remote_endpoint.address:
-                remote_info = await self.loop.getaddrinfo(
+                remote_info = await self.resolver.getaddrinfo(
                     self.remote_endpoint.host_name, self.remote_endpoint.port)
                 self.remote_endpoint.address = [remote_info[0][4][0]]
         # If the candidate set is empty issue an InitiateError cb
@@ -65,7 +92,7 @@ class Listener:
 
         all_addrs = []
         if self.local_endpoint.host_name:
-            endpoint_info = await self.loop.getaddrinfo(
+            endpoint_info = await self.resolver.getaddrinfo(
                 self.local_endpoint.host_name, self.local_endpoint.port)
             all_addrs += list(set([info[4][0] for info in endpoint_info]))
             logger.info("Resolved " + str(self.local_endpoint.host_name) +
@@ -129,22 +156,36 @@ class Listener:
                             # multicast_receiver = True
                             self.loop.create_task(self.multicast_join())
                     else:
-                        await self.loop.create_datagram_endpoint(
-                            lambda: DatagramHandler(self),
-                            local_addr=(
-                                self.local_endpoint.address[0],
-                                self.local_endpoint.port))
+                        transport, handler = \
+                            await self.loop.create_datagram_endpoint(
+                                lambda: DatagramHandler(self),
+                                local_addr=(
+                                    self.local_endpoint.address[0],
+                                    self.local_endpoint.port),
+                                reuse_port=self.reuse_port or None)
+                        self.endpoints.append(transport)
                 elif candidate[0] == 'tcp':
                     self.protocol = 'tcp'
                     self.local_endpoint.address = [candidate[2]]
                     logger.info("TCP local endpoint: address " +
                                 str(self.local_endpoint.address) +
                                 " port: " + str(self.local_endpoint.port))
-                    await self.loop.create_server(
-                        lambda: StreamHandler(self),
-                        self.local_endpoint.address[0],
-                        self.local_endpoint.port,
-                        ssl=self.security_context)
+                    if self.loop_pool:
+                        # TLS handshakes happen on the loops
+                        # the connections are handed to
+                        server = await self.loop.create_server(
+                            lambda: DispatchHandler(self),
+                            self.local_endpoint.address[0],
+                            self.local_endpoint.port,
+                            reuse_port=self.reuse_port or None)
+                    else:
+                        server = await self.loop.create_server(
+                            lambda: StreamHandler(self),
+                            self.local_endpoint.address[0],
+                            self.local_endpoint.port,
+                            ssl=self.security_context,
+                            reuse_port=self.reuse_port or None)
+                    self.servers.append(server)
             except Exception as err:
                 logger.warn("Listen Error occurred: " + str(err))
                 if self.listen_error:
@@ -156,6 +197,61 @@ class Listener:
                         str(self.local_endpoint.port))
         return
 
+    def stop(self):
+        """ Stops listening for new connections and calls the stopped
+            callback. Received TCP connections stay open, UDP flows end
+            with the socket they were received on.
+        """
+        if not self.servers and not self.endpoints:
+            return
+        logger.info("Stopping listener.")
+        for server in self.servers:
+            server.close()
+        for transport in self.endpoints:
+            transport.close()
+        self.servers = []
+        self.endpoints = []
+        if self.stopped:
+            self.loop.create_task(self.stopped())
+
+    def listening(self):
+        """ Returns whether the listener accepts connections.
+        """
+        return bool(self.servers or self.endpoints)
+
+    def open_connections(self):
+        """ Returns the number of received TCP connections
+            that are still open.
+        """
+        return sum(1 for handler in list(self.stream_handlers)
+                   if not handler.transport.is_closing())
+
+    def close_connections(self):
+        """ Closes all received TCP connections.
+        """
+        for handler in list(self.stream_handlers):
+            if not handler.transport.is_closing():
+                handler.transport.close()
+
+    def stream_handler(self, loop):
+        """ Returns a handler for a TCP connection received
+            by this listener that runs on another loop
+        """
+        return StreamHandler(self, loop)
+
+    def stats(self):
+        """ Returns a dictionary with the number of received connections,
+            of those still open, of sockets listened on, and the
+            counters of the received connections.
+        """
+        stats = {
+            "connections_received": self.connections_received,
+            "open_connections": self.open_connections(),
+            "sockets": len(self.servers) + len(self.endpoints),
+        }
+        stats.update(self.metrics.as_dict())
+        return stats
+
     """ ASYNCIO function that gets called when joining a multicast flow
     """
 
@@ -190,22 +286,63 @@ class DatagramHandler(asyncio.Protocol):
         self.remotes = dict()
         self.preconnection.handler = self
         self.transport = None
+        self.reader = None
+        self.sender = None
 
     def connection_made(self, transport):
         self.transport = transport
+        self.reader = BatchedDatagramReader.attach(
+            self.preconnection.loop, transport, self,
+            self.preconnection.transport_properties.properties.get(
+                "recv-batch-size", RECV_BATCH_SIZE))
+        self.sender = BatchedDatagramSender.attach(
+            transport, self.reader.sock if self.reader else None)
         logger.info("New UDP flow.")
         return
 
+    def connection_lost(self, exc):
+        if self.reader:
+            self.reader.close()
+        if self.sender:
+            self.sender.close()
+
     def datagram_received(self, data, addr):
-        logger.info("Received new datagram")
+        if packet_log.enabled:
+            packet_log.debug("Received datagram from %s", addr)
         if addr in self.remotes:
             self.remotes[addr].transports[0].datagram_received(data, addr)
             return
+        self.new_flow(addr).datagram_received(data, addr)
+
+    def datagrams_received(self, batch):
+        """ Dispatches a batch of (data, address) tuples
+            to the flows of their senders
+        """
+        if packet_log.enabled:
+            packet_log.debug("Received %d datagrams", len(batch))
+        flows = {}
+        for data, addr in batch:
+            datagrams = flows.get(addr)
+            if datagrams is None:
+                flows[addr] = [data]
+            else:
+                datagrams.append(data)
+        remotes = self.remotes
+        for addr, datagrams in flows.items():
+            if addr in remotes:
+                udp = remotes[addr].transports[0]
+            else:
+                udp = self.new_flow(addr)
+            udp.received_from(addr, datagrams)
+
+    def error_received(self, err):
+        logger.warning("Error on UDP listener: " + str(err))
+
+    def new_flow(self, addr):
         new_connection = Connection(self.preconnection)
         new_connection.state = ConnectionState.ESTABLISHED
         new_remote_endpoint = RemoteEndpoint()
-        logger.info("Received new connection from " +
-                    str(addr[0]) + ":" + str(addr[1]) + ".")
+        logger.info("Received new connection from %s:%s.", addr[0], addr[1])
         new_remote_endpoint.with_address(addr[0])
         new_remote_endpoint.with_port(addr[1])
         new_connection.remote_endpoint = new_remote_endpoint
@@ -214,22 +351,47 @@ class DatagramHandler(asyncio.Protocol):
                                new_connection.local_endpoint,
                                new_remote_endpoint)
         new_udp.transport = self.transport
+        new_udp.sender = self.sender
+        self.preconnection.connections_received += 1
         if new_connection.connection_received:
             new_connection.loop.create_task(
                 new_connection.connection_received(new_connection))
             logger.info("Called connection_received cb")
-        new_udp.datagram_received(data, addr)
         self.remotes[addr] = new_connection
-        return
+        return new_udp
+
+
+class DispatchHandler(asyncio.Protocol):
+    """ Class that hands incoming TCP connections to the loop pool
+        of the listener right after accepting them
+    """
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def connection_made(self, transport):
+        self.listener.connections_received += 1
+        self.listener.loop_pool.dispatch(self.listener, transport)
 
 
 class StreamHandler(asyncio.Protocol):
 
-    def __init__(self, preconnection):
+    def __init__(self, preconnection, loop=None):
         new_connection = Connection(preconnection)
+        self.listener = preconnection
+        # Connections dispatched to another loop have been
+        # counted by the listener already
+        self.dispatched = loop is not None
+        if self.dispatched:
+            new_connection.loop = loop
+            new_connection.resolver = get_resolver(loop)
         self.connection = new_connection
+        self.transport = None
 
     def connection_made(self, transport):
+        self.transport = transport
+        if not self.dispatched:
+            self.listener.stream_handlers.add(self)
         new_remote_endpoint = RemoteEndpoint()
         logger.info("Received new connection.")
         # Get information about the newly connected endpoint
@@ -242,7 +404,10 @@ class StreamHandler(asyncio.Protocol):
                                self.connection.local_endpoint,
                                new_remote_endpoint)
         new_tcp.transport = transport
+        new_tcp.apply_write_buffer_limits()
         self.connection.state = ConnectionState.ESTABLISHED
+        if not self.dispatched:
+            self.listener.connections_received += 1
         if self.connection.connection_received:
             self.connection.loop.create_task(
                 self.connection.connection_received(self.connection)
@@ -260,3 +425,9 @@ class StreamHandler(asyncio.Protocol):
 
     def connection_lost(self, exc):
         self.connection.transports[0].connection_lost(exc)
+
+    def pause_writing(self):
+        self.connection.transports[0].pause_writing()
+
+    def resume_writing(self):
+        self.connection.transports[0].resume_writing()
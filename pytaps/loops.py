@@ -0,0 +1,333 @@
+import copy
+import os
+import threading
+
+from .eventloop import new_event_loop
+from .listener import Listener
+from .multicast import release_handle
+from .resolver import get_resolver
+from .transports import *
+
+logger = setup_logger(__name__, "yellow")
+
+
+def connection_open(connection):
+    """ Returns whether a connection is being established or is open
+    """
+    if connection.state is ConnectionState.CLOSED:
+        return False
+    if connection.transports and \
+            connection.transports[0].transport is not None:
+        return not connection.transports[0].transport.is_closing()
+    return True
+
+
+def detach_socket(transport):
+    """ Takes the socket away from an asyncio stream transport and returns
+        a duplicate of it, which can be used on another event loop.
+        Must be called from the thread running the transport's loop.
+    """
+    transport.pause_reading()
+    sock = transport.get_extra_info("socket").dup()
+    # The old protocol, e.g., the StreamHandler of a received connection,
+    # must not report the connection as lost when the transport closes
+    transport.set_protocol(asyncio.Protocol())
+    # Closing the transport only closes its own file descriptor,
+    # the connection stays open through the duplicate
+    transport.close()
+    return sock
+
+
+def bind_to_loop(connection, loop):
+    connection.loop = loop
+    connection.resolver = get_resolver(loop)
+
+
+class AdoptedStream(asyncio.Protocol):
+    """ Protocol of a TCP connection that has been handed to another event
+        loop, passes all events on to the connection's new TcpTransport
+    """
+
+    def __init__(self, tcp):
+        self.tcp = tcp
+
+    def connection_made(self, transport):
+        self.tcp.transport = transport
+        self.tcp.apply_write_buffer_limits()
+        # Data carried over may already exceed the receive limit
+        self.tcp.check_receive_limit()
+
+    def eof_received(self):
+        self.tcp.eof_received()
+
+    def data_received(self, data):
+        self.tcp.data_received(data)
+
+    def connection_lost(self, exc):
+        self.tcp.connection_lost(exc)
+
+    def pause_writing(self):
+        self.tcp.pause_writing()
+
+    def resume_writing(self):
+        self.tcp.resume_writing()
+
+
+class LoopPool:
+    """ Runs a number of event loops, each on its own thread, and spreads
+        connections across them. New connections go to the loop with the
+        fewest open connections.
+
+        Connections initiated through the pool run on one of its loops,
+        and so do connections received by a listener started through it,
+        while the listener itself accepts them on the loop it has been
+        started from. The callbacks of these connections are called on
+        the thread of their loop.
+
+    Attributes:
+        size (integer, optional):
+                Number of event loops, the number of CPUs by default.
+        name (string, optional):
+                Prefix of the names of the threads.
+        backend (string, optional):
+                Event loop implementation to use instead of
+                the configured one.
+    """
+
+    def __init__(self, size=None, name="pytaps-loop", backend=None):
+        self.size = size or os.cpu_count() or 1
+        self.name = name
+        self.backend = backend
+        self.loops = []
+        self.threads = []
+        self.lock = threading.Lock()
+        # Open connections per loop
+        self.connections = {}
+        # Connections assigned to a loop that have not arrived there yet
+        self.pending = {}
+        self.dispatched = 0
+        self.handed_off = 0
+
+    def start(self):
+        """ Starts the event loops and returns once all are running.
+        """
+        for index in range(self.size):
+            loop = new_event_loop(self.backend)
+            started = threading.Event()
+            thread = threading.Thread(target=self.run_loop,
+                                      args=(loop, started),
+                                      name=self.name + "-" + str(index),
+                                      daemon=True)
+            thread.start()
+            started.wait()
+            self.loops.append(loop)
+            self.threads.append(thread)
+            self.connections[loop] = set()
+            self.pending[loop] = 0
+        logger.info("Started " + str(self.size) + " event loops.")
+
+    @staticmethod
+    def run_loop(loop, started):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(started.set)
+        loop.run_forever()
+
+    def stop(self, timeout=5):
+        """ Closes the connections of all loops, stops the loops
+            and waits for their threads to end.
+        """
+        for loop in self.loops:
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(self.shutdown(loop), loop)
+        for thread in self.threads:
+            thread.join(timeout)
+        for loop, thread in zip(self.loops, self.threads):
+            if not thread.is_alive():
+                loop.close()
+        self.loops = []
+        self.threads = []
+        self.connections.clear()
+        self.pending.clear()
+        logger.info("Stopped event loops.")
+
+    async def shutdown(self, loop):
+        with self.lock:
+            connections = list(self.connections[loop])
+        for connection in connections:
+            if connection_open(connection) and connection.transports and \
+                    connection.transports[0].transport is not None:
+                connection.transports[0].transport.close()
+        # Let the transports finish closing
+        await asyncio.sleep(0)
+        release_handle(loop)
+        loop.stop()
+
+    def load(self, loop):
+        """ Returns the number of open connections on a loop,
+            including those that are on their way to it.
+        """
+        with self.lock:
+            return self.count(loop)
+
+    def count(self, loop):
+        connections = self.connections[loop]
+        closed = [connection for connection in connections
+                  if not connection_open(connection)]
+        connections.difference_update(closed)
+        return len(connections) + self.pending[loop]
+
+    def assign(self):
+        """ Returns the least loaded loop, which counts the
+            connection about to be sent to it.
+        """
+        with self.lock:
+            loop = min(self.loops, key=self.count)
+            self.pending[loop] += 1
+            self.dispatched += 1
+        return loop
+
+    def register(self, connection, loop):
+        """ Counts a connection that has arrived on the loop
+            it has been assigned to.
+        """
+        with self.lock:
+            if loop in self.pending:
+                self.pending[loop] -= 1
+                self.connections[loop].add(connection)
+
+    def unassign(self, loop):
+        with self.lock:
+            if loop in self.pending:
+                self.pending[loop] -= 1
+
+    def bind(self, preconnection, loop):
+        """ Returns a copy of a Preconnection that uses loop.
+        """
+        bound = copy.copy(preconnection)
+        bound.loop = loop
+        bound.resolver = get_resolver(loop)
+        return bound
+
+    async def initiate(self, preconnection):
+        """ Initiates a Connection from a Preconnection
+            on the least loaded loop and returns it.
+        """
+        loop = self.assign()
+        try:
+            connection = await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(
+                    self.bind(preconnection, loop).initiate(), loop))
+        except BaseException:
+            self.unassign(loop)
+            raise
+        self.register(connection, loop)
+        return connection
+
+    async def listen(self, preconnection):
+        """ Starts a Listener for a Preconnection on the running loop,
+            whose received connections are handed to the pool's loops.
+        """
+        if preconnection.local_endpoint is None:
+            raise Exception("A local endpoint needs "
+                            "to be specified to listen")
+        listener = Listener(preconnection)
+        listener.loop_pool = self
+        await listener.start_listener()
+        return listener
+
+    def dispatch(self, listener, transport):
+        """ Hands a freshly accepted TCP connection from the
+            listener's loop to the least loaded loop.
+        """
+        loop = self.assign()
+        sock = detach_socket(transport)
+        future = asyncio.run_coroutine_threadsafe(
+            self.accept(listener, sock, loop), loop)
+        future.add_done_callback(self.accept_done)
+
+    async def accept(self, listener, sock, loop):
+        try:
+            handler = listener.stream_handler(loop)
+            await loop.connect_accepted_socket(
+                lambda: handler, sock, ssl=listener.security_context)
+        except Exception:
+            self.unassign(loop)
+            sock.close()
+            raise
+        self.register(handler.connection, loop)
+
+    @staticmethod
+    def accept_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Accepting connection failed: " +
+                           str(future.exception()))
+
+    async def hand_off(self, connection, loop):
+        """ Moves an established TCP connection without TLS to another
+            loop. Must be called from the connection's loop, and neither
+            receives nor unsent data may be pending.
+
+        Attributes:
+            connection (Connection, required):
+                Connection to move.
+            loop (eventLoop, required):
+                Loop to move the connection to.
+        """
+        if loop is connection.loop:
+            return
+        old = connection.transports[0] if connection.transports else None
+        if not isinstance(old, TcpTransport) or \
+                connection.state is not ConnectionState.ESTABLISHED:
+            raise Exception("Only established TCP connections "
+                            "can be handed off")
+        if old.transport.get_extra_info("ssl_object") is not None:
+            raise Exception("TLS connections cannot be handed off")
+        if connection.framer:
+            raise Exception("Connections with a framer "
+                            "cannot be handed off")
+        if old.waiters or old.transport.get_write_buffer_size():
+            raise Exception("Connection has pending receives "
+                            "or unsent data")
+        # Issue the sent events of messages that have left the buffer
+        old.report_drained()
+        with self.lock:
+            for connections in self.connections.values():
+                connections.discard(connection)
+            if loop in self.pending:
+                self.pending[loop] += 1
+        # The old transport is no longer part of the connection,
+        # so it does not report losing it
+        connection.transports.remove(old)
+        sock = detach_socket(old.transport)
+        try:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+                self.adopt(connection, sock, old, loop), loop))
+        except BaseException:
+            self.unassign(loop)
+            raise
+        self.register(connection, loop)
+        self.handed_off += 1
+
+    async def adopt(self, connection, sock, old, loop):
+        bind_to_loop(connection, loop)
+        tcp = TcpTransport(connection, old.local_endpoint,
+                           old.remote_endpoint)
+        # Data that has been received but not read yet
+        tcp.recv_buffer = old.recv_buffer
+        tcp.at_eof = old.at_eof
+        tcp.message_count = old.message_count
+        tcp.bytes_written = old.bytes_written
+        tcp.sent_data = old.sent_data
+        tcp.received_data = old.received_data
+        await loop.connect_accepted_socket(lambda: AdoptedStream(tcp), sock)
+
+    def stats(self):
+        """ Returns a dictionary with the load of each loop and the
+            number of dispatched and handed off connections.
+        """
+        return {
+            "loops": len(self.loops),
+            "load": [self.load(loop) for loop in self.loops],
+            "dispatched": self.dispatched,
+            "handed_off": self.handed_off,
+        }
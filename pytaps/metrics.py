@@ -0,0 +1,403 @@
+import weakref
+
+from .utility import *
+
+logger = setup_logger(__name__, "white")
+
+# Default address of the HTTP endpoint for Prometheus to scrape
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_PATH = "/metrics"
+
+# Counters as (attribute, metric name, help text)
+COUNTERS = (
+    ("connections", "connections_total",
+     "Connections created."),
+    ("bytes_sent", "sent_bytes_total",
+     "Bytes handed to the transport."),
+    ("messages_sent", "sent_messages_total",
+     "Messages handed to the transport."),
+    ("bytes_received", "received_bytes_total",
+     "Bytes received from the transport."),
+    ("messages_received", "received_messages_total",
+     "Messages delivered to the application."),
+    ("send_errors", "send_errors_total",
+     "Messages that could not be sent."),
+    ("deframing_failures", "deframing_failures_total",
+     "Data the framer failed to deframe."),
+    ("dropped_messages", "dropped_messages_total",
+     "Datagrams dropped because the receive queue was full."),
+    ("connection_errors", "connection_errors_total",
+     "Connections lost with an error."),
+    ("racing_attempts", "racing_attempts_total",
+     "Connection attempts made while racing candidates."),
+    ("racing_failures", "racing_failures_total",
+     "Connection attempts that failed while racing candidates."),
+)
+# Gauges summed up over open connections, as (metric name, help text)
+GAUGES = (
+    ("open_connections", "Connections that are open."),
+    ("receive_buffer_bytes", "Received bytes not read by the application."),
+    ("send_buffer_bytes", "Bytes in the send buffers of the transports."),
+    ("unsent_messages", "Messages that have not left the send buffer."),
+    ("pending_receives", "Receive calls waiting for data."),
+)
+
+
+class Metrics:
+    """ Counters of a connection, or of all connections of a listener or
+        of the process. Every event is counted on the connection and on
+        all Metrics above it.
+
+        Counting is lock-free, connections running on several threads
+        may lose an increment under contention.
+
+    Attributes:
+        parent (Metrics, optional):
+                Metrics to count all events in as well.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.connections = 0
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.bytes_received = 0
+        self.messages_received = 0
+        self.send_errors = 0
+        self.deframing_failures = 0
+        self.dropped_messages = 0
+        self.connection_errors = 0
+        self.racing_attempts = 0
+        self.racing_failures = 0
+        # Time from starting to race until connected, in seconds
+        self.establishment_time = None
+        self.establishment_seconds = 0.0
+        self.establishments = 0
+
+    def created(self):
+        metrics = self
+        while metrics is not None:
+            metrics.connections += 1
+            metrics = metrics.parent
+
+    def sent(self, messages, length):
+        metrics = self
+        while metrics is not None:
+            metrics.messages_sent += messages
+            metrics.bytes_sent += length
+            metrics = metrics.parent
+
+    def received(self, length):
+        metrics = self
+        while metrics is not None:
+            metrics.bytes_received += length
+            metrics = metrics.parent
+
+    def delivered(self, messages=1):
+        metrics = self
+        while metrics is not None:
+            metrics.messages_received += messages
+            metrics = metrics.parent
+
+    def send_failed(self, messages):
+        metrics = self
+        while metrics is not None:
+            metrics.send_errors += messages
+            metrics = metrics.parent
+
+    def deframing_failed(self):
+        metrics = self
+        while metrics is not None:
+            metrics.deframing_failures += 1
+            metrics = metrics.parent
+
+    def dropped(self, messages):
+        metrics = self
+        while metrics is not None:
+            metrics.dropped_messages += messages
+            metrics = metrics.parent
+
+    def connection_failed(self):
+        metrics = self
+        while metrics is not None:
+            metrics.connection_errors += 1
+            metrics = metrics.parent
+
+    def racing_attempt(self):
+        metrics = self
+        while metrics is not None:
+            metrics.racing_attempts += 1
+            metrics = metrics.parent
+
+    def racing_failure(self):
+        metrics = self
+        while metrics is not None:
+            metrics.racing_failures += 1
+            metrics = metrics.parent
+
+    def established(self, seconds):
+        self.establishment_time = seconds
+        metrics = self
+        while metrics is not None:
+            metrics.establishment_seconds += seconds
+            metrics.establishments += 1
+            metrics = metrics.parent
+
+    def as_dict(self):
+        """ Returns the counters as a dictionary
+        """
+        counters = {attribute: getattr(self, attribute)
+                    for attribute, name, text in COUNTERS}
+        counters["establishment_seconds"] = self.establishment_seconds
+        counters["establishments"] = self.establishments
+        return counters
+
+
+def queue_depths(connection):
+    """ Returns the gauges of one connection
+    """
+    depths = {"open_connections": 0, "receive_buffer_bytes": 0,
+              "send_buffer_bytes": 0, "unsent_messages": 0,
+              "pending_receives": 0}
+    if connection.state is ConnectionState.CLOSED or \
+            not connection.transports:
+        return depths
+    transport = connection.transports[0]
+    if transport.transport is None or transport.transport.is_closing():
+        return depths
+    depths["open_connections"] = 1
+    depths["receive_buffer_bytes"] = transport.buffered_bytes()
+    depths["send_buffer_bytes"] = \
+        transport.transport.get_write_buffer_size()
+    depths["unsent_messages"] = len(transport.unsent)
+    depths["pending_receives"] = len(transport.waiters)
+    return depths
+
+
+class MetricsRegistry:
+    """ Keeps the metrics of the process, and tracks listeners and
+        connections to export their metrics and queue depths.
+    """
+
+    def __init__(self):
+        self.metrics = Metrics()
+        self.listeners = weakref.WeakSet()
+        self.connections = weakref.WeakSet()
+
+    def track_listener(self, listener):
+        self.listeners.add(listener)
+
+    def track_connection(self, connection):
+        self.connections.add(connection)
+        connection.metrics.created()
+
+    def gauges(self):
+        """ Returns the queue depths summed up over the process,
+            and per listener metrics
+        """
+        process = dict.fromkeys(name for name, text in GAUGES)
+        for name in process:
+            process[name] = 0
+        listeners = {}
+        for connection in list(self.connections):
+            depths = queue_depths(connection)
+            parent = connection.metrics.parent
+            if parent is not self.metrics:
+                listener = listeners.setdefault(
+                    parent, dict.fromkeys(process, 0))
+                for name, value in depths.items():
+                    listener[name] += value
+            for name, value in depths.items():
+                process[name] += value
+        return process, listeners
+
+
+# Shared by all Preconnections and Listeners of this process
+metrics_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    """ Returns the metrics registry of this process.
+    """
+    return metrics_registry
+
+
+def listener_label(listener):
+    endpoint = listener.local_endpoint
+    address = endpoint.address
+    if isinstance(address, list):
+        address = ",".join(address)
+    return (str(listener.protocol) + "/" +
+            str(address or endpoint.host_name) + ":" + str(endpoint.port))
+
+
+def connection_label(connection):
+    endpoint = connection.remote_endpoint
+    address = endpoint.address if endpoint else None
+    if isinstance(address, list):
+        address = address[0] if address else None
+    return (str(connection.protocol) + "/" + str(address) + ":" +
+            str(endpoint.port if endpoint else None) + "/" +
+            hex(id(connection)))
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+class MetricsExporter:
+    """ Renders the metrics of a process in the Prometheus text format,
+        and serves them over HTTP or hands them to a callback.
+
+        Process totals are exported as pytaps_*, the metrics of each
+        listener as pytaps_listener_* with a listener label, and, if
+        per_connection is set, those of each connection as
+        pytaps_connection_* with a connection label.
+
+    Attributes:
+        registry (MetricsRegistry, optional):
+                Registry to export, the one of the process by default.
+        per_connection (boolean, optional):
+                Whether to export every connection on its own.
+    """
+
+    def __init__(self, registry=None, per_connection=False):
+        self.registry = registry or metrics_registry
+        self.per_connection = per_connection
+        self.server = None
+        self.reporter = None
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text format.
+        """
+        registry = self.registry
+        process_gauges, listener_gauges = registry.gauges()
+        listeners = [(escape(listener_label(listener)), listener.metrics)
+                     for listener in list(registry.listeners)]
+        connections = []
+        if self.per_connection:
+            connections = [(escape(connection_label(connection)),
+                            connection) for connection in
+                           list(registry.connections)]
+        lines = []
+        for attribute, name, text in COUNTERS:
+            self.family(lines, "pytaps_" + name, "counter", text)
+            lines.append("pytaps_%s %d" % (
+                name, getattr(registry.metrics, attribute)))
+            if listeners:
+                self.family(lines, "pytaps_listener_" + name, "counter",
+                            text)
+                for label, metrics in listeners:
+                    lines.append('pytaps_listener_%s{listener="%s"} %d' % (
+                        name, label, getattr(metrics, attribute)))
+            if connections and attribute != "connections":
+                self.family(lines, "pytaps_connection_" + name, "counter",
+                            text)
+                for label, connection in connections:
+                    lines.append(
+                        'pytaps_connection_%s{connection="%s"} %d' % (
+                            name, label,
+                            getattr(connection.metrics, attribute)))
+        text = "Time from starting to race until connected."
+        self.family(lines, "pytaps_establishment_seconds", "summary", text)
+        lines.append("pytaps_establishment_seconds_sum %f" %
+                     registry.metrics.establishment_seconds)
+        lines.append("pytaps_establishment_seconds_count %d" %
+                     registry.metrics.establishments)
+        for name, text in GAUGES:
+            self.family(lines, "pytaps_" + name, "gauge", text)
+            lines.append("pytaps_%s %d" % (name, process_gauges[name]))
+            if listeners:
+                self.family(lines, "pytaps_listener_" + name, "gauge", text)
+                for listener in list(registry.listeners):
+                    gauges = listener_gauges.get(listener.metrics, {})
+                    lines.append('pytaps_listener_%s{listener="%s"} %d' % (
+                        name, escape(listener_label(listener)),
+                        gauges.get(name, 0)))
+            if connections:
+                self.family(lines, "pytaps_connection_" + name, "gauge",
+                            text)
+                for label, connection in connections:
+                    lines.append(
+                        'pytaps_connection_%s{connection="%s"} %d' % (
+                            name, label, queue_depths(connection)[name]))
+        if connections:
+            text = "Time from starting to race until connected."
+            self.family(lines, "pytaps_connection_establishment_seconds",
+                        "gauge", text)
+            for label, connection in connections:
+                if connection.metrics.establishment_time is not None:
+                    lines.append(
+                        'pytaps_connection_establishment_seconds'
+                        '{connection="%s"} %f' % (
+                            label, connection.metrics.establishment_time))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def family(lines, name, kind, text):
+        lines.append("# HELP " + name + " " + text)
+        lines.append("# TYPE " + name + " " + kind)
+
+    async def serve(self, host=METRICS_HOST, port=METRICS_PORT):
+        """ Serves the metrics over HTTP on the running loop, for
+            Prometheus to scrape from /metrics.
+        """
+        self.server = await asyncio.start_server(self.handle_request,
+                                                 host, port)
+        logger.info("Serving metrics on %s:%s%s", host, port, METRICS_PATH)
+        return self.server
+
+    async def handle_request(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # Skip the headers of the request
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and \
+                    parts[1].split(b"?")[0] == METRICS_PATH.encode():
+                status = "200 OK"
+                body = self.render().encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not found\n"
+            writer.write(("HTTP/1.1 " + status + "\r\n"
+                          "Content-Type: text/plain; version=0.0.4\r\n"
+                          "Content-Length: " + str(len(body)) + "\r\n"
+                          "Connection: close\r\n\r\n").encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def report(self, callback, interval):
+        """ Calls a coroutine with the rendered metrics every
+            interval seconds on the running loop.
+
+        Attributes:
+            callback (callback, required):
+                Coroutine called with the metrics as text.
+            interval (float, required):
+                Seconds between two calls.
+        """
+        async def run():
+            while True:
+                await asyncio.sleep(interval)
+                await callback(self.render())
+        self.reporter = asyncio.get_running_loop().create_task(run())
+        return self.reporter
+
+    def close(self):
+        """ Stops serving and reporting metrics.
+        """
+        if self.server:
+            self.server.close()
+            self.server = None
+        if self.reporter:
+            self.reporter.cancel()
+            self.reporter = None
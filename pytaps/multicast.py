@@ -1,19 +1,18 @@
+import threading
+import weakref
+
 import multicast_glue
 
-global _loop, _libhandle
-_loop = None
-_libhandle = None
+# Library handles by event loop, each loop reads its own sockets
+_libhandles = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
 
 
 def added_sock_cb(loop, handle, fd, do_read):
-    global _libhandle
-    assert (_libhandle is not None)
-
-    # sock = socket.socket(fileno=fd)
     def read_handler(do_read, handle, fd):
-        global _libhandle
-        assert (_libhandle is not None)
-        return multicast_glue.receive_packets(_libhandle, do_read, handle, fd)
+        libhandle = _libhandles.get(loop)
+        assert (libhandle is not None)
+        return multicast_glue.receive_packets(libhandle, do_read, handle, fd)
 
     loop.add_reader(fd, read_handler, do_read, handle, fd)
     return 0
@@ -30,27 +29,40 @@ def got_packet(listener, size, data, port):
     return 0
 
 
+def get_handle(loop):
+    """ Returns the library handle of an event loop,
+        initializing one if necessary
+    """
+    with _lock:
+        libhandle = _libhandles.get(loop)
+        if libhandle is None:
+            libhandle = multicast_glue.initialize(loop, added_sock_cb,
+                                                  removed_sock_cb)
+            assert (libhandle is not None)
+            _libhandles[loop] = libhandle
+        return libhandle
+
+
+def release_handle(loop):
+    """ Cleans up the library handle of an event loop, if it has one.
+        Must be called from the thread running the loop.
+    """
+    with _lock:
+        libhandle = _libhandles.pop(loop, None)
+    if libhandle is not None:
+        multicast_glue.cleanup(libhandle)
+
+
 def do_join(listener):
-    global _loop, _libhandle
-    if _loop is None:
-        if listener.loop is None:
-            raise Exception("joining with no asyncio" +
-                            " loop attached to connection")
-            return False
-        _libhandle = multicast_glue.initialize(listener.loop, added_sock_cb,
-                                               removed_sock_cb)
-        _loop = listener.loop
-        assert (_libhandle is not None)
+    if listener.loop is None:
+        raise Exception("joining with no asyncio" +
+                        " loop attached to connection")
+    libhandle = get_handle(listener.loop)
 
     remote = listener.remote_endpoint.address[0]
     local = listener.local_endpoint.address[0]
 
-    if _loop is not listener.loop:
-        # if we hit this, we need to maintain a dict to keep a separate
-        # libhandle per loop
-        raise Exception("not yet supported: joining with multiple" +
-                        " different asyncio loops")
-    join_ctx = multicast_glue.join(_libhandle, listener,
+    join_ctx = multicast_glue.join(libhandle, listener,
                                    remote,
                                    local,
                                    int(listener.local_endpoint.port),
@@ -0,0 +1,258 @@
+import threading
+from collections import deque
+
+from .utility import *
+
+logger = setup_logger(__name__, "white")
+
+# Default maximum number of idle connections in a pool
+POOL_MAX_IDLE = 64
+# Default maximum number of idle connections to the same destination
+POOL_MAX_PER_DESTINATION = 8
+# Default number of seconds after which an idle connection is closed
+POOL_IDLE_TIMEOUT = 60.0
+
+
+def endpoint_key(endpoint):
+    if endpoint is None:
+        return None
+    address = endpoint.address
+    if endpoint.host_name:
+        # Racing replaces the address with the one it connected to
+        address = None
+    elif isinstance(address, str):
+        address = (address,)
+    else:
+        address = tuple(address)
+    interface = endpoint.interface
+    if interface is not None and not isinstance(interface, str):
+        interface = tuple(interface)
+    return endpoint.host_name, address, endpoint.port, interface
+
+
+def pool_key(preconnection):
+    """ Returns what a pooled connection must have in common with a
+        Preconnection in order to be handed out for it.
+    """
+    security = preconnection.security_parameters
+    if security is not None:
+        security = (security.identity, tuple(security.trustedCA))
+    framer = preconnection.framer
+    return (endpoint_key(preconnection.remote_endpoint),
+            endpoint_key(preconnection.local_endpoint),
+            frozenset(preconnection.transport_properties.properties.items()),
+            security,
+            type(framer) if framer else None,
+            # Connections cannot be used from another event loop
+            preconnection.loop)
+
+
+def call_on_loop(loop, callback, *args):
+    """ Calls back right away if loop is the running event loop,
+        otherwise schedules the callback on the thread running loop
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        callback(*args)
+    else:
+        loop.call_soon_threadsafe(callback, *args)
+
+
+class ConnectionPool:
+    """ Keeps established connections that the application has released,
+        so that a later initiate() of a Preconnection with the same
+        endpoints, transport properties, security parameters and framer
+        gets one of them instead of establishing a new connection.
+
+        A Preconnection uses a pool if one is passed to it. Connections
+        are returned to the pool by Connection.release(). A connection is
+        only kept if it is still established, has no unread data, and
+        the pool has room for it. A pool can be shared by connections on
+        different event loops, e.g., those of a LoopPool, but only hands
+        out connections on the loop they run on.
+
+    Attributes:
+        max_idle (integer, optional):
+                Maximum number of idle connections in the pool.
+        max_per_destination (integer, optional):
+                Maximum number of idle connections kept per
+                combination of endpoints and properties.
+        idle_timeout (float, optional):
+                Seconds after which an idle connection is closed.
+        health_check (callback, optional):
+                Coroutine called with an idle connection before it is
+                handed out, the connection is closed and not handed out
+                if it returns False.
+    """
+
+    def __init__(self, max_idle=POOL_MAX_IDLE,
+                 max_per_destination=POOL_MAX_PER_DESTINATION,
+                 idle_timeout=POOL_IDLE_TIMEOUT, health_check=None):
+        self.max_idle = max_idle
+        self.max_per_destination = max_per_destination
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        # Idle connections by pool key, as (connection, eviction timer)
+        self.idle = {}
+        self.idle_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    async def acquire(self, preconnection):
+        """ Returns an idle connection for the Preconnection and schedules
+            its ready event, or None if there is none.
+        """
+        key = pool_key(preconnection)
+        while True:
+            with self.lock:
+                idle = self.idle.get(key)
+                if not idle:
+                    self.misses += 1
+                    return None
+                connection, timer = idle.pop()
+                self.idle_count -= 1
+            # The key includes the loop, so the timer runs on this one
+            timer.cancel()
+            if not self.usable(connection) or (
+                    self.health_check and
+                    not await self.health_check(connection)):
+                logger.info("Discarding broken idle connection.")
+                self.discard(connection)
+                continue
+            with self.lock:
+                self.hits += 1
+            self.adopt(connection, preconnection)
+            return connection
+
+    def release(self, connection):
+        """ Puts a connection back into the pool. Returns False if it
+            cannot be reused, in which case the caller should close it.
+        """
+        if not self.usable(connection):
+            return False
+        transport = connection.transports[0]
+        with self.lock:
+            idle = self.idle.setdefault(connection.pool_key, deque())
+            if len(idle) >= self.max_per_destination:
+                return False
+            oldest = None
+            if self.idle_count >= self.max_idle:
+                oldest = self.pop_oldest()
+            # Pending reads of the previous user must not
+            # consume data meant for the next one
+            for waiter in transport.waiters:
+                waiter.cancel()
+            self.clear_callbacks(connection)
+            timer = connection.loop.call_later(self.idle_timeout,
+                                               self.expire, connection)
+            idle.append((connection, timer))
+            self.idle_count += 1
+        if oldest is not None:
+            self.evict(*oldest)
+        return True
+
+    def usable(self, connection):
+        """ Returns whether a connection is still open
+            and has no unread data
+        """
+        if connection.state is not ConnectionState.ESTABLISHED or \
+                not connection.transports:
+            return False
+        transport = connection.transports[0]
+        return (transport.transport is not None and
+                not transport.transport.is_closing() and
+                not transport.at_eof and
+                not getattr(connection, "at_eof", False) and
+                # The next user must not get data meant for the previous
+                # one, or sent by the peer while the connection was idle
+                transport.buffered_bytes() == 0)
+
+    @staticmethod
+    def clear_callbacks(connection):
+        connection.received = None
+        connection.received_partial = None
+        connection.receive_error = None
+        connection.sent = None
+        connection.send_error = None
+        connection.expired = None
+        connection.connection_error = None
+        connection.closed = None
+
+    @staticmethod
+    def adopt(connection, preconnection):
+        # Events now go to the callbacks of the new Preconnection
+        connection.ready = preconnection.ready
+        connection.initiate_error = preconnection.initiate_error
+        connection.stopped = preconnection.stopped
+        connection.listen_error = preconnection.listen_error
+        connection.connection_received = preconnection.connection_received
+        if connection.ready:
+            connection.loop.create_task(connection.ready(connection))
+
+    def expire(self, connection):
+        with self.lock:
+            found = next(((idle, entry) for idle in self.idle.values()
+                          for entry in idle if entry[0] is connection), None)
+            if found is None:
+                return
+            idle, entry = found
+            idle.remove(entry)
+            self.idle_count -= 1
+        logger.info("Closing connection that has been idle "
+                    "for " + str(self.idle_timeout) + " s.")
+        self.discard(connection)
+
+    def pop_oldest(self):
+        """ Removes the connection that has been idle the longest and
+            returns it with its timer, or None. Must hold the lock.
+        """
+        oldest = None
+        for idle in self.idle.values():
+            if idle and (oldest is None or idle[0][1].when() <
+                         oldest[0][1].when()):
+                oldest = idle
+        if oldest:
+            self.idle_count -= 1
+            return oldest.popleft()
+        return None
+
+    def evict(self, connection, timer):
+        # The connection may run on another loop
+        call_on_loop(connection.loop, timer.cancel)
+        self.discard(connection)
+
+    def discard(self, connection):
+        with self.lock:
+            self.evicted += 1
+        if connection.state is ConnectionState.ESTABLISHED:
+            call_on_loop(connection.loop, connection.close)
+
+    def close(self):
+        """ Closes all idle connections.
+        """
+        with self.lock:
+            entries = [entry for idle in self.idle.values()
+                       for entry in idle]
+            self.idle.clear()
+            self.idle_count = 0
+        for connection, timer in entries:
+            self.evict(connection, timer)
+
+    def stats(self):
+        """ Returns a dictionary with the number of connections handed
+            out from the pool, of initiate() calls that found no idle
+            connection, of idle connections that have been closed by
+            the pool, and of connections that are currently idle.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "idle": self.idle_count,
+            }
@@ -1,10 +1,15 @@
-import ssl
 from xml.etree.ElementTree import fromstring
 
 from .connection import Connection
 from .endpoint import LocalEndpoint
 from .listener import Listener
+from .metrics import metrics_registry
+from .pool import pool_key
+from .resolver import get_resolver
 from .securityParameters import SecurityParameters
+from .sharding import ShardedListener, sharding_supported
+from .tls import TlsSessionCache, get_security_context
+from .tracing import Tracer, tracer
 from .transportProperties import TransportProperties
 from .transports import *
 from .yang_validate import *
@@ -33,12 +38,21 @@ class Preconnection:
                         Event loop on which all coroutines and callbacks
                         will be scheduled, if none if given the
                         one of the current thread is used by default
+        resolver (Resolver, optional):
+                        Resolver with which to look up host names,
+                        if none is given the one shared by
+                        the event loop is used
+        pool (ConnectionPool, optional):
+                        Pool from which initiate() takes idle
+                        connections and to which released
+                        connections are returned
     """
 
     def __init__(self, local_endpoint=None, remote_endpoint=None,
                  transport_properties=TransportProperties(),
                  security_parameters=None,
-                 event_loop=asyncio.get_event_loop()):
+                 event_loop=None,
+                 resolver=None, pool=None):
 
         # Initializations from arguments
         self.local_endpoint = local_endpoint
@@ -46,7 +60,13 @@ class Preconnection:
         self.transport_properties = transport_properties
         self.security_parameters = security_parameters
 
-        self.loop = event_loop
+        self.loop = event_loop or current_loop()
+        self.resolver = resolver or get_resolver(self.loop)
+        self.pool = pool
+        # Counters that connections of this preconnection count in
+        self.metrics = metrics_registry.metrics
+        # Tracer that connections of this preconnection report to
+        self.tracer = tracer
 
         # Callbacks of the application
         self.read = None
@@ -61,17 +81,13 @@ class Preconnection:
 
         # If security_parameters were given, initialize ssl context
         if self.security_parameters:
-            self.security_context = ssl.create_default_context(
-                ssl.Purpose.SERVER_AUTH)
-            if self.security_parameters.identity:
-                logger.info("Identity: " +
-                            str(self.security_parameters.identity))
-                self.security_context.load_cert_chain(
-                    self.security_parameters.identity)
-            for cert in self.security_parameters.trustedCA:
-                self.security_context.load_verify_locations(cert)
+            self.security_context = get_security_context(
+                self.security_parameters)
         else:
             self.security_context = None
+        # TLS sessions of the connections of this preconnection,
+        # set to None to always do a full handshake
+        self.tls_sessions = TlsSessionCache()
 
     def from_yang(self, frmat, text):
         if frmat == YANG_FMT_XML:
@@ -163,6 +179,8 @@ class Preconnection:
         self.local_endpoint = lp
         self.transport_properties = tp
         self.security_parameters = sp
+        if sp:
+            self.security_context = get_security_context(sp)
         return self
 
     def from_yangfile(self, fname):
@@ -198,19 +216,41 @@ class Preconnection:
                             "to be specified to initiate")
         logger.info("Initiating connection.")
 
+        if self.pool:
+            pooled_connection = await self.pool.acquire(self)
+            if pooled_connection:
+                logger.info("Reusing pooled connection.")
+                return pooled_connection
+
         new_connection = Connection(self)
+        if self.pool:
+            new_connection.pool = self.pool
+            new_connection.pool_key = pool_key(self)
         # Race the candidate sets
         self.loop.create_task(new_connection.race())
         logger.info("Returning connection object.")
         return new_connection
 
-    async def listen(self):
+    async def listen(self, workers=None):
         """ Tries to start a listener, first chooses candidate protocol and
             then tries to establish it with the appropriate asyncio function.
+
+        Attributes:
+            workers (integer, optional):
+                Number of processes to listen with. If more than one,
+                the listener is sharded with SO_REUSEPORT and a
+                ShardedListener is returned once the workers are up.
         """
         if self.local_endpoint is None:
             raise Exception("A local endpoint needs "
                             "to be specified to listen")
+        if workers is not None and workers > 1:
+            if sharding_supported():
+                listener = ShardedListener(self, workers)
+                await listener.start()
+                return listener
+            logger.warn("Sharded listeners are not supported on this "
+                        "platform, listening in this process only.")
         listener = Listener(self)
         # Create start_listener task so we can return right away
         self.loop.create_task(listener.start_listener())
@@ -223,7 +263,7 @@ class Preconnection:
         if self.remote_endpoint is None:
             raise Exception("A remote endpoint needs "
                             "to be specified to resolve")
-        remote_info = await self.loop.getaddrinfo(
+        remote_info = await self.resolver.getaddrinfo(
             self.remote_endpoint.host_name, self.remote_endpoint.port)
         self.remote_endpoint.address = remote_info[0][4][0]
 
@@ -291,6 +331,19 @@ class Preconnection:
         """
         self.stopped = callback
 
+    def on_trace(self, sink):
+        """ Adds a sink for the trace events of all connections
+            initiated or received through this preconnection, i.e.,
+            the timed phases of setting them up and their first bytes.
+
+        Attributes:
+            sink (function, required): Function called with each
+                TraceEvent, must not block.
+        """
+        if self.tracer is tracer:
+            self.tracer = Tracer(tracer)
+        self.tracer.add_sink(sink)
+
     # TODO: Refactor this probably
     def got_mc(self, listener, data, port):
         """ Method that redirects incoming multicast
@@ -310,9 +363,12 @@ class Preconnection:
                                        rp,
                                        listener.transport_properties,
                                        listener.security_parameters,
-                                       listener.loop)
+                                       listener.loop,
+                                       listener.resolver)
                 if listener.framer:
                     precon.add_framer(listener.framer)
+                precon.metrics = listener.metrics
+                precon.tracer = listener.tracer
                 conn = Connection(precon)
                 new_udp = UdpTransport(conn,
                                        conn.local_endpoint,
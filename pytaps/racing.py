@@ -0,0 +1,595 @@
+import ipaddress
+import socket
+import threading
+import time
+from collections import deque
+
+from .transports import *
+
+logger = setup_logger(__name__, "yellow")
+
+# Delays of Happy Eyeballs Version 2 (RFC 8305), in seconds
+# How long to wait for AAAA answers once the A answers have arrived
+RESOLUTION_DELAY = 0.05
+# Delay between connection attempts as long as no RTT has been observed
+CONNECTION_ATTEMPT_DELAY = 0.25
+MIN_CONNECTION_ATTEMPT_DELAY = 0.01
+MAX_CONNECTION_ATTEMPT_DELAY = 2.0
+# How long the racing history remembers a destination, in seconds
+RACING_HISTORY_TTL = 600.0
+# How long a failed candidate is tried last, in seconds
+RACING_FAILURE_TTL = 30.0
+# Maximum number of destinations in the racing history
+RACING_HISTORY_SIZE = 1024
+
+
+def address_family(address):
+    """ Returns the address family of an IPv4 or IPv6 address literal
+    """
+    if ipaddress.ip_address(address.split("%")[0]).version == 6:
+        return socket.AF_INET6
+    return socket.AF_INET
+
+
+class RttEstimator:
+    """ Smoothed estimate of the time it takes to establish a connection,
+        computed like the TCP retransmission timer (RFC 6298). Used to
+        adapt the delay between connection attempts to the network.
+        Samples can be added from several threads.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.lock = threading.Lock()
+
+    def add_sample(self, rtt):
+        """ Adds the duration of a successful connection attempt.
+
+        Attributes:
+            rtt (float, required): Duration in seconds.
+        """
+        with self.lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = (0.75 * self.rttvar +
+                               0.25 * abs(self.srtt - rtt))
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def attempt_delay(self):
+        """ Returns how long to wait for a connection attempt before
+            starting the next one.
+        """
+        with self.lock:
+            if self.srtt is None:
+                return CONNECTION_ATTEMPT_DELAY
+            return min(max(self.srtt + 4 * self.rttvar,
+                           MIN_CONNECTION_ATTEMPT_DELAY),
+                       MAX_CONNECTION_ATTEMPT_DELAY)
+
+
+# Shared by all connections of this process
+rtt_estimator = RttEstimator()
+
+
+class HistoryEntry:
+    """ What is known about racing one protocol to one destination
+    """
+
+    def __init__(self):
+        # Time of the last update
+        self.updated = None
+        # Remote address of the last successful attempt
+        self.winner = None
+        # Time of the last failed attempt, by remote address
+        self.failures = {}
+        # Connection establishment times
+        self.rtt = RttEstimator()
+
+    def as_dict(self):
+        return {
+            "winner": self.winner,
+            "failures": dict(self.failures),
+            "srtt": self.rtt.srtt,
+            "age": time.monotonic() - self.updated,
+        }
+
+
+class RacingHistory:
+    """ Remembers the outcome of previous races per destination, i.e.,
+        per remote host, port, protocol and local interface, so that later
+        races can start with the candidate that won last time and try
+        candidates that failed recently only after all others. The
+        history can be shared by connections on different threads.
+
+    Attributes:
+        ttl (float, optional):
+                Seconds after which a destination that has not been
+                raced again is forgotten.
+        failure_ttl (float, optional):
+                Seconds for which a failed candidate is tried last.
+        max_entries (integer, optional):
+                Maximum number of destinations to remember,
+                the oldest ones are forgotten first.
+    """
+
+    def __init__(self, ttl=RACING_HISTORY_TTL, failure_ttl=RACING_FAILURE_TTL,
+                 max_entries=RACING_HISTORY_SIZE):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.history = {}
+        self.lock = threading.RLock()
+
+    def lookup(self, key):
+        """ Returns the entry for a destination,
+            or None if there is none or it has expired.
+        """
+        with self.lock:
+            entry = self.history.get(key)
+            if entry is not None and \
+                    time.monotonic() - entry.updated > self.ttl:
+                del self.history[key]
+                entry = None
+            return entry
+
+    def update(self, key):
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is None:
+                while len(self.history) >= self.max_entries:
+                    del self.history[next(iter(self.history))]
+                entry = HistoryEntry()
+            else:
+                # Move to the end, so the least recently raced go first
+                del self.history[key]
+            self.history[key] = entry
+            entry.updated = time.monotonic()
+            return entry
+
+    def record_win(self, key, address, rtt=None):
+        with self.lock:
+            entry = self.update(key)
+            entry.winner = address
+            entry.failures.pop(address, None)
+        if rtt is not None:
+            entry.rtt.add_sample(rtt)
+
+    def record_failure(self, key, address):
+        with self.lock:
+            entry = self.update(key)
+            entry.failures[address] = entry.updated
+            if entry.winner == address:
+                entry.winner = None
+
+    def failed_recently(self, key, address):
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is None or address not in entry.failures:
+                return False
+            return (time.monotonic() - entry.failures[address] <
+                    self.failure_ttl)
+
+    def entries(self):
+        """ Returns a dictionary with what is known about each
+            destination, keyed by (remote host, port, protocol,
+            local interfaces).
+        """
+        with self.lock:
+            return dict((key, entry.as_dict())
+                        for key, entry in list(self.history.items())
+                        if self.lookup(key) is not None)
+
+    def flush(self, host=None):
+        """ Forgets all destinations, or only those of one remote host.
+
+        Attributes:
+            host (string, optional): Remote host name or address.
+        """
+        with self.lock:
+            if host is None:
+                self.history.clear()
+                return
+            for key in [key for key in self.history if key[0] == host]:
+                del self.history[key]
+
+
+# Shared by all connections of this process
+racing_history = RacingHistory()
+
+
+def get_racing_history():
+    """ Returns the racing history shared by all connections.
+    """
+    return racing_history
+
+
+class AddressList:
+    """ Remote addresses in the order in which they should be tried.
+        Address families are interleaved, starting with IPv6, while
+        new addresses can still be added as name resolution goes on.
+    """
+
+    def __init__(self, preferred=None):
+        self.addresses = {socket.AF_INET6: deque(), socket.AF_INET: deque()}
+        self.seen = set()
+        self.next_family = socket.AF_INET6
+        # Address to try first once it is known, e.g., the last winner
+        self.preferred = preferred
+        if preferred is not None:
+            self.next_family = address_family(preferred)
+
+    def __len__(self):
+        return sum(len(addresses) for addresses in self.addresses.values())
+
+    def add(self, family, address):
+        if address in self.seen:
+            return
+        self.seen.add(address)
+        if address == self.preferred:
+            self.addresses[family].appendleft(address)
+        else:
+            self.addresses[family].append(address)
+
+    def pop(self):
+        """ Returns the next address family and address to try,
+            or None if there is none left.
+        """
+        family = self.next_family
+        if not self.addresses[family]:
+            family = other_family(family)
+            if not self.addresses[family]:
+                return None
+        self.next_family = other_family(family)
+        return family, self.addresses[family].popleft()
+
+
+def other_family(family):
+    if family == socket.AF_INET6:
+        return socket.AF_INET
+    return socket.AF_INET6
+
+
+class HappyEyeballs:
+    """ Races connection attempts to all candidates of a connection as
+        described by Happy Eyeballs Version 2 (RFC 8305).
+
+        AAAA and A queries are sent in parallel and connection attempts
+        start as soon as the first usable answer arrives. Address families
+        are interleaved, and every protocol candidate is tried for each
+        address. A new attempt starts whenever the previous one failed or
+        did not succeed within the connection attempt delay, which adapts
+        to the observed connection establishment times. The first
+        successful attempt wins and all others are cancelled.
+
+        Outcomes are recorded in the racing history. Protocols and
+        addresses that won the last race to the same destination are
+        tried first, candidates that failed recently are tried last.
+
+    Attributes:
+        connection (Connection, required):
+                Connection to establish.
+        protocols (list, required):
+                Protocol candidates, as returned by create_candidates().
+        local_addresses (dict, optional):
+                Local addresses to bind to, by address family.
+        history (RacingHistory, optional):
+                Racing history to use, the shared one by default.
+    """
+
+    def __init__(self, connection, protocols, local_addresses=None,
+                 history=None):
+        self.connection = connection
+        self.loop = connection.loop
+        self.resolver = connection.resolver
+        self.history = history or racing_history
+        self.local_addresses = local_addresses
+        self.destination = self.destination_of(connection)
+        # Try protocols that won last time first
+        entries = dict((protocol[0], self.history.lookup(
+            self.history_key(protocol[0]))) for protocol in protocols)
+        self.protocols = sorted(
+            [protocol[0] for protocol in protocols],
+            key=lambda name: entries[name] is None or
+            entries[name].winner is None)
+        first = entries.get(self.protocols[0]) if self.protocols else None
+        self.remote_addresses = AddressList(first.winner if first else None)
+        # Use what is known about the destination to time attempts
+        if first is not None and first.rtt.srtt is not None:
+            self.rtt = first.rtt
+        else:
+            self.rtt = rtt_estimator
+        # Candidates of the current address that have not been tried yet
+        self.candidates = deque()
+        # Candidates that failed recently, tried after all others
+        self.deferred = deque()
+        # Running name resolution and connection attempt tasks
+        self.queries = set()
+        self.attempts = set()
+        # Candidates that have created a transport, by transport, as
+        # (protocol, remote address, local address, start, attempt task)
+        self.connecting = {}
+        self.established = False
+        self.wakeup = asyncio.Event()
+        # Set while waiting for addresses, so that arriving addresses
+        # do not cut the connection attempt delay short
+        self.waiting_for_addresses = False
+        self.aaaa_done = None
+        # Time the race started, to measure connection establishment
+        self.started = None
+        # Span of the whole race, if it is traced
+        self.span = None
+
+    async def run(self):
+        """ Races the candidates until one of them is established
+            or all of them have failed.
+        """
+        self.started = self.loop.time()
+        self.span = self.connection.tracer.start(self.connection, "race")
+        remote_endpoint = self.connection.remote_endpoint
+        if remote_endpoint.host_name:
+            self.resolve(remote_endpoint.host_name, remote_endpoint.port)
+        else:
+            addresses = remote_endpoint.address
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            logger.info("Not resolving - using address %s", addresses)
+            for address in addresses:
+                self.remote_addresses.add(address_family(address), address)
+
+        while not self.established:
+            candidate = self.next_candidate()
+            if candidate is None:
+                if not self.queries and not self.attempts:
+                    self.fail()
+                    return
+                # Wait for more addresses or for an attempt to finish
+                self.waiting_for_addresses = True
+                await self.wait()
+                self.waiting_for_addresses = False
+                continue
+            self.start_attempt(*candidate)
+            # Give the attempt a head start, unless it fails earlier
+            delay = self.rtt.attempt_delay()
+            span = self.connection.tracer.start(self.connection,
+                                                "attempt_delay", delay=delay)
+            await self.wait(delay)
+            if span:
+                span.end()
+
+    @staticmethod
+    def destination_of(connection):
+        remote_endpoint = connection.remote_endpoint
+        host = remote_endpoint.host_name
+        if not host:
+            host = remote_endpoint.address
+            if not isinstance(host, str):
+                host = tuple(host)
+        interfaces = None
+        if connection.local_endpoint and connection.local_endpoint.interface:
+            interfaces = connection.local_endpoint.interface
+            if not isinstance(interfaces, str):
+                interfaces = tuple(interfaces)
+        return host, remote_endpoint.port, interfaces
+
+    def history_key(self, protocol):
+        host, port, interfaces = self.destination
+        return host, port, protocol, interfaces
+
+    def next_candidate(self):
+        while not self.candidates:
+            entry = self.remote_addresses.pop()
+            if entry is None:
+                if self.deferred and not self.queries:
+                    return self.deferred.popleft()
+                return None
+            family, remote_address = entry
+            if self.local_addresses is None:
+                local_addresses = [None]
+            else:
+                local_addresses = self.local_addresses.get(family, [])
+            for protocol in self.protocols:
+                if self.history.failed_recently(
+                        self.history_key(protocol), remote_address):
+                    candidates = self.deferred
+                else:
+                    candidates = self.candidates
+                for local_address in local_addresses:
+                    candidates.append(
+                        (protocol, remote_address, local_address))
+        return self.candidates.popleft()
+
+    async def wait(self, timeout=None):
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def resolve(self, host_name, port):
+        """ Starts AAAA and A queries in parallel
+        """
+        self.aaaa_done = self.loop.create_future()
+        for family in (socket.AF_INET6, socket.AF_INET):
+            task = self.loop.create_task(self.query(host_name, port, family))
+            self.queries.add(task)
+
+    async def query(self, host_name, port, family):
+        # FIXME: Unfortunately, asyncio getaddrinfo does not
+        # FIXME: allow to resolve on specific interfaces
+        # FIXME: Consider migrating to something better, e.g., getdns
+        span = self.connection.tracer.start(self.connection, "resolve",
+                                            host=host_name, family=family)
+        try:
+            try:
+                remote_info = await self.resolver.getaddrinfo(
+                    host_name, port, family=family, type=socket.SOCK_STREAM)
+            except Exception as err:
+                # E.g., a UnicodeError for a name that is not valid IDNA
+                logger.info("Resolving %s for family %s failed: %s",
+                            host_name, family, err)
+                remote_info = []
+            if span:
+                span.end(addresses=len(remote_info))
+            if family == socket.AF_INET6:
+                self.aaaa_done.set_result(None)
+            elif not self.aaaa_done.done():
+                # Give the AAAA query a short head start (RFC 8305 Section 3)
+                await asyncio.wait([self.aaaa_done],
+                                   timeout=RESOLUTION_DELAY)
+            addresses = [info[4][0] for info in remote_info]
+            logger.info("Resolved %s to %s", host_name, addresses)
+            for address in addresses:
+                self.remote_addresses.add(family, address)
+        finally:
+            # run() must not wait for a query that has ended
+            self.queries.discard(asyncio.current_task())
+            if self.waiting_for_addresses:
+                self.wakeup.set()
+
+    def start_attempt(self, protocol, remote_address, local_address):
+        if local_address:
+            logger.info("Trying candidate protocol: %s and remote address: "
+                        "%s and local address: %s", protocol, remote_address,
+                        local_address)
+        else:
+            logger.info("Trying candidate protocol: %s and remote address: "
+                        "%s", protocol, remote_address)
+        task = self.loop.create_task(
+            self.attempt(protocol, remote_address, local_address))
+        self.attempts.add(task)
+        self.connection.pending.append(task)
+
+    async def attempt(self, protocol, remote_address, local_address):
+        connection = self.connection
+        port = connection.remote_endpoint.port
+        local_addr = (local_address, None) if local_address else None
+        created = []
+        start = self.loop.time()
+
+        def create_transport(transport_class):
+            new_transport = transport_class(
+                connection=connection,
+                remote_endpoint=connection.remote_endpoint)
+            created.append(new_transport)
+            # The transport asks select() whether it has won the race
+            # once it is connected, including the TLS handshake
+            new_transport.race = self
+            self.connecting[new_transport] = (
+                protocol, remote_address, local_address, start,
+                asyncio.current_task())
+            return new_transport
+
+        security_context = connection.security_context
+        if security_context and connection.tls_sessions is not None:
+            # Resume the last session with this server, if any
+            security_context = connection.tls_sessions.context_for(
+                security_context, connection.remote_endpoint.host_name,
+                remote_address)
+        connection.metrics.racing_attempt()
+        # Spans the TCP handshake and, with TLS, the TLS handshake
+        span = connection.tracer.start(
+            connection, "attempt", protocol=protocol,
+            remote_address=remote_address, local_address=local_address,
+            tls=bool(security_context))
+        try:
+            if protocol == 'tcp':
+                connection.protocol = 'tcp'
+                await self.loop.create_connection(
+                    lambda: create_transport(TcpTransport),
+                    remote_address, port,
+                    ssl=security_context,
+                    server_hostname=(
+                        connection.remote_endpoint.host_name
+                        if connection.security_context else None),
+                    local_addr=local_addr)
+            elif protocol == 'udp':
+                connection.protocol = 'udp'
+                await self.loop.create_datagram_endpoint(
+                    lambda: create_transport(UdpTransport),
+                    remote_addr=(remote_address, port),
+                    local_addr=local_addr)
+            else:
+                logger.warning("Protocol %s is not supported, "
+                               "skipping candidate.", protocol)
+                if span:
+                    span.end(outcome="unsupported")
+                return
+        except asyncio.CancelledError:
+            if span:
+                span.end(outcome="cancelled")
+            self.forget(created)
+            raise
+        except Exception as err:
+            if span:
+                span.end(outcome="failed", error=str(err))
+            logger.info("Connection attempt with %s to %s failed: %s",
+                        protocol, remote_address, err)
+            connection.metrics.racing_failure()
+            self.history.record_failure(self.history_key(protocol),
+                                        remote_address)
+            self.forget(created)
+            return
+        finally:
+            self.attempts.discard(asyncio.current_task())
+            # Go on with the next candidate right away
+            self.wakeup.set()
+        if span:
+            span.end(outcome="connected")
+
+    def forget(self, created):
+        """ Removes the transports of a failed attempt
+        """
+        for failed in created:
+            self.connecting.pop(failed, None)
+            if failed in self.connection.transports:
+                self.connection.transports.remove(failed)
+
+    def select(self, transport):
+        """ Called by the transport of a candidate once it is connected.
+            The first one wins the race and becomes the connection's
+            transport. Returns whether the transport has won.
+        """
+        if self.established:
+            return False
+        protocol, remote_address, local_address, start, task = \
+            self.connecting.pop(transport)
+        connection = self.connection
+        # Candidates that are still connecting close themselves
+        # or get cancelled
+        connection.transports[:] = [transport]
+        connection.remote_endpoint.address = remote_address
+        if local_address:
+            connection.local_endpoint.address = local_address
+        rtt = None
+        if protocol == 'tcp':
+            rtt = self.loop.time() - start
+            rtt_estimator.add_sample(rtt)
+        self.history.record_win(self.history_key(protocol), remote_address,
+                                rtt)
+        self.won(task)
+        return True
+
+    def won(self, winner):
+        """ Stops racing once a candidate has been established,
+            cancelling all attempts but the one of the winner
+        """
+        logger.info("Connection established -- stop racing")
+        self.established = True
+        self.connection.metrics.established(self.loop.time() - self.started)
+        if self.span:
+            self.span.end(outcome="established")
+        self.connecting.clear()
+        for task in self.attempts | self.queries:
+            if task is not winner:
+                task.cancel()
+
+    def fail(self):
+        logger.warning("All candidates failed, giving up.")
+        if self.span:
+            self.span.end(outcome="failed")
+        self.connection.state = ConnectionState.CLOSED
+        if self.connection.initiate_error:
+            self.loop.create_task(self.connection.initiate_error())
@@ -0,0 +1,162 @@
+import socket
+import weakref
+
+from .utility import *
+
+logger = setup_logger(__name__, "grey")
+
+# getaddrinfo does not report the TTL of the records it returns, so cached
+# answers expire after a fixed time, in seconds
+DNS_CACHE_TTL = 60.0
+# How long a failed name resolution is remembered, in seconds
+DNS_NEGATIVE_TTL = 5.0
+# Maximum number of answers to keep in the cache
+DNS_CACHE_SIZE = 1024
+
+
+class Resolver:
+    """ Caching wrapper around the getaddrinfo of an event loop.
+
+        Answers are cached for ttl seconds and failed lookups for
+        negative_ttl seconds. Concurrent lookups of the same name share
+        one getaddrinfo call instead of each occupying a thread of the
+        executor. A lookup that is cancelled does not cancel the shared
+        call, so the answer is still cached for the others.
+
+        The cache holds the answers for all address families and socket
+        types of a host and port, so that lookups of one family or type
+        are answered from what any lookup of the same name has
+        returned. Lookups with flags are not cached.
+
+        By default, all Preconnections on the same event loop share one
+        Resolver, see get_resolver(). A Preconnection can be given its own.
+
+    Attributes:
+        loop (eventLoop, optional):
+                Event loop on which to resolve, the one of the
+                current thread if none is given.
+        ttl (float, optional):
+                Seconds for which answers are cached, 0 disables caching.
+        negative_ttl (float, optional):
+                Seconds for which failed lookups are cached,
+                0 disables negative caching.
+        max_entries (integer, optional):
+                Maximum number of cached answers, the oldest ones
+                are evicted first.
+    """
+
+    def __init__(self, loop=None, ttl=DNS_CACHE_TTL,
+                 negative_ttl=DNS_NEGATIVE_TTL, max_entries=DNS_CACHE_SIZE):
+        self.loop = loop or current_loop()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # Maps host and port to (expiry time, addrinfo list or error)
+        self.cache = {}
+        # Lookups that are currently running, by host and port
+        self.in_flight = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def getaddrinfo(self, host, port, family=0, type=0, proto=0,
+                          flags=0):
+        """ Resolves host and port like loop.getaddrinfo, answering
+            from the cache where possible.
+        """
+        if flags:
+            return await self.loop.getaddrinfo(
+                host, port, family=family, type=type, proto=proto,
+                flags=flags)
+        key = (host, port)
+        entry = self.cache.get(key)
+        if entry is not None:
+            expiry, result = entry
+            if expiry > self.loop.time():
+                if isinstance(result, Exception):
+                    self.negative_hits += 1
+                    raise result
+                self.hits += 1
+                return self.select(result, family, type, proto)
+            del self.cache[key]
+
+        lookup = self.in_flight.get(key)
+        if lookup is None:
+            self.misses += 1
+            lookup = self.loop.create_task(self.lookup(key))
+            self.in_flight[key] = lookup
+        else:
+            self.coalesced += 1
+        return self.select(await asyncio.shield(lookup), family, type, proto)
+
+    @staticmethod
+    def select(result, family, type, proto):
+        """ Returns the answers of a lookup of all families and types
+            that match family, type and proto, where 0 matches any.
+        """
+        answers = [info for info in result
+                   if family in (0, info[0]) and type in (0, info[1]) and
+                   proto in (0, info[2])]
+        if not answers:
+            raise socket.gaierror(socket.EAI_NONAME,
+                                  "No address of the requested family")
+        return answers
+
+    async def lookup(self, key):
+        try:
+            result = await self.loop.getaddrinfo(key[0], key[1])
+        except socket.gaierror as err:
+            self.store(key, err, self.negative_ttl)
+            raise
+        finally:
+            del self.in_flight[key]
+        self.store(key, result, self.ttl)
+        return result
+
+    def store(self, key, result, ttl):
+        if ttl <= 0:
+            return
+        while len(self.cache) >= self.max_entries:
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = (self.loop.time() + ttl, result)
+
+    def flush(self):
+        """ Removes all answers from the cache.
+        """
+        logger.info("Flushing " + str(len(self.cache)) + " cached answers")
+        self.cache.clear()
+
+    def stats(self):
+        """ Returns a dictionary with the number of cache hits, negative
+            cache hits, misses, lookups that joined a running lookup,
+            and cached answers.
+        """
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self.cache),
+        }
+
+
+# Default resolvers, one per event loop
+resolvers = weakref.WeakKeyDictionary()
+
+
+def get_resolver(loop=None):
+    """ Returns the Resolver shared by everything running on loop,
+        creating it if necessary.
+
+    Attributes:
+        loop (eventLoop, optional):
+                Event loop of the Resolver, the one of the
+                current thread if none is given.
+    """
+    loop = loop or current_loop()
+    resolver = resolvers.get(loop)
+    if resolver is None:
+        resolver = Resolver(loop)
+        resolvers[loop] = resolver
+    return resolver
@@ -0,0 +1,251 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+from .eventloop import new_event_loop
+from .listener import Listener
+from .resolver import get_resolver
+from .utility import *
+
+logger = setup_logger(__name__, "cyan")
+
+# Default number of seconds a stopping worker waits for
+# its connections to close before closing them itself
+SHARD_GRACE_PERIOD = 5.0
+# Number of seconds to wait for a worker to report back
+SHARD_REPLY_TIMEOUT = 5.0
+
+
+def sharding_supported():
+    """ Returns whether listeners can be sharded across processes,
+        which requires SO_REUSEPORT and fork()
+    """
+    return hasattr(socket, "SO_REUSEPORT") and \
+        "fork" in multiprocessing.get_all_start_methods()
+
+
+def run_worker(preconnection, index, control):
+    """ Entry point of a worker process, runs a listener for the
+        Preconnection on a new event loop until told to stop.
+    """
+    # Interrupts go to the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    # The event loop and resolver of the parent cannot be used here
+    preconnection.loop = loop
+    preconnection.resolver = get_resolver(loop)
+    listener = Listener(preconnection)
+    listener.reuse_port = True
+    worker = ShardWorker(listener, index, control)
+    try:
+        loop.run_until_complete(worker.run())
+    finally:
+        control.close()
+        loop.close()
+
+
+class ShardWorker:
+    """ Runs the listener of one worker process and answers
+        the requests of the parent.
+
+    Attributes:
+        listener (Listener, required):
+                Listener of this worker.
+        index (integer, required):
+                Number of this worker.
+        control (Connection, required):
+                Worker end of the pipe to the parent.
+    """
+
+    def __init__(self, listener, index, control):
+        self.listener = listener
+        self.loop = listener.loop
+        self.index = index
+        self.control = control
+        self.done = self.loop.create_future()
+
+    async def run(self):
+        await self.listener.start_listener()
+        listening = self.listener.listening()
+        self.control.send(("started", listening))
+        if not listening:
+            return
+        logger.info("Worker " + str(self.index) + " (pid " +
+                    str(os.getpid()) + ") listening.")
+        self.loop.add_reader(self.control.fileno(), self.command_received)
+        try:
+            await self.done
+        finally:
+            self.loop.remove_reader(self.control.fileno())
+
+    def stats(self):
+        stats = self.listener.stats()
+        stats["worker"] = self.index
+        stats["pid"] = os.getpid()
+        return stats
+
+    def command_received(self):
+        try:
+            command = self.control.recv()
+        except (EOFError, OSError):
+            # The parent is gone, nobody is left to stop us
+            command = ("stop", 0)
+        if command[0] == "stats":
+            self.control.send(("stats", self.stats()))
+        elif command[0] == "stop":
+            self.loop.remove_reader(self.control.fileno())
+            self.loop.create_task(self.stop(command[1]))
+
+    async def stop(self, grace_period):
+        self.listener.stop()
+        deadline = self.loop.time() + grace_period
+        while self.listener.open_connections() and \
+                self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.listener.open_connections():
+            logger.info("Worker " + str(self.index) + " closing " +
+                        str(self.listener.open_connections()) +
+                        " connections after grace period.")
+            self.listener.close_connections()
+            # Let the transports finish closing
+            await asyncio.sleep(0)
+        try:
+            self.control.send(("stopped", self.stats()))
+        except OSError:
+            pass
+        self.done.set_result(None)
+
+
+class ShardedListener:
+    """ Listens with several worker processes, each of which binds the
+        local endpoint with SO_REUSEPORT and runs its own listener and
+        event loop, so that the kernel spreads incoming connections and
+        datagrams across them.
+
+        The workers are forked from the calling process and run the
+        callbacks of the Preconnection themselves. The parent only
+        starts them, collects their statistics and stops them.
+
+    Attributes:
+        preconnection (Preconnection, required):
+                Preconnection to listen with, its local endpoint
+                needs a fixed port.
+        workers (integer, required):
+                Number of worker processes.
+    """
+
+    def __init__(self, preconnection, workers):
+        self.preconnection = preconnection
+        self.loop = preconnection.loop
+        self.workers = workers
+        self.processes = []
+        self.controls = []
+        # Statistics the workers reported when they stopped
+        self.final_stats = []
+
+    async def start(self):
+        """ Starts the workers and waits until they are listening.
+            Returns the number of listening workers.
+        """
+        port = self.preconnection.local_endpoint.port
+        if not port:
+            raise Exception("A sharded listener needs a fixed local port")
+        context = multiprocessing.get_context("fork")
+        for index in range(self.workers):
+            control, worker_control = context.Pipe()
+            process = context.Process(
+                target=run_worker,
+                args=(self.preconnection, index, worker_control),
+                name="pytaps-listener-" + str(index), daemon=True)
+            process.start()
+            worker_control.close()
+            self.processes.append(process)
+            self.controls.append(control)
+        replies = await asyncio.gather(*[
+            self.receive(control, SHARD_REPLY_TIMEOUT)
+            for control in self.controls])
+        listening = sum(1 for reply in replies if reply and reply[1])
+        logger.info("Started " + str(listening) + " of " +
+                    str(self.workers) + " listener workers on port " +
+                    str(port) + ".")
+        if listening == 0:
+            await self.stop(0)
+            if self.preconnection.listen_error:
+                self.loop.create_task(self.preconnection.listen_error())
+        return listening
+
+    async def receive(self, control, timeout):
+        """ Waits for the next message of a worker, returns None if
+            there is none within timeout or the worker is gone.
+        """
+        if control.closed:
+            return None
+        readable = self.loop.create_future()
+
+        def wake():
+            if not readable.done():
+                readable.set_result(None)
+        fd = control.fileno()
+        self.loop.add_reader(fd, wake)
+        try:
+            await asyncio.wait_for(readable, timeout)
+            return control.recv()
+        except (asyncio.TimeoutError, EOFError, OSError):
+            return None
+        finally:
+            self.loop.remove_reader(fd)
+
+    async def request(self, control, command, reply, timeout):
+        try:
+            control.send(command)
+        except OSError:
+            return None
+        message = await self.receive(control, timeout)
+        if message is None or message[0] != reply:
+            return None
+        return message[1]
+
+    async def stats(self):
+        """ Returns the statistics of all workers, summed up, with those
+            of each worker under "per_worker".
+        """
+        replies = await asyncio.gather(*[
+            self.request(control, ("stats",), "stats", SHARD_REPLY_TIMEOUT)
+            for control in self.controls if not control.closed])
+        return self.aggregate([reply for reply in replies if reply])
+
+    @staticmethod
+    def aggregate(worker_stats):
+        total = {}
+        for stats in worker_stats:
+            for key, value in stats.items():
+                if key not in ("worker", "pid"):
+                    total[key] = total.get(key, 0) + value
+        total["per_worker"] = worker_stats
+        return total
+
+    async def stop(self, grace_period=SHARD_GRACE_PERIOD):
+        """ Stops all workers. Each one stops listening, waits up to
+            grace_period seconds for its connections to close, closes
+            the remaining ones and exits. Returns the summed up final
+            statistics of the workers.
+        """
+        replies = await asyncio.gather(*[
+            self.request(control, ("stop", grace_period), "stopped",
+                         grace_period + SHARD_REPLY_TIMEOUT)
+            for control in self.controls if not control.closed])
+        self.final_stats = [reply for reply in replies if reply]
+        for control in self.controls:
+            control.close()
+        for process in self.processes:
+            await self.loop.run_in_executor(None, process.join, 1)
+            if process.is_alive():
+                logger.warn("Terminating listener worker " +
+                            str(process.name) + ".")
+                process.terminate()
+                process.join()
+        logger.info("Stopped " + str(len(self.processes)) +
+                    " listener workers.")
+        return self.aggregate(self.final_stats)
@@ -0,0 +1,179 @@
+import os
+import ssl
+import threading
+import time
+
+from .utility import *
+
+logger = setup_logger(__name__, "magenta")
+
+# Maximum number of TLS sessions to keep per cache
+TLS_SESSION_CACHE_SIZE = 256
+
+
+def create_security_context(security_parameters, server_side=False):
+    """ Creates the SSLContext for a set of SecurityParameters, used
+        to initiate connections or, if server_side is set, to accept them.
+    """
+    if server_side:
+        purpose = ssl.Purpose.CLIENT_AUTH
+    else:
+        purpose = ssl.Purpose.SERVER_AUTH
+    context = ssl.create_default_context(purpose)
+    if security_parameters.identity:
+        logger.info("Identity: " + str(security_parameters.identity))
+        context.load_cert_chain(security_parameters.identity)
+    for cert in security_parameters.trustedCA:
+        context.load_verify_locations(cert)
+    return context
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Contexts shared by the whole process, by identity, trusted CAs and
+# purpose, as (modification stamps of the files, context)
+security_contexts = {}
+
+
+def get_security_context(security_parameters, server_side=False):
+    """ Returns an SSLContext for a set of SecurityParameters, creating
+        it only if no context with the same identity, trusted CAs and
+        purpose exists yet, or if one of their files has been modified
+        since.
+    """
+    identity = security_parameters.identity
+    trusted_ca = tuple(security_parameters.trustedCA)
+    key = (identity, trusted_ca, server_side)
+    files = ((identity,) if identity else ()) + trusted_ca
+    stamps = tuple(file_stamp(path) for path in files)
+    entry = security_contexts.get(key)
+    if entry is not None and entry[0] == stamps:
+        return entry[1]
+    if entry is not None:
+        logger.info("Certificates changed, reloading security context.")
+    context = create_security_context(security_parameters, server_side)
+    security_contexts[key] = (stamps, context)
+    return context
+
+
+def flush_security_contexts():
+    """ Forgets all shared contexts, so that certificates
+        are loaded again.
+    """
+    security_contexts.clear()
+
+
+class ResumingContext:
+    """ Wraps an SSLContext so that the TLS connection asyncio creates
+        with it resumes a previous session. Everything except wrap_bio
+        is passed through to the wrapped context.
+
+    Attributes:
+        context (SSLContext, required):
+                Context that created the session.
+        session (SSLSession, required):
+                Session to resume.
+    """
+
+    def __init__(self, context, session):
+        self.context = context
+        self.session = session
+
+    def wrap_bio(self, incoming, outgoing, server_side=False,
+                 server_hostname=None, session=None):
+        return self.context.wrap_bio(
+            incoming, outgoing, server_side=server_side,
+            server_hostname=server_hostname,
+            session=session or self.session)
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+
+class TlsSessionCache:
+    """ Keeps the TLS sessions of a Preconnection's connections,
+        keyed by server name and address, so that later connections
+        to the same server resume a session instead of doing a full
+        handshake. Sessions can only be resumed with the SSLContext
+        that created them. A cache can be shared by connections on
+        different threads, e.g., those of a LoopPool.
+
+    Attributes:
+        max_entries (integer, optional):
+                Maximum number of sessions to keep,
+                the oldest ones are dropped first.
+    """
+
+    def __init__(self, max_entries=TLS_SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.sessions = {}
+        self.resumed = 0
+        self.full_handshakes = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, server_name, address, context=None):
+        """ Returns a session for the server that has not expired yet,
+            and, if context is given, has been created with it, or None.
+        """
+        with self.lock:
+            entry = self.sessions.get((server_name, address))
+            if entry is None:
+                return None
+            session_context, session = entry
+            if session.time + session.timeout <= time.time() or (
+                    context is not None and session_context is not context):
+                del self.sessions[(server_name, address)]
+                return None
+            return session
+
+    def context_for(self, context, server_name, address):
+        """ Returns the context with which to connect to the server,
+            which resumes a cached session if there is one.
+        """
+        session = self.lookup(server_name, address, context)
+        if session is None:
+            return context
+        return ResumingContext(context, session)
+
+    def store(self, server_name, address, ssl_object):
+        """ Keeps the session of an established TLS connection
+            and counts whether it has been resumed.
+        """
+        session = ssl_object.session
+        if session is None:
+            return
+        key = (server_name, address)
+        with self.lock:
+            self.sessions.pop(key, None)
+            while len(self.sessions) >= self.max_entries:
+                del self.sessions[next(iter(self.sessions))]
+            self.sessions[key] = (ssl_object.context, session)
+
+    def count(self, ssl_object):
+        with self.lock:
+            if ssl_object.session_reused:
+                self.resumed += 1
+            else:
+                self.full_handshakes += 1
+
+    def flush(self):
+        """ Drops all sessions.
+        """
+        with self.lock:
+            self.sessions.clear()
+
+    def stats(self):
+        """ Returns a dictionary with the number of resumed sessions,
+            of full handshakes, and of cached sessions.
+        """
+        return {
+            "resumed": self.resumed,
+            "full_handshakes": self.full_handshakes,
+            "entries": len(self.sessions),
+        }
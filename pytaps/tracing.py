@@ -0,0 +1,160 @@
+import time
+
+from .utility import *
+
+logger = setup_logger(__name__, "white")
+
+
+class TraceEvent:
+    """ A phase of a connection's lifecycle, or a single point in it.
+        Timestamps are nanoseconds of the monotonic clock.
+
+    Attributes:
+        connection (Connection):
+                Connection the event belongs to.
+        name (string):
+                Name of the phase, e.g., "resolve" or "attempt".
+        start (integer):
+                Time the phase started, or the event happened.
+        end (integer):
+                Time the phase ended, None for single points.
+        attributes (dict):
+                Details of the phase, e.g., protocol and address.
+    """
+
+    def __init__(self, connection, name, start, end=None, attributes=None):
+        self.connection = connection
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attributes = attributes or {}
+
+    @property
+    def duration(self):
+        """ Duration of the phase in nanoseconds, 0 for single points
+        """
+        if self.end is None:
+            return 0
+        return self.end - self.start
+
+    def __repr__(self):
+        return ("TraceEvent(" + self.name + ", " +
+                str(self.duration / 1e6) + " ms, " +
+                str(self.attributes) + ")")
+
+
+class Span:
+    """ A phase that has started and is reported to the sinks once
+        it ends.
+    """
+
+    def __init__(self, tracer, connection, name, attributes):
+        self.tracer = tracer
+        self.event = TraceEvent(connection, name, time.monotonic_ns(),
+                                attributes=attributes)
+
+    def end(self, **attributes):
+        if self.event.end is not None:
+            return
+        self.event.end = time.monotonic_ns()
+        self.event.attributes.update(attributes)
+        self.tracer.emit(self.event)
+
+
+class Tracer:
+    """ Hands trace events of connections to sinks. A sink is a plain
+        function called with each TraceEvent, it must not block.
+        Events also go to the sinks of the parent tracer. Without any
+        sinks, start() and event() return right away.
+
+    Attributes:
+        parent (Tracer, optional):
+                Tracer whose sinks get the events as well.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.sinks = []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    @property
+    def enabled(self):
+        tracer = self
+        while tracer is not None:
+            if tracer.sinks:
+                return True
+            tracer = tracer.parent
+        return False
+
+    def start(self, connection, name, **attributes):
+        """ Starts a phase and returns its Span,
+            or None if nobody listens.
+        """
+        if not self.enabled:
+            return None
+        return Span(self, connection, name, attributes)
+
+    def event(self, connection, name, **attributes):
+        """ Reports a single point in the lifecycle of a connection.
+        """
+        if not self.enabled:
+            return
+        self.emit(TraceEvent(connection, name, time.monotonic_ns(),
+                             attributes=attributes))
+
+    def emit(self, event):
+        tracer = self
+        while tracer is not None:
+            for sink in tracer.sinks:
+                try:
+                    sink(event)
+                except Exception as err:
+                    logger.warning("Trace sink failed: " + str(err))
+            tracer = tracer.parent
+
+
+# Shared by all Preconnections and Listeners of this process
+tracer = Tracer()
+
+
+def get_tracer():
+    """ Returns the tracer of this process,
+        whose sinks get the events of all connections.
+    """
+    return tracer
+
+
+class TraceRecorder:
+    """ Sink that keeps all events, e.g., to look at where the time
+        to set up a connection went.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def durations(self, connection=None):
+        """ Returns the summed up duration of each phase in seconds,
+            of one connection or of all.
+        """
+        durations = {}
+        for event in self.events:
+            if connection is None or event.connection is connection:
+                durations[event.name] = durations.get(event.name, 0) + \
+                    event.duration / 1e9
+        return durations
+
+
+def log_sink(event):
+    """ Sink that logs every event at INFO level.
+    """
+    logger.info("%s %s %.3f ms %s", hex(id(event.connection)), event.name,
+                event.duration / 1e6, event.attributes)
@@ -1,5 +1,7 @@
+import functools
 import json
 from enum import Enum
+from types import MappingProxyType
 
 
 class PreferenceLevel(Enum):
@@ -10,9 +12,15 @@ class PreferenceLevel(Enum):
     PROHIBIT = -2
 
 
+class DropPolicy(Enum):
+    DROP_OLDEST = 0
+    DROP_NEWEST = 1
+    PAUSE_READING = 2
+
+
 # TODO: Is this accurate? What properties
 #       are actually supported by this implementation
-def get_protocols():
+def parse_protocols():
     protocols = []
     tcp = """{
         "name": "tcp",
@@ -129,6 +137,64 @@ def get_protocols():
     return protocols
 
 
+# The protocol table is parsed once and cannot be modified afterwards
+PROTOCOLS = tuple(MappingProxyType(protocol) for protocol in parse_protocols())
+# For each property, the names of the protocols that have it and
+# of those that do not have it. Protocols for which a property is
+# optional are in neither set.
+PROTOCOLS_WITH = MappingProxyType({
+    prop: frozenset(protocol["name"] for protocol in PROTOCOLS
+                    if protocol[prop] is True)
+    for prop in PROTOCOLS[0] if prop != "name"})
+PROTOCOLS_WITHOUT = MappingProxyType({
+    prop: frozenset(protocol["name"] for protocol in PROTOCOLS
+                    if protocol[prop] is False)
+    for prop in PROTOCOLS[0] if prop != "name"})
+
+
+def get_protocols():
+    """ Returns the protocols known to the implementation
+        and their properties.
+    """
+    return PROTOCOLS
+
+
+@functools.lru_cache(maxsize=256)
+def rank_protocols(preferences):
+    """ Decides which protocols are candidates for a set of preferences,
+        as returned by TransportProperties.snapshot(), and orders them
+        according to the TAPS interface draft. Returns a tuple of
+        (name, (number of PREFERs, -number of AVOIDs)) tuples.
+        Results are cached, as the same preferences are used over and over.
+    """
+    empty = frozenset()
+    # At the beginning, all protocols are candidates
+    candidates = set(protocol["name"] for protocol in PROTOCOLS)
+    prefers = dict.fromkeys(candidates, 0)
+    avoids = dict.fromkeys(candidates, 0)
+    for prop, level in preferences:
+        # If a protocol has a prohibited property remove it
+        if level is PreferenceLevel.PROHIBIT:
+            candidates -= PROTOCOLS_WITH.get(prop, empty)
+        # If a protocol doesnt have a required property remove it
+        elif level is PreferenceLevel.REQUIRE:
+            candidates -= PROTOCOLS_WITHOUT.get(prop, empty)
+        # Count how many PREFER and AVOID properties each protocol has
+        elif level is PreferenceLevel.PREFER:
+            for name in PROTOCOLS_WITH.get(prop, empty):
+                prefers[name] += 1
+        elif level is PreferenceLevel.AVOID:
+            for name in PROTOCOLS_WITH.get(prop, empty):
+                avoids[name] -= 1
+
+    # Sort candidates by number of PREFERs and then by AVOIDs on ties,
+    # keeping the order of the protocol table otherwise
+    ranked = [(protocol["name"], (prefers[protocol["name"]],
+                                  avoids[protocol["name"]]))
+              for protocol in PROTOCOLS if protocol["name"] in candidates]
+    return tuple(sorted(ranked, key=lambda value: value[1], reverse=True))
+
+
 class TransportProperties:
     """ Class to handle the TAPS transport properties.
 
@@ -148,7 +214,13 @@ class TransportProperties:
             "multipath": PreferenceLevel.PREFER,
             "direction": "bidirectional",
             "retransmit-notify": PreferenceLevel.IGNORE,
-            "soft-error-notify": PreferenceLevel.IGNORE
+            "soft-error-notify": PreferenceLevel.IGNORE,
+            "recv-queue-capacity": 1024,
+            "recv-queue-drop-policy": DropPolicy.DROP_OLDEST,
+            "recv-buffer-limit": None,
+            "send-buffer-high-water": None,
+            "send-buffer-low-water": None,
+            "recv-batch-size": 64
         }
 
     def add(self, prop, value):
@@ -206,6 +278,15 @@ class TransportProperties:
         """
         self.properties[prop] = PreferenceLevel.PROHIBIT
 
+    def snapshot(self):
+        """ Returns a hashable copy of the preferences that take part
+            in protocol selection. Changing the properties afterwards
+            does not change the snapshot.
+        """
+        return frozenset((prop, value)
+                         for prop, value in self.properties.items()
+                         if isinstance(value, PreferenceLevel))
+
     def default(self, prop):
         """ Sets the property prop back to its default value.
 
@@ -225,6 +306,12 @@ class TransportProperties:
             "multipath": PreferenceLevel.PREFER,
             "direction": "Bidirectional",
             "retransmit-notify": PreferenceLevel.IGNORE,
-            "soft-error-notify": PreferenceLevel.IGNORE
+            "soft-error-notify": PreferenceLevel.IGNORE,
+            "recv-queue-capacity": 1024,
+            "recv-queue-drop-policy": DropPolicy.DROP_OLDEST,
+            "recv-buffer-limit": None,
+            "send-buffer-high-water": None,
+            "send-buffer-low-water": None,
+            "recv-batch-size": 64
         }
         self.properties[prop] = defaults.get(prop)
@@ -1,7 +1,15 @@
+from collections import deque
+
+from .buffers import ReceiveBuffer, DatagramQueue, RECV_QUEUE_CAPACITY
+from .datagram import BatchedDatagramReader, BatchedDatagramSender, \
+    ICMP_ERRORS, RECV_BATCH_SIZE
 from .endpoint import RemoteEndpoint
 from .framer import *
+from .transportProperties import DropPolicy
 
 logger = setup_logger(__name__, "blue")
+# Records of events that happen for every message
+packet_log = HotPath(logger)
 
 
 class MessageContext(object):
@@ -28,21 +36,55 @@ class TransportLayer(asyncio.Protocol):
         self.connection = connection
         self.loop = connection.loop
         self.connection.transports.append(self)
+        # Counters of the connection, and of its listener and process
+        self.metrics = connection.metrics
         self.waiters = []
         self.open_receives = 0
         # Keeping track of how many messages have been sent for msgref
         self.message_count = 0
-        # Determines if the protocol is message based or not (needed?)
+        # Determines if the protocol is message based or not
         self.message_based = True
         # Reception buffer, holding data returned from the OS
         self.recv_buffer = None
         # Boolean to indicate that EOF has been reached
         self.at_eof = False
+        # Boolean to indicate that reading from the socket has been paused
+        self.reading_paused = False
+        # Reader taking over from asyncio, if the transport reads in batches
+        self.reader = None
+        # Number of buffered bytes at which reading gets paused
+        self.recv_limit = connection.transport_properties.properties.get(
+            "recv-buffer-limit")
+        # Number of bytes of deframed messages that have not been read yet
+        self.framed_bytes = 0
+        # Buffered bytes each waiting reader needs before it returns
+        self.wanted = []
+        # Boolean to indicate that the transport asked to stop writing
+        self.writing_paused = False
+        # Futures of senders waiting for writing to be resumed
+        self.drain_waiters = []
+        # Total number of bytes handed to the transport
+        self.bytes_written = 0
+        # Messages still in the send buffer, as (end offset, message ref)
+        self.unsent = deque()
+        # Write buffer limits as (low, high) while they are lowered to
+        # learn when the send buffer is empty, None otherwise
+        self.flush_watch = None
+        # Whether data has been sent or received yet, for tracing
+        self.sent_data = False
+        self.received_data = False
+        # HappyEyeballs race this transport is a candidate of, if any
+        self.race = None
 
         # If we have a framer, create a buffer for deframed messages
         if connection.framer:
-            self.active_framer = None
-            self.framer_buffer = []
+            self.framer_buffer = deque()
+            # Synchronous framers are called inline, without a task
+            self.sync_framer = isinstance(connection.framer, SyncFramer)
+            # Task running the deframing loop, if any
+            self.deframing = None
+            # Set if new data arrived while the deframing loop is running
+            self.deframe_again = False
 
         self.transport = None
 
@@ -57,67 +99,325 @@ class TransportLayer(asyncio.Protocol):
         finally:
             del self.waiters[0]
 
-    """ Function that blocks until a framer has finished deframing
+    def receive_closed(self):
+        """ Returns whether no more data will arrive, as the connection
+            has been closed or the peer has finished sending
+        """
+        return (self.connection.state is ConnectionState.CLOSED or
+                getattr(self.connection, "at_eof", False))
+
+    def wake_all_waiters(self):
+        self.wake_waiters(len(self.waiters))
+
+    def wake_waiters(self, count=1):
+        """ Wakes up to count readers waiting for new data
+        """
+        for w in self.waiters:
+            if count == 0:
+                return
+            if not w.done():
+                w.set_result(None)
+                count -= 1
+
+    def schedule_deframing(self):
+        """ Makes sure newly arrived data gets deframed. If the framer
+            is already busy, the running deframing loop picks it up.
+        """
+        if self.sync_framer:
+            self.deframe_inline()
+        elif self.deframing is None:
+            self.deframing = self.loop.create_task(self.deframe())
+        else:
+            self.deframe_again = True
+
+    """ Invokes the framer to deframe as many messages as possible from
+        the reception buffer and delivers them as one batch
     """
 
-    async def await_framer(self):
-        self.active_framer = self.loop.create_future()
+    async def deframe(self):
+        batch = []
         try:
-            await self.active_framer
+            while len(self.recv_buffer) > 0:
+                self.deframe_again = False
+                # Try to call the deframing function implemented
+                # by the individual framer
+                try:
+                    ctx, msg, length, eom = await \
+                        self.connection.framer.handle_received_data(
+                            self.connection)
+                except (DeframingFailed, ValueError, TypeError):
+                    # Try again if data arrived while deframing, otherwise
+                    # wait until new data arrives
+                    if self.deframing_failed() or self.deframe_again:
+                        continue
+                    break
+                # If a message was deframed successful, modify the recv
+                # buffer, add the message to the batch
+                self.advance_receive_cursor(length)
+                batch.append((msg, length))
+                self.framed_bytes += length
         finally:
-            self.active_framer = None
+            self.deframing = None
+            self.framer_buffer.extend(batch)
+            self.wake_waiters(len(batch))
+            self.check_deframed_limit()
 
-    """ Invokes the framer to deframe newly arrived data
-    """
+    def deframe_inline(self):
+        """ Deframes all complete messages right away using
+            the deframe() function of a SyncFramer
+        """
+        framer = self.connection.framer
+        count = 0
+        while len(self.recv_buffer) > 0:
+            try:
+                ctx, msg, length, eom = framer.deframe(self.connection)
+            except (DeframingFailed, ValueError, TypeError):
+                if self.deframing_failed():
+                    continue
+                break
+            self.advance_receive_cursor(length)
+            self.framer_buffer.append((msg, length))
+            self.framed_bytes += length
+            count += 1
+        self.wake_waiters(count)
+        self.check_deframed_limit()
 
-    async def invoke_framer(self):
-        # If there is already another deframing in progress,
-        #  wait for it to complete
-        if self.active_framer:
-            await self.active_framer
-        self.active_framer = self.loop.create_future()
-        # Try to call the deframing function implemented
-        # by the individual framer
-        try:
-            ctx, msg, length, eom = await \
-                self.connection.framer.handle_received_data(self.connection)
-        except (DeframingFailed, ValueError, TypeError):
-            # If the framer throws an DeframingFailed Error, stop trying
-            # to deframe until new data arrives
-            self.active_framer.set_result(None)
-            self.active_framer = None
-            return
-        # If a message was deframed successful, modify the recv buffer,
-        #  add the message to the framer buffer
+    def deframing_failed(self):
+        """ Handles a framer failing to deframe the head of the buffer,
+            returns True if deframing should go on with the next message
+        """
+        if not self.message_based:
+            return False
+        self.metrics.deframing_failed()
+        # A datagram does not become more complete later, so discard it
+        logger.warning("Discarding datagram that could not be deframed.")
+        self.advance_receive_cursor(0)
+        return True
+
+    def parse(self, min_incomplete_length=0, max_length=0):
+        """ Returns the reception buffer for a framer to deframe.
+        """
+        return self.recv_buffer, None, False
+
+    def advance_receive_cursor(self, length):
+        """ Discards length bytes that have been deframed
+            from the reception buffer.
+        """
         self.recv_buffer = self.recv_buffer[length:]
-        self.framer_buffer.append(msg)
-        self.active_framer.set_result(None)
-        self.active_framer = None
-        for w in self.waiters:
-            if not w.done():
-                w.set_result(None)
-                return
-        # Since there might be another message that is able to be deframed,
-        #  invoke the framer again
-        self.loop.create_task(self.invoke_framer())
+
+    def next_deframed(self):
+        """ Removes and returns the oldest deframed message
+        """
+        data, length = self.framer_buffer.popleft()
+        self.framed_bytes -= length
+        self.check_resume_receiving()
+        return data
+
+    def buffered_bytes(self):
+        """ Returns the number of received bytes that have not
+            been read by the application yet
+        """
+        return self.framed_bytes
+
+    def can_deliver(self):
+        """ Returns whether the application can consume buffered data
+            without more data arriving first, i.e., whether pausing
+            reading cannot keep a message from being completed
+        """
+        if self.message_based:
+            return True
+        if self.connection.framer:
+            # The rest of the buffer may be the start of a large message
+            return self.framed_bytes > 0
+        return not self.wanted or len(self.recv_buffer) >= max(self.wanted)
+
+    def check_receive_limit(self):
+        """ Pauses reading once the receive buffers hold
+            recv-buffer-limit bytes or more, unless the
+            application is waiting for more data than that
+        """
+        if (self.recv_limit is not None and
+                self.buffered_bytes() >= self.recv_limit and
+                self.can_deliver()):
+            self.pause_receiving()
+
+    def check_deframed_limit(self):
+        # Deframing makes data deliverable, so reading may have to be
+        # paused now. Sockets of message based transports may be shared
+        # with a listener, they are only paused when data arrives.
+        if not self.message_based:
+            self.check_receive_limit()
+
+    def check_resume_receiving(self):
+        """ Resumes reading once the application has consumed
+            at least half of the buffered data, or needs more
+            data than is buffered
+        """
+        if self.reading_paused and (
+                self.recv_limit is None or
+                self.buffered_bytes() <= self.recv_limit // 2 or
+                not self.can_deliver()):
+            self.resume_receiving()
+
+    def pause_receiving(self):
+        """ Stops reading from the underlying socket until
+            resume_receiving() is called.
+        """
+        if self.reading_paused or self.transport is None:
+            return
+        logger.info("Pausing reading from transport.")
+        if self.reader:
+            self.reader.pause()
+        else:
+            self.transport.pause_reading()
+        self.reading_paused = True
+
+    def resume_receiving(self):
+        if not self.reading_paused:
+            return
+        logger.info("Resuming reading from transport.")
+        if self.reader:
+            self.reader.resume()
+        else:
+            self.transport.resume_reading()
+        self.reading_paused = False
+
+    def apply_write_buffer_limits(self):
+        """ Sets the high and low water marks of the send buffer
+            from the transport properties of the connection.
+        """
+        properties = self.connection.transport_properties.properties
+        high = properties.get("send-buffer-high-water")
+        low = properties.get("send-buffer-low-water")
+        if high is not None or low is not None:
+            self.set_write_buffer_limits(high, low)
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        """ Sets the high and low water marks of the send buffer,
+            keeping them lowered while waiting for it to empty.
+        """
+        self.transport.set_write_buffer_limits(high, low)
+        if self.flush_watch is not None:
+            self.flush_watch = self.transport.get_write_buffer_limits()
+            self.transport.set_write_buffer_limits(0, 0)
+
+    def watch_flush(self):
+        """ Makes asyncio call resume_writing() once the send buffer is
+            empty. It only does so after calling pause_writing(), which
+            happens above the high water mark, so both water marks are
+            lowered to zero until then.
+        """
+        self.flush_watch = self.transport.get_write_buffer_limits()
+        self.transport.set_write_buffer_limits(0, 0)
+
+    def end_flush_watch(self):
+        if self.flush_watch is None:
+            return
+        low, high = self.flush_watch
+        self.flush_watch = None
+        self.transport.set_write_buffer_limits(high, low)
+
+    async def drain(self):
+        """ Function that blocks while writing to the
+            transport is paused
+        """
+        while self.writing_paused:
+            waiter = self.loop.create_future()
+            self.drain_waiters.append(waiter)
+            await waiter
+
+    def wake_drain_waiters(self):
+        for waiter in self.drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.drain_waiters.clear()
+
+    def report_drained(self):
+        """ Issues sent events for all messages that have left the
+            send buffer of the transport.
+        """
+        buffered = self.transport.get_write_buffer_size()
+        flushed = self.bytes_written - buffered
+        while self.unsent and self.unsent[0][0] <= flushed:
+            end, message_ref = self.unsent.popleft()
+            if self.connection.sent:
+                self.loop.create_task(
+                    self.connection.sent(message_ref, self.connection)
+                )
+        if not self.unsent or self.writing_paused:
+            # resume_writing() reports the rest
+            return
+        if self.flush_watch is None:
+            # Have resume_writing() called once the rest has been sent
+            self.watch_flush()
+        elif not self.writing_paused and buffered > self.flush_watch[1]:
+            # asyncio does not pause writing again while the water marks
+            # are lowered, so apply the real high water mark here and
+            # have writing resumed below the real low water mark
+            self.end_flush_watch()
+            self.pause_writing()
 
     def send(self, data):
         """ Function responsible for sending data.
         """
-        self.message_count += 1
+        message_refs = self.send_batch([data])
+        if message_refs:
+            return message_refs[0]
+
+    def send_batch(self, messages):
+        """ Function responsible for sending a batch of messages with as
+            few writes as possible. Returns the message references.
+        """
+        first_ref = self.message_count + 1
+        self.message_count += len(messages)
         if self.connection.state is not ConnectionState.ESTABLISHED:
             logger.warn("SendError occurred, connection is not established.")
-            if self.connection.send_error:
-                self.loop.create_task(
-                    self.connection.send_error(self.message_count, self.connection)
-                )
+            self.report_send_error(first_ref, len(messages))
             return
-        self.loop.create_task(self.write(data))
-        return self.message_count
+        if self.connection.framer and not self.sync_framer:
+            # Asynchronous framers have to be awaited within a task
+            self.loop.create_task(self.write(messages, first_ref))
+        else:
+            self.transmit(self.frame_batch(messages), first_ref)
+        return list(range(first_ref, self.message_count + 1))
+
+    def frame_batch(self, messages):
+        """ Frames messages inline if there is a synchronous framer
+        """
+        if self.connection.framer:
+            frame = self.connection.framer.frame
+            return [frame(data, None, False) for data in messages]
+        return messages
 
-    async def write(self, data):
+    async def write(self, messages, first_ref):
+        """ Frames messages with an asynchronous framer, then
+            transmits them
+        """
+        framer = self.connection.framer
+        framed = []
+        for data in messages:
+            framed.append(
+                await framer.handle_new_sent_message(data, None, False))
+        self.transmit(framed, first_ref)
+
+    def transmit(self, messages, first_ref):
         pass
 
+    def report_sent(self, first_ref, count):
+        if self.connection.sent:
+            for message_ref in range(first_ref, first_ref + count):
+                self.loop.create_task(
+                    self.connection.sent(message_ref, self.connection)
+                )
+
+    def report_send_error(self, first_ref, count):
+        self.metrics.send_failed(count)
+        if self.connection.send_error:
+            for message_ref in range(first_ref, first_ref + count):
+                self.loop.create_task(
+                    self.connection.send_error(message_ref, self.connection)
+                )
+
     def receive(self, min_incomplete_length, max_length):
         """if self.connection.framer:
             self.loop.create_task(self.read_framed(min_incomplete_length,
@@ -130,6 +430,13 @@ class TransportLayer(asyncio.Protocol):
                    max_length):
         pass
 
+    async def next_message(self, min_incomplete_length=1, max_length=-1):
+        """ Waits for the next message and returns it as a tuple of
+            data, context and end of message, or None if no more data
+            will arrive. Does not schedule any tasks.
+        """
+        pass
+
     async def close(self):
         pass
 
@@ -139,6 +446,8 @@ class TransportLayer(asyncio.Protocol):
     def eof_received(self):
         logger.info("EOF received")
         self.connection.at_eof = True
+        # Readers waiting for more data get what is left
+        self.wake_all_waiters()
 
     """ ASYNCIO function that gets called when the connection has
         an error.
@@ -148,32 +457,112 @@ class TransportLayer(asyncio.Protocol):
     def error_received(self, err):
         if type(err) is ConnectionRefusedError:
             logger.warn("Connection Error occurred.")
+            self.metrics.connection_failed()
             if self.connection.connection_error:
                 self.loop.create_task(
                     self.connection.connection_error(err, self.connection)
                 )
             return
 
+    """ ASYNCIO function that gets called when the send buffer
+        of the transport exceeds its high water mark
+    """
+
+    def pause_writing(self):
+        if (self.flush_watch is not None and
+                self.transport.get_write_buffer_size() <= self.flush_watch[1]):
+            # Only paused to learn when the send buffer is empty
+            return
+        logger.info("Pausing writing, send buffer is full.")
+        self.writing_paused = True
+
+    """ ASYNCIO function that gets called when the send buffer
+        of the transport drops below its low water mark
+    """
+
+    def resume_writing(self):
+        self.end_flush_watch()
+        if self.writing_paused:
+            logger.info("Resuming writing.")
+            self.writing_paused = False
+            self.wake_drain_waiters()
+        self.report_drained()
+
+    def store_tls_session(self):
+        """ Keeps the TLS session of an active connection, so that
+            later connections to the same server can resume it
+        """
+        if (self.transport is None or not self.connection.active or
+                self.connection.tls_sessions is None):
+            return
+        ssl_object = self.transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            self.connection.tls_sessions.store(
+                self.connection.remote_endpoint.host_name,
+                self.connection.remote_endpoint.address, ssl_object)
+
     """ ASYNCIO function that gets called when the connection
         is lost
     """
 
     def connection_lost(self, exc):
+        # Ignore candidates that lost the race
+        if self not in self.connection.transports:
+            return
+        # TLS 1.3 session tickets arrive after the handshake
+        self.store_tls_session()
+        # Messages still in the send buffer will never be sent
+        self.flush_watch = None
+        for end, message_ref in self.unsent:
+            self.report_send_error(message_ref, 1)
+        self.unsent.clear()
+        self.writing_paused = False
+        self.wake_drain_waiters()
         if exc is None:
             logger.warn("Connection lost without error.")
             if self.connection.closed and self.connection.state != ConnectionState.CLOSED:
                 self.loop.create_task(self.connection.closed(self.connection))
         else:
             logger.warn("Connection lost with error.")
+            self.metrics.connection_failed()
             if self.connection.connection_error:
                 self.loop.create_task(
                     self.connection.connection_error(exc, self.connection)
                 )
+        self.connection.state = ConnectionState.CLOSED
+        self.wake_all_waiters()
+
+    async def start_framer(self):
+        """ Calls the start event of the framer, if there is one
+        """
+        if not self.connection.framer:
+            return
+        span = self.connection.tracer.start(self.connection, "framer_start")
+        await self.connection.framer.handle_start(self.connection)
+        if span:
+            span.end()
+
+    def won_race(self):
+        """ Returns whether the transport is to be used, i.e., it has
+            not lost a race against another candidate of the connection
+        """
+        if self.race is None or self.race.select(self):
+            return True
+        # Another candidate has already won the race
+        if self in self.connection.transports:
+            self.connection.transports.remove(self)
+        return False
+
+    def first_sent(self):
+        self.sent_data = True
+        self.connection.tracer.event(self.connection, "first_byte_sent")
+
+    def first_received(self):
+        self.received_data = True
+        self.connection.tracer.event(self.connection, "first_byte_received")
 
     async def passive_open(self, transport):
-        # If there is a framer, call the start event
-        if self.connection.framer:
-            await self.connection.framer.handle_start(self.connection)
+        await self.start_framer()
         self.transport = transport
         new_remote_endpoint = RemoteEndpoint()
         logger.info("Received new connection.")
@@ -184,6 +573,7 @@ class TransportLayer(asyncio.Protocol):
             transport.get_extra_info("peername")[1])
         self.remote_endpoint = new_remote_endpoint
         self.connection.state = ConnectionState.ESTABLISHED
+        self.connection.tracer.event(self.connection, "ready", active=False)
         if self.connection.connection_received:
             self.loop.create_task(self.connection.connection_received(self))
         return
@@ -194,84 +584,169 @@ class UdpTransport(TransportLayer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.context = MessageContext()
+        properties = self.connection.transport_properties.properties
+        self.recv_buffer = DatagramQueue(
+            properties.get("recv-queue-capacity", RECV_QUEUE_CAPACITY),
+            properties.get("recv-queue-drop-policy", DropPolicy.DROP_OLDEST))
+        # Flows of a listener share one socket that cannot be paused,
+        # so bound the queue by the receive buffer limit instead
+        if not self.connection.active:
+            self.recv_buffer.max_bytes = self.recv_limit
+        # Sends datagrams directly on the socket, if available
+        self.sender = None
+        self.datagrams_sent = 0
+        self.send_calls = 0
 
     async def active_open(self, transport):
-        # If there is a framer, call the start event
-        if self.connection.framer:
-            await self.connection.framer.handle_start(self.connection)
+        await self.start_framer()
         self.transport = transport
-        for t in self.connection.pending:
-            t.cancel()
-        logger.info("Connected successfully UDP to " +
-                    str(self.connection.remote_endpoint.address) +
-                    ":" + str(self.connection.remote_endpoint.port) +
-                    ".")
+        self.reader = BatchedDatagramReader.attach(
+            self.loop, transport, self, self.connection.transport_properties.
+            properties.get("recv-batch-size", RECV_BATCH_SIZE))
+        self.sender = BatchedDatagramSender.attach(
+            transport, self.reader.sock if self.reader else None)
+        logger.info("Connected successfully UDP to %s:%s.",
+                    self.connection.remote_endpoint.address,
+                    self.connection.remote_endpoint.port)
         self.connection.state = ConnectionState.ESTABLISHED
+        self.connection.tracer.event(self.connection, "ready", active=True)
         if self.connection.ready:
             self.loop.create_task(self.connection.ready(self.connection))
         return
 
-    async def write(self, data):
-        """ Sends udp data
+    def transmit(self, messages, first_ref):
+        """ Sends a batch of framed messages as udp datagrams
         """
-        logger.info("Writing UDP data to " +
-                    str(self.connection.remote_endpoint.address[0]) +
-                    ":" + str(self.connection.remote_endpoint.port) +
-                    ".")
-        if isinstance(data, str):
-            data = data.encode()
+        if packet_log.enabled:
+            packet_log.debug("Writing %d UDP datagrams to %s:%s.",
+                             len(messages),
+                             self.connection.remote_endpoint.address[0],
+                             self.connection.remote_endpoint.port)
+        # See if the udp flow was the result of passive or active open
+        if self.connection.active:
+            address = None
+        else:
+            address = (self.remote_endpoint.address[0],
+                       self.remote_endpoint.port)
+        datagrams = []
+        for data in messages:
+            if isinstance(data, str):
+                data = data.encode()
+            elif type(data) is list:
+                # A list of buffers is sent as one datagram
+                data = b"".join(data)
+            datagrams.append(data)
+        count = 0
         try:
-            # See if the udp flow was the result of passive or active open
-            if self.connection.active:
-                # Frame the data
-                if self.connection.framer:
-                    data = await self.connection.framer. \
-                        handle_new_sent_message(data, None, False)
-                # Write the data
-                self.transport.sendto(data)
-            else:
-                remote_address = self.remote_endpoint.address[0]
-                remote_port = self.remote_endpoint.port
-                self.transport.sendto(data, (remote_address, remote_port))
-        except InterruptedError:
-            logger.warn("SendError occurred.")
-            if self.connection.send_error:
-                self.loop.create_task(
-                    self.connection.send_error(
-                        self.message_count, self.connection
-                    )
-                )
-            return
-        logger.info("Data written successfully.")
-        if self.connection.sent:
-            self.loop.create_task(
-                self.connection.sent(self.message_count, self.connection)
-            )
-        return
+            # Send directly unless asyncio still buffers earlier datagrams
+            if self.sender and self.transport.get_write_buffer_size() == 0:
+                calls = 0
+                try:
+                    count, calls = self.sender.send(datagrams, address)
+                except OSError as err:
+                    count, calls = err.sent, err.calls
+                    if err.errno not in ICMP_ERRORS:
+                        raise
+                    # An earlier datagram has been rejected, which asyncio
+                    # reports the same way, the rest can still be sent
+                    self.error_received(err)
+                finally:
+                    self.datagrams_sent += count
+                    self.send_calls += calls
+            # Leave the rest to asyncio, which buffers what cannot be sent
+            for data in datagrams[count:]:
+                if address is None:
+                    self.transport.sendto(data)
+                else:
+                    self.transport.sendto(data, address)
+                self.datagrams_sent += 1
+                self.send_calls += 1
+                count += 1
+        except OSError as err:
+            logger.warning("SendError occurred: %s", err)
+            self.report_send_error(first_ref + count, len(messages) - count)
+        if packet_log.enabled:
+            packet_log.debug("Data written successfully.")
+        if count:
+            self.metrics.sent(count, sum(len(data)
+                                         for data in datagrams[:count]))
+            if not self.sent_data:
+                self.first_sent()
+        self.report_sent(first_ref, count)
+
+    def datagram_stats(self):
+        """ Returns how many datagrams have been sent and received and
+            how many system calls and event loop callbacks that took
+        """
+        stats = {
+            "datagrams_sent": self.datagrams_sent,
+            "send_calls": self.send_calls,
+            "send_calls_saved": self.datagrams_sent - self.send_calls,
+            "segmentation_offload": bool(self.sender and self.sender.gso),
+        }
+        if self.reader:
+            stats["datagrams_received"] = self.reader.datagrams
+            stats["receive_batches"] = self.reader.batches
+        return stats
 
     async def close(self):
         logger.info("Closing connection.")
+        self.close_socket_duplicates()
         self.transport.close()
         self.connection.state = ConnectionState.CLOSED
+        self.wake_all_waiters()
         if self.connection.closed:
             self.loop.create_task(self.connection.closed(self.connection))
 
     async def read(self, min_incomplete_length, max_length):
+        message = await self.next_message(min_incomplete_length, max_length)
+        if message is None:
+            return
+        if self.connection.received:
+            self.loop.create_task(self.connection.received(message[0],
+                                                           self.context, self.connection))
+
+    async def next_message(self, min_incomplete_length=1, max_length=-1):
         if self.connection.framer:
-            if len(self.framer_buffer) == 0:
+            while len(self.framer_buffer) == 0:
+                if self.receive_closed():
+                    return None
                 await self.await_data()
-            data = self.framer_buffer.pop(0)
+            data = self.next_deframed()
         else:
-            if self.recv_buffer is None:
+            while len(self.recv_buffer) == 0:
+                if self.receive_closed():
+                    return None
                 await self.await_data()
-            if len(self.recv_buffer) == 1:
-                data = self.recv_buffer[0]
-                self.recv_buffer = None
-            else:
-                data = self.recv_buffer.pop(0)
-        if self.connection.received:
-            self.loop.create_task(self.connection.received(data,
-                                                           self.context, self.connection))
+            data = self.recv_buffer.get()
+            self.check_resume_receiving()
+        self.metrics.delivered()
+        return data, self.context, True
+
+    def parse(self, min_incomplete_length=0, max_length=0):
+        """ Returns the datagram at the head of the
+            reception queue.
+        """
+        return self.recv_buffer.peek(), self.context, True
+
+    def advance_receive_cursor(self, length):
+        # Datagrams are always deframed as a whole
+        self.recv_buffer.get()
+
+    def buffered_bytes(self):
+        return self.recv_buffer.size + self.framed_bytes
+
+    def check_resume_receiving(self):
+        # Resume once the application has drained half of the queue
+        if len(self.recv_buffer) <= self.recv_buffer.capacity // 2:
+            super().check_resume_receiving()
+
+    def close_socket_duplicates(self):
+        # Flows of a listener share the listener's reader and sender
+        if self.reader:
+            self.reader.close()
+        if self.sender and self.connection.active:
+            self.sender.close()
 
     # Asyncio Callbacks
 
@@ -280,7 +755,7 @@ class UdpTransport(TransportLayer):
     """
 
     def connection_made(self, transport):
-        if self.connection.state == ConnectionState.ESTABLISHED:
+        if not self.won_race():
             transport.close()
             return
 
@@ -306,20 +781,63 @@ class UdpTransport(TransportLayer):
         is received. It stores the datagram in the recv_buffer
     """
 
+    def connection_lost(self, exc):
+        self.close_socket_duplicates()
+        super().connection_lost(exc)
+
     def datagram_received(self, data, addr):
+        self.received_from(addr, [data])
+
+    def receive_room(self):
+        """ Returns how many datagrams the batched reader may read
+            before reading has to be paused, or None if there is no
+            such limit
+        """
+        if (self.recv_buffer.policy is DropPolicy.PAUSE_READING and
+                self.connection.active):
+            # Reading is paused as soon as the queue is full,
+            # so this only guards against reading nothing at all
+            return max(self.recv_buffer.capacity - len(self.recv_buffer), 1)
+        return None
+
+    def datagrams_received(self, batch):
+        """ Called by the batched reader with a list of
+            (data, address) tuples
+        """
+        self.received_from(batch[-1][1], [data for data, addr in batch])
+
+    def received_from(self, addr, datagrams):
+        """ Stores datagrams received from one peer in the recv_buffer
+            and wakes readers once for all of them
+        """
         self.context.addr = addr
-        if self.recv_buffer is None:
-            self.recv_buffer = list()
-        self.recv_buffer.append(data)
+        count = 0
+        length = 0
+        dropped = self.recv_buffer.dropped
+        for data in datagrams:
+            length += len(data)
+            if self.recv_buffer.put(data):
+                count += 1
+        self.metrics.received(length)
+        if not self.received_data:
+            self.first_received()
+        if self.recv_buffer.dropped != dropped:
+            self.metrics.dropped(self.recv_buffer.dropped - dropped)
+        if count == 0:
+            return
+        # Only pause if the socket is not shared with other connections
+        # of a listener, otherwise fall back to dropping new datagrams
+        if self.connection.active:
+            if (self.recv_buffer.policy is DropPolicy.PAUSE_READING and
+                    self.recv_buffer.full()):
+                self.pause_receiving()
+            else:
+                self.check_receive_limit()
 
         if self.connection.framer:
-            self.loop.create_task(self.invoke_framer())
-            return
+            self.schedule_deframing()
         else:
-            for w in self.waiters:
-                if not w.done():
-                    w.set_result(None)
-                    return
+            self.wake_waiters(count)
 
 
 class TcpTransport(TransportLayer):
@@ -327,70 +845,76 @@ class TcpTransport(TransportLayer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.context = MessageContext()
+        self.message_based = False
+        self.recv_buffer = ReceiveBuffer()
 
     async def active_open(self, transport):
-        # If there is a framer, call the start event
-        if self.connection.framer:
-            await self.connection.framer.handle_start(self.connection)
+        await self.start_framer()
         self.transport = transport
+        self.apply_write_buffer_limits()
+        ssl_object = transport.get_extra_info("ssl_object")
+        if ssl_object is not None and self.connection.tls_sessions:
+            self.connection.tls_sessions.count(ssl_object)
+            logger.info("TLS session resumed: %s",
+                        ssl_object.session_reused)
+            self.store_tls_session()
         logger.info("Connected successfully on TCP.")
         self.connection.state = ConnectionState.ESTABLISHED
-        self.connection.sleeper_for_racing.cancel_all()
+        self.connection.tracer.event(self.connection, "ready", active=True)
         if self.connection.ready:
             self.loop.create_task(self.connection.ready(self.connection))
         return
 
-    async def write(self, data):
-        """ Send tcp data
+    def transmit(self, messages, first_ref):
+        """ Hands a batch of framed messages to the tcp
+            transport with a single write
         """
-        logger.info("Writing TCP data.")
-        if isinstance(data, str):
-            data = data.encode()
+        if packet_log.enabled:
+            packet_log.debug("Writing %d TCP messages.", len(messages))
+        buffers = []
+        unsent = []
+        size = self.bytes_written
+        for message_ref, data in enumerate(messages, first_ref):
+            if isinstance(data, str):
+                data = data.encode()
+            if type(data) is list:
+                buffers.extend(data)
+                size += sum(len(buffer) for buffer in data)
+            else:
+                buffers.append(data)
+                size += len(data)
+            unsent.append((size, message_ref))
         try:
-
-            # Frame the data
-            if self.connection.framer:
-                data = await self.connection.framer. \
-                    handle_new_sent_message(data, None, False)
             # Attempt to write data
-            self.transport.write(data)
+            self.transport.writelines(buffers)
         except InterruptedError:
             logger.warn("SendError occurred.")
-            if self.connection.send_error:
-                self.loop.create_task(
-                    self.connection.send_error(self.message_count, self.connection)
-                )
+            self.report_send_error(first_ref, len(messages))
             return
-        logger.info("Data written successfully.")
-        if self.connection.sent:
-            self.loop.create_task(
-                self.connection.sent(self.message_count, self.connection)
-            )
-        return
+        if packet_log.enabled:
+            packet_log.debug("Data written successfully.")
+        self.metrics.sent(len(messages), size - self.bytes_written)
+        if not self.sent_data:
+            self.first_sent()
+        # Messages count as sent once they have left the send buffer
+        self.bytes_written = size
+        self.unsent.extend(unsent)
+        self.report_drained()
 
     async def read(self, min_incomplete_length, max_length):
         # print_time("Reading message", color)
+        message = await self.next_message(min_incomplete_length, max_length)
+        if message is None:
+            return
+        data, context, end_of_message = message
         if self.connection.framer:
-            if len(self.framer_buffer) == 0:
-                await self.await_data()
-            data = self.framer_buffer.pop(0)
             if self.connection.received:
                 self.loop.create_task(
                     self.connection.received(data, "Context", self.connection)
                 )
             return
 
-        while self.recv_buffer is None or (
-                len(self.recv_buffer) < min_incomplete_length):
-            await self.await_data()
-        if max_length == -1 or len(self.recv_buffer) <= max_length:
-            data = self.recv_buffer
-            self.recv_buffer = None
-        else:
-            data = self.recv_buffer[:max_length]
-            self.recv_buffer = self.recv_buffer[max_length:]
-
-        if self.at_eof:
+        if end_of_message:
             if self.connection.received:
                 self.loop.create_task(self.connection.received(data,
                                                                self.context, self.connection))
@@ -398,15 +922,63 @@ class TcpTransport(TransportLayer):
         else:
             if self.connection.received_partial:
                 self.loop.create_task(self.connection.received_partial(data,
-                                                                       self.context, False, self))
+                                                                       self.context, False, self.connection))
+
+    async def next_message(self, min_incomplete_length=1, max_length=-1):
+        if self.connection.framer:
+            while len(self.framer_buffer) == 0:
+                if self.receive_closed():
+                    return None
+                await self.await_data()
+            data = self.next_deframed()
+            self.metrics.delivered()
+            return data, self.context, True
+
+        while len(self.recv_buffer) == 0 or (
+                len(self.recv_buffer) < min_incomplete_length):
+            if self.receive_closed():
+                # Hand out what is left, even if it is short
+                if len(self.recv_buffer) == 0:
+                    return None
+                break
+            # Keep reading beyond the receive limit if necessary
+            self.wanted.append(min_incomplete_length)
+            self.check_resume_receiving()
+            try:
+                await self.await_data()
+            finally:
+                self.wanted.remove(min_incomplete_length)
+        data = self.recv_buffer.read(max_length)
+        self.check_resume_receiving()
+        self.metrics.delivered()
+        # The stream ends with the last data before EOF
+        end_of_message = self.at_eof or (
+            self.receive_closed() and len(self.recv_buffer) == 0)
+        return data, self.context, end_of_message
 
     async def close(self):
         logger.info("Closing connection.")
+        self.store_tls_session()
         self.transport.close()
         self.connection.state = ConnectionState.CLOSED
+        self.wake_all_waiters()
         if self.connection.closed:
             self.loop.create_task(self.connection.closed(self.connection))
 
+    def parse(self, min_incomplete_length=0, max_length=0):
+        """ Returns a memoryview of the unread part of the
+            reception buffer, without copying it. The view is only
+            valid until the receive cursor is advanced, framers must
+            copy messages out of it before that.
+        """
+        return self.recv_buffer.view(), None, False
+
+    def advance_receive_cursor(self, length):
+        self.recv_buffer.advance(length)
+
+    def buffered_bytes(self):
+        return len(self.recv_buffer) + self.framed_bytes
+
     # Asyncio Callbacks
 
     """ ASYNCIO function that gets called when a new
@@ -414,7 +986,7 @@ class TcpTransport(TransportLayer):
     """
 
     def connection_made(self, transport):
-        if self.connection.state == ConnectionState.ESTABLISHED:
+        if not self.won_race():
             transport.close()
             return
 
@@ -442,18 +1014,15 @@ class TcpTransport(TransportLayer):
     """
 
     def data_received(self, data):
-        logger.info("Received %d bytes" % len(data))
+        if packet_log.enabled:
+            packet_log.debug("Received %d bytes", len(data))
 
-        # See if we already have so data buffered
-        if self.recv_buffer is None:
-            self.recv_buffer = data
-        else:
-            self.recv_buffer = self.recv_buffer + data
+        self.metrics.received(len(data))
+        if not self.received_data:
+            self.first_received()
+        self.recv_buffer.append(data)
+        self.check_receive_limit()
         if self.connection.framer:
-            self.loop.create_task(self.invoke_framer())
-            return
+            self.schedule_deframing()
         else:
-            for w in self.waiters:
-                if not w.done():
-                    w.set_result(None)
-                    return
+            self.wake_waiters()
@@ -1,10 +1,11 @@
 import asyncio
 import datetime
 import logging
+import os
 import warnings
 from enum import Enum
 
-from pytaps.transportProperties import get_protocols, PreferenceLevel
+from pytaps.transportProperties import rank_protocols
 
 colors = {
     "red": "\x1b[31;1m",
@@ -30,97 +31,207 @@ def print_time(msg="", color="red"):
     print(str(datetime.datetime.now()) + ": " + msg, color)
 
 
-def color_emit(emit):
-    def new(*args):
-        level = args[0].levelno
-        if level == logging.CRITICAL:
-            color = "red"
-        elif level == logging.WARNING:
-            color = "yellow"
-        elif level == logging.INFO:
-            color = "green"
+# Environment variables read at import time, see configure_logging().
+# PYTAPS_LOG_LEVEL holds a level and per module overrides, e.g.,
+# "WARNING,pytaps.racing=DEBUG"
+LOG_LEVEL_ENV = "PYTAPS_LOG_LEVEL"
+# Setting PYTAPS_LOG to "production" enables the production mode
+LOG_MODE_ENV = "PYTAPS_LOG"
+# Only every n-th record of a per-message event is logged
+LOG_SAMPLE_ENV = "PYTAPS_LOG_SAMPLE"
+
+level_colors = {
+    logging.CRITICAL: "red",
+    logging.ERROR: "red",
+    logging.WARNING: "yellow",
+    logging.INFO: "green",
+}
+
+log_config = {
+    "level": logging.INFO,
+    "levels": {},
+    "sample": 1,
+    "production": False,
+}
+# Colors of the loggers created with setup_logger()
+logger_colors = {}
+# Handlers added by setup_logger(), by logger name
+log_handlers = {}
+hot_paths = []
+
+
+class ColorFormatter(logging.Formatter):
+    """ Formatter that colors logger names and levels
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(color)s%(name)s \x1b[0m- "
+                         "%(levelcolor)s%(levelname)s\x1b[0m: %(message)s")
+
+    def format(self, record):
+        record.color = colors[logger_colors.get(record.name, "white")]
+        record.levelcolor = colors[level_colors.get(record.levelno,
+                                                    "white")]
+        return super().format(record)
+
+
+def log_formatter():
+    if log_config["production"]:
+        return logging.Formatter(
+            "%(asctime)s %(name)s %(levelname)s: %(message)s")
+    return ColorFormatter()
+
+
+def log_level(level):
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError("Unknown log level: " + str(level))
+    return value
+
+
+class HotPath:
+    """ Gate for the log records of per-message events. Call sites check
+        enabled before building any message arguments::
+
+            if packet_log.enabled:
+                packet_log.debug("Received %d bytes", len(data))
+
+        so that a disabled record costs one attribute lookup. Records are
+        logged at DEBUG level, and only every sample-th one is kept.
+
+    Attributes:
+        logger (Logger, required):
+                Logger to log the records to.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.enabled = False
+        self.sample = 1
+        self.skipped = 0
+        hot_paths.append(self)
+        self.update()
+
+    def update(self):
+        self.enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self.sample = log_config["sample"]
+        self.skipped = 0
+
+    def debug(self, msg, *args):
+        self.skipped += 1
+        if self.skipped < self.sample:
+            return
+        self.skipped = 0
+        self.logger.debug(msg, *args)
+
+
+def apply_logging_config():
+    level = log_config["level"]
+    levels = log_config["levels"]
+    # Loggers of PyTAPS modules inherit the level of the package logger
+    package = logging.getLogger("pytaps")
+    package.setLevel(levels.get("pytaps", level))
+    for name in logger_colors:
+        if name in levels:
+            logging.getLogger(name).setLevel(levels[name])
+        elif name.startswith("pytaps."):
+            logging.getLogger(name).setLevel(logging.NOTSET)
         else:
-            color = "white"
-        args[0].levelname = f'{colors[color]}{args[0].levelname}\x1b[0m'
-        return emit(*args)
-    return new
+            logging.getLogger(name).setLevel(level)
+    for name, module_level in levels.items():
+        logging.getLogger(name).setLevel(module_level)
+    for handler in log_handlers.values():
+        handler.setFormatter(log_formatter())
+    for hot_path in hot_paths:
+        hot_path.update()
+
+
+def configure_logging(level=None, levels=None, sample=None, production=None):
+    """ Configures the loggers of PyTAPS, and of those created with
+        setup_logger().
+
+    Attributes:
+        level (string or integer, optional):
+                Level of all loggers, INFO by default.
+        levels (dict, optional):
+                Levels of single loggers, by logger name,
+                e.g., {"pytaps.racing": "DEBUG"}.
+        sample (integer, optional):
+                Log only every sample-th record of per-message events,
+                e.g., received data.
+        production (boolean, optional):
+                Production mode, which logs warnings and errors only,
+                unless level says otherwise, without colors.
+    """
+    if production is not None:
+        log_config["production"] = production
+        if production and level is None:
+            level = logging.WARNING
+    if level is not None:
+        log_config["level"] = log_level(level)
+    if levels is not None:
+        for name, module_level in levels.items():
+            log_config["levels"][name] = log_level(module_level)
+    if sample is not None:
+        log_config["sample"] = max(1, int(sample))
+    apply_logging_config()
+
+
+def configure_logging_from_environment(environ):
+    if environ.get(LOG_MODE_ENV, "").lower() == "production":
+        log_config["production"] = True
+        log_config["level"] = logging.WARNING
+    for entry in environ.get(LOG_LEVEL_ENV, "").split(","):
+        name, equals, level = entry.strip().rpartition("=")
+        if not level:
+            continue
+        try:
+            if equals:
+                log_config["levels"][name] = log_level(level)
+            else:
+                log_config["level"] = log_level(level)
+        except ValueError:
+            warnings.warn("Ignoring log level " + entry + " in " +
+                          LOG_LEVEL_ENV)
+    if environ.get(LOG_SAMPLE_ENV, "").isdigit():
+        log_config["sample"] = max(1, int(environ[LOG_SAMPLE_ENV]))
 
 
 def setup_logger(module, color="white"):
+    """ Returns the logger of a module, which logs to stderr with the
+        module name in color. Loggers of PyTAPS modules share one handler.
+    """
     logger = logging.getLogger(module)
-    logger.setLevel(logging.INFO)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    ch.setFormatter(logging.Formatter(f'%(asctime)s - {colors[color]}%(name)s \x1b[0m- %(levelname)s: %(message)s'))
-    ch.emit = color_emit(ch.emit)
-    logger.addHandler(ch)
+    logger_colors[module] = color
+    if module.startswith("pytaps."):
+        owner = "pytaps"
+    else:
+        owner = module
+    if owner not in log_handlers:
+        handler = logging.StreamHandler()
+        log_handlers[owner] = handler
+        logging.getLogger(owner).addHandler(handler)
+    apply_logging_config()
     return logger
 
 
+configure_logging_from_environment(os.environ)
+
+
+def current_loop():
+    """ Returns the running event loop, or the event loop
+        of the current thread if none is running
+    """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.get_event_loop()
+
+
 def create_candidates(connection):
     """ Decides which protocols are candidates and then orders them
     according to the TAPS interface draft
     """
-    # Get the protocols know to the implementation from transportProperties
-    available_protocols = get_protocols()
-
-    # At the beginning, all protocols are candidates
-    candidate_protocols = dict([(row["name"], list((0, 0)))
-                                for row in available_protocols])
-
-    # Iterate over all available protocols and over all properties
-    for protocol in available_protocols:
-        for transport_property in connection.transport_properties.properties:
-            # If a protocol has a prohibited property remove it
-            if (connection.transport_properties.properties[transport_property]
-                    is PreferenceLevel.PROHIBIT):
-                if (protocol[transport_property] is True and
-                        protocol["name"] in candidate_protocols):
-                    del candidate_protocols[protocol["name"]]
-            # If a protocol doesnt have a required property remove it
-            if (connection.transport_properties.properties[transport_property]
-                    is PreferenceLevel.REQUIRE):
-                if (protocol[transport_property] is False and
-                        protocol["name"] in candidate_protocols):
-                    del candidate_protocols[protocol["name"]]
-            # Count how many PREFER properties each protocol has
-            if (connection.transport_properties.properties[transport_property]
-                    is PreferenceLevel.PREFER):
-                if (protocol[transport_property] is True and
-                        protocol["name"] in candidate_protocols):
-                    candidate_protocols[protocol["name"]][0] += 1
-            # Count how many AVOID properties each protocol has
-            if (connection.transport_properties.properties[transport_property]
-                    is PreferenceLevel.AVOID):
-                if (protocol[transport_property] is True and
-                        protocol["name"] in candidate_protocols):
-                    candidate_protocols[protocol["name"]][1] -= 1
-
-    # Sort candidates by number of PREFERs and then by AVOIDs on ties
-    sorted_candidates = sorted(candidate_protocols.items(),
-                               key=lambda value: (value[1][0],
-                                                  value[1][1]), reverse=True)
-
-    return sorted_candidates
-
-
-# Define our own sleep function which keeps track of its running calls
-# so we can cancel them once the Connection is established
-# https://stackoverflow.com/questions/37209864/interrupt-all-asyncio-sleep-currently-executing
-class SleepClassForRacing:
-    tasks = set()
-
-    async def sleep(self, delay, result=None, *, loop=None):
-        coro = asyncio.sleep(delay, result=result, loop=loop)
-        task = asyncio.ensure_future(coro)
-        self.tasks.add(task)
-        try:
-            return await task
-        except asyncio.CancelledError:
-            return result
-        finally:
-            self.tasks.remove(task)
-
-    def cancel_all(self):
-        for task in self.tasks:
-            task.cancel()
+    return list(rank_protocols(connection.transport_properties.snapshot()))
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import pytaps as taps
+
+
+class Echo(asyncio.Protocol):
+    """ Sends back everything it receives, over TCP or UDP
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.transport.write(data)
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+
+def remote_endpoint(port):
+    endpoint = taps.RemoteEndpoint()
+    endpoint.with_address("127.0.0.1")
+    endpoint.with_port(port)
+    return endpoint
+
+
+async def start_echo_server(protocol="tcp", ssl=None):
+    """ Starts an echo server on 127.0.0.1 and returns
+        a function that stops it, and its port
+    """
+    loop = asyncio.get_running_loop()
+    if protocol == "tcp":
+        server = await loop.create_server(Echo, "127.0.0.1", 0, ssl=ssl)
+        return server.close, server.sockets[0].getsockname()[1]
+    transport, echo = await loop.create_datagram_endpoint(
+        Echo, local_addr=("127.0.0.1", 0))
+    return transport.close, transport.get_extra_info("sockname")[1]
+
+
+async def initiate(loop, remote_endpoint, properties):
+    """ Initiates a Connection to remote_endpoint
+        and returns it once it is ready
+    """
+    preconnection = taps.Preconnection(
+        remote_endpoint=remote_endpoint, transport_properties=properties,
+        event_loop=loop)
+    ready = loop.create_future()
+
+    async def handle_ready(connection):
+        ready.set_result(connection)
+
+    preconnection.on_ready(handle_ready)
+    await preconnection.initiate()
+    return await asyncio.wait_for(ready, 5)
+
+
+@pytest.fixture
+def remote():
+    """ Returns a function that creates a RemoteEndpoint
+        for a port on 127.0.0.1
+    """
+    return remote_endpoint
+
+
+@pytest.fixture
+def echo_server():
+    """ Returns a function that runs a coroutine function on a new event
+        loop next to an echo server, passing it the server's port, and
+        returns its result. The protocol of the server is "tcp" or "udp",
+        a TCP server uses TLS if an SSL context is passed.
+    """
+    def run(main, protocol="tcp", ssl=None):
+        async def with_server():
+            stop, port = await start_echo_server(protocol, ssl)
+            try:
+                return await main(port)
+            finally:
+                stop()
+        return asyncio.run(with_server())
+    return run
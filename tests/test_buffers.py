@@ -0,0 +1,147 @@
+import asyncio
+
+import pytaps as taps
+from pytaps.buffers import ReceiveBuffer, DatagramQueue
+from pytaps.transportProperties import DropPolicy
+from test_datagram import flood
+
+
+def test_receive_buffer_append_and_read():
+    buf = ReceiveBuffer(initial_size=8)
+    buf.append(b"Hello ")
+    buf.append(b"World")
+    assert len(buf) == 11
+    assert buf.read(6) == b"Hello "
+    assert bytes(buf.view()) == b"World"
+    assert buf.read() == b"World"
+    assert len(buf) == 0
+
+
+def test_receive_buffer_view_survives_growth():
+    buf = ReceiveBuffer(initial_size=4)
+    buf.append(b"abcd")
+    view = buf.view(2)
+    # Growing the buffer must not invalidate or alter earlier views
+    buf.append(b"efghijkl")
+    assert bytes(view) == b"ab"
+    buf.advance(2)
+    assert buf.read() == b"cdefghijkl"
+
+
+def test_receive_buffer_advance_past_end():
+    buf = ReceiveBuffer(initial_size=4)
+    buf.append(b"abc")
+    buf.advance(10)
+    assert len(buf) == 0
+    buf.append(b"xyz")
+    assert buf.read() == b"xyz"
+
+
+def test_datagram_queue_drop_oldest():
+    queue = DatagramQueue(capacity=2, policy=DropPolicy.DROP_OLDEST)
+    for datagram in (b"a", b"b", b"c"):
+        assert queue.put(datagram)
+    assert queue.dropped == 1
+    assert queue.get() == b"b"
+    assert queue.get() == b"c"
+
+
+def test_datagram_queue_drop_newest():
+    queue = DatagramQueue(capacity=2, policy=DropPolicy.DROP_NEWEST)
+    assert queue.put(b"a")
+    assert queue.put(b"b")
+    assert not queue.put(b"c")
+    assert queue.full()
+    assert queue.dropped == 1
+    assert queue.peek() == b"a"
+
+
+def test_datagram_queue_byte_limit():
+    queue = DatagramQueue(capacity=10, policy=DropPolicy.DROP_OLDEST,
+                          max_bytes=4)
+    assert queue.put(b"ab")
+    assert queue.put(b"cd")
+    assert queue.full()
+    assert queue.put(b"efg")
+    assert queue.dropped == 2
+    assert queue.size == 3
+    assert queue.get() == b"efg"
+    assert queue.size == 0
+
+
+def test_receive_buffer_allocates_lazily_and_shrinks():
+    buf = ReceiveBuffer(initial_size=1024)
+    assert buf.capacity() == 0
+    buf.append(b"a" * 10)
+    assert buf.capacity() == 1024
+    buf.append(b"b" * 100000)
+    assert buf.capacity() > 100000
+    # Compacting with little unread data shrinks the buffer again
+    buf.advance(100009)
+    while buf.capacity() > 1024:
+        buf.append(b"c" * 100)
+        buf.advance(100)
+    assert len(buf) == 1
+    buf.read()
+    # A large buffer is freed once it has been emptied
+    buf.append(b"d" * 1000000)
+    buf.advance(1000000)
+    assert buf.capacity() == 0
+    buf.append(b"e")
+    assert buf.read() == b"e"
+
+
+async def receive_all(connection):
+    received = []
+    while len(connection.transports[0].recv_buffer):
+        received.append(await asyncio.wait_for(
+            connection.receive_message(), 5))
+    return received
+
+
+def test_drop_policies_of_a_flooded_connection():
+    async def run(policy):
+        properties = taps.TransportProperties()
+        properties.add("recv-queue-capacity", 10)
+        properties.add("recv-queue-drop-policy", policy)
+        connection, peer = await flood(properties, 50)
+        dropped = connection.dropped_messages()
+        received = await receive_all(connection)
+        connection.close()
+        peer.close()
+        return dropped, received
+
+    dropped, received = asyncio.run(run(DropPolicy.DROP_OLDEST))
+    assert dropped == 40
+    assert received == [b"%d" % i for i in range(40, 50)]
+    dropped, received = asyncio.run(run(DropPolicy.DROP_NEWEST))
+    assert dropped == 40
+    assert received == [b"%d" % i for i in range(10)]
+
+
+def test_paused_connection_resumes_once_half_drained():
+    async def run():
+        properties = taps.TransportProperties()
+        properties.add("recv-queue-capacity", 10)
+        properties.add("recv-queue-drop-policy", DropPolicy.PAUSE_READING)
+        connection, peer = await flood(properties, 50)
+        transport = connection.transports[0]
+        assert transport.reading_paused
+        received = []
+        for i in range(4):
+            received.append(await connection.receive_message())
+        assert transport.reading_paused
+        received.append(await connection.receive_message())
+        # Reading resumes and fills the queue again
+        await asyncio.sleep(0.05)
+        assert len(transport.recv_buffer) == 10
+        assert transport.reading_paused
+        while len(received) < 50:
+            received.append(await asyncio.wait_for(
+                connection.receive_message(), 5))
+        assert received == [b"%d" % i for i in range(50)]
+        assert connection.dropped_messages() == 0
+        connection.close()
+        peer.close()
+
+    asyncio.run(run())
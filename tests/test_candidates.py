@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+from pytaps.transportProperties import TransportProperties, rank_protocols
+from pytaps.utility import create_candidates
+
+
+def candidates(properties):
+    return [name for name, _ in create_candidates(
+        SimpleNamespace(transport_properties=properties))]
+
+
+def test_default_properties_select_tcp():
+    assert candidates(TransportProperties()) == ["tcp"]
+
+
+def test_unreliable_properties_select_udp():
+    properties = TransportProperties()
+    properties.ignore("congestion-control")
+    properties.ignore("preserve-order")
+    properties.prohibit("reliability")
+    assert candidates(properties) == ["udp"]
+
+
+def test_ranking_is_cached_per_snapshot():
+    properties = TransportProperties()
+    snapshot = properties.snapshot()
+    properties.ignore("reliability")
+    # The snapshot must not follow later changes
+    assert snapshot != properties.snapshot()
+    rank_protocols.cache_clear()
+    candidates(TransportProperties())
+    candidates(TransportProperties())
+    info = rank_protocols.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
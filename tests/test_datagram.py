@@ -0,0 +1,198 @@
+import asyncio
+import socket
+
+import pytaps as taps
+from conftest import initiate, remote_endpoint
+from pytaps.datagram import BatchedDatagramReader, BatchedDatagramSender
+from pytaps.transportProperties import DropPolicy
+
+
+class Collector(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.batches = []
+        self.received = asyncio.Event()
+
+    def datagram_received(self, data, addr):
+        self.batches.append([(data, addr)])
+        self.received.set()
+
+    def datagrams_received(self, batch):
+        self.batches.append(batch)
+        self.received.set()
+
+
+def test_reader_delivers_datagrams_in_batches():
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, collector = await loop.create_datagram_endpoint(
+            Collector, local_addr=("127.0.0.1", 0))
+        reader = BatchedDatagramReader.attach(loop, transport, collector,
+                                              batch_size=8)
+        assert reader is not None
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(10):
+            sender.sendto(b"%d" % i, transport.get_extra_info("sockname"))
+        while sum(len(batch) for batch in collector.batches) < 10:
+            collector.received.clear()
+            await asyncio.wait_for(collector.received.wait(), 5)
+        assert [len(batch) for batch in collector.batches] == [8, 2]
+        assert [data for batch in collector.batches
+                for data, addr in batch] == [b"%d" % i for i in range(10)]
+        assert collector.batches[0][0][1][1] == sender.getsockname()[1]
+        sender.close()
+        reader.close()
+        transport.close()
+
+    asyncio.run(run())
+
+
+def test_segment_runs_end_with_at_most_one_shorter_datagram():
+    datagrams = [b"a" * 10] * 3 + [b"b" * 5] + [b"c" * 10] * 2 + [b"d" * 20]
+    run = BatchedDatagramSender.segment_run
+    assert run(datagrams, 0) == 4
+    assert run(datagrams, 4) == 2
+    assert run(datagrams, 6) == 1
+
+
+def test_sender_sends_batches_with_fewer_calls():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(5)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=receiver.getsockname())
+        sender = BatchedDatagramSender.attach(transport)
+        datagrams = [b"%04d" % i for i in range(20)]
+        sent, calls = sender.send(datagrams)
+        assert sent == 20
+        if sender.gso:
+            assert calls == 1
+        sender.close()
+        transport.close()
+
+    asyncio.run(run())
+    assert [receiver.recv(100) for i in range(20)] == \
+        [b"%04d" % i for i in range(20)]
+    receiver.close()
+
+
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    address = sock.getsockname()
+    sock.close()
+    return address
+
+
+def test_sender_reports_datagrams_sent_before_an_error():
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=closed_port())
+        sender = BatchedDatagramSender.attach(transport)
+        # The first datagram is sent, the second one fails
+        # with the ICMP port unreachable caused by the first
+        try:
+            sender.send([b"a", b"bb", b"ccc"])
+        except ConnectionRefusedError as exc:
+            assert exc.sent == 1
+        else:
+            assert False
+        # Datagrams that fit are sent, even if a later one does not
+        try:
+            sender.send([b"a", b"b", b"c" * 70000])
+        except OSError as exc:
+            assert exc.sent == 2
+        else:
+            assert False
+        sender.close()
+        transport.close()
+
+    asyncio.run(run())
+
+
+def test_icmp_errors_are_not_send_errors(remote):
+    async def run():
+        loop = asyncio.get_running_loop()
+        properties = taps.TransportProperties()
+        properties.prohibit("reliability")
+        properties.ignore("congestion-control")
+        properties.ignore("preserve-order")
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote(closed_port()[1]),
+            transport_properties=properties, event_loop=loop)
+        ready = loop.create_future()
+        sent = []
+        send_errors = []
+        connection_errors = []
+
+        async def handle_ready(connection):
+            ready.set_result(connection)
+
+        async def handle_sent(message_ref, connection):
+            sent.append(message_ref)
+
+        async def handle_send_error(message_ref, connection):
+            send_errors.append(message_ref)
+
+        async def handle_connection_error(err, connection):
+            connection_errors.append(err)
+
+        preconnection.on_ready(handle_ready)
+        await preconnection.initiate()
+        connection = await asyncio.wait_for(ready, 5)
+        connection.on_sent(handle_sent)
+        connection.on_send_error(handle_send_error)
+        connection.on_connection_error(handle_connection_error)
+        await connection.send_messages([b"a", b"bb", b"ccc"])
+        await asyncio.sleep(0.05)
+        assert send_errors == []
+        assert sent == [1, 2, 3]
+        assert connection_errors
+        connection.close()
+
+    asyncio.run(run())
+
+
+async def flood(properties, count):
+    """ Initiates a UDP Connection to a socket that then sends it count
+        datagrams, and returns the Connection and the socket
+    """
+    loop = asyncio.get_running_loop()
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(("127.0.0.1", 0))
+    peer.settimeout(5)
+    properties.prohibit("reliability")
+    properties.ignore("congestion-control")
+    properties.ignore("preserve-order")
+    connection = await initiate(loop, remote_endpoint(peer.getsockname()[1]),
+                                properties)
+    await connection.send_message(b"hello")
+    data, address = peer.recvfrom(100)
+    for i in range(count):
+        peer.sendto(b"%d" % i, address)
+    await asyncio.sleep(0.1)
+    return connection, peer
+
+
+def test_batched_reads_leave_datagrams_in_the_socket_when_paused():
+    async def run():
+        properties = taps.TransportProperties()
+        properties.add("recv-queue-capacity", 10)
+        properties.add("recv-queue-drop-policy", DropPolicy.PAUSE_READING)
+        connection, peer = await flood(properties, 50)
+        assert connection.transports[0].reader is not None
+        assert connection.transports[0].reading_paused
+        assert len(connection.transports[0].recv_buffer) == 10
+        received = []
+        for i in range(50):
+            received.append(await asyncio.wait_for(
+                connection.receive_message(), 5))
+        assert received == [b"%d" % i for i in range(50)]
+        assert connection.dropped_messages() == 0
+        connection.close()
+        peer.close()
+
+    asyncio.run(run())
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import pytaps as taps
+from pytaps import eventloop
+
+
+def test_run_returns_result_of_coroutine():
+    async def main():
+        await asyncio.sleep(0)
+        return asyncio.get_running_loop()
+
+    loop = taps.run(main(), backend="asyncio")
+    assert loop.is_closed()
+
+
+def test_run_waits_for_the_default_executor():
+    done = []
+
+    def work():
+        time.sleep(0.1)
+        done.append(True)
+
+    async def main():
+        asyncio.get_running_loop().run_in_executor(None, work)
+
+    taps.run(main(), backend="asyncio")
+    assert done
+
+
+def test_loop_backend_falls_back_to_asyncio(monkeypatch):
+    monkeypatch.setattr(eventloop, "import_uvloop", lambda: None)
+    monkeypatch.setenv(eventloop.LOOP_BACKEND_ENV, "uvloop")
+    assert taps.get_loop_backend() == "asyncio"
+    taps.set_loop_backend("asyncio")
+    try:
+        assert taps.get_loop_backend() == "asyncio"
+        assert taps.get_loop_backend("auto") == "asyncio"
+    finally:
+        taps.set_loop_backend(None)
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytaps as taps
+from conftest import initiate
+from test_framer import SyncLengthPrefixFramer
+
+
+class SlowReader(asyncio.Protocol):
+    """ Does not read until told to, then discards everything
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.pause_reading()
+
+    def data_received(self, data):
+        pass
+
+
+def test_slow_reader_pauses_and_resumes_writing(remote):
+    async def run():
+        loop = asyncio.get_running_loop()
+        reader = SlowReader()
+        server = await loop.create_server(lambda: reader, "127.0.0.1", 0)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        connection = await initiate(
+            loop, remote(server.sockets[0].getsockname()[1]), properties)
+        connection.set_write_buffer_limits(high=256 * 1024, low=64 * 1024)
+        sent = []
+
+        async def handle_sent(message_ref, connection):
+            sent.append(message_ref)
+
+        connection.on_sent(handle_sent)
+        count = 256
+        paused = []
+
+        async def send():
+            for i in range(count):
+                await connection.send_message(b"x" * 65536)
+                paused.append(connection.transports[0].writing_paused)
+        sender = loop.create_task(send())
+        # The sender blocks once the socket and the send buffer are full
+        for i in range(500):
+            if any(paused) or sender.done():
+                break
+            await asyncio.sleep(0.01)
+        assert any(paused) and not sender.done()
+        assert len(sent) < len(paused)
+        reader.transport.resume_reading()
+        await asyncio.wait_for(sender, 10)
+        # The last messages are reported once the buffer has emptied
+        for i in range(500):
+            if len(sent) == count:
+                break
+            await asyncio.sleep(0.01)
+        assert sent == list(range(1, count + 1))
+        assert connection.transports[0].flush_watch is None
+        connection.close()
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_sent_is_reported_below_the_high_water_mark(remote):
+    async def run():
+        loop = asyncio.get_running_loop()
+        reader = SlowReader()
+        server = await loop.create_server(lambda: reader, "127.0.0.1", 0)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        connection = await initiate(
+            loop, remote(server.sockets[0].getsockname()[1]), properties)
+        # Writing never pauses, so asyncio never calls resume_writing()
+        # by itself
+        connection.set_write_buffer_limits(high=1 << 30)
+        sent = []
+
+        async def handle_sent(message_ref, connection):
+            sent.append(message_ref)
+
+        connection.on_sent(handle_sent)
+        transport = connection.transports[0]
+        while transport.transport.get_write_buffer_size() == 0:
+            await connection.send_message(b"x" * 65536)
+        count = transport.message_count
+        await asyncio.sleep(0.05)
+        assert len(sent) < count
+        reader.transport.resume_reading()
+        for i in range(500):
+            if len(sent) == count:
+                break
+            await asyncio.sleep(0.01)
+        assert sent == list(range(1, count + 1))
+        assert not transport.writing_paused
+        connection.close()
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_receive_limit_does_not_stall_large_messages(echo_server, remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        properties.add("recv-buffer-limit", 65536)
+        connection = await initiate(loop, remote(port), properties)
+        # A reader waits for more data than the limit allows to buffer
+        await connection.send_message(b"x" * 150000)
+        data = await asyncio.wait_for(
+            connection.receive_message(min_incomplete_length=100000), 5)
+        assert len(data) >= 100000
+        connection.close()
+
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote(port), transport_properties=properties,
+            event_loop=loop)
+        preconnection.add_framer(SyncLengthPrefixFramer())
+        ready = loop.create_future()
+
+        async def handle_ready(connection):
+            ready.set_result(connection)
+
+        preconnection.on_ready(handle_ready)
+        await preconnection.initiate()
+        connection = await asyncio.wait_for(ready, 5)
+        # A single message is larger than the limit
+        messages = [b"a" * 1000, b"b" * 200000, b"c" * 1000]
+        await connection.send_messages(messages)
+        received = []
+        for message in messages:
+            received.append(await asyncio.wait_for(
+                connection.receive_message(), 5))
+        assert received == messages
+        assert not connection.transports[0].reading_paused
+        connection.close()
+
+    echo_server(run)
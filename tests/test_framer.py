@@ -0,0 +1,166 @@
+import asyncio
+import struct
+
+import pytaps as taps
+from pytaps.transports import TcpTransport, UdpTransport
+
+
+class LengthPrefixFramer(taps.Framer):
+    """ Frames each message with a four byte length
+    """
+
+    async def start(self, connection):
+        return
+
+    async def new_sent_message(self, data, context, eom):
+        return struct.pack("!I", len(data)) + data
+
+    async def handle_received_data(self, connection):
+        buffer, context, eom = connection.parse()
+        if len(buffer) < 4:
+            raise taps.DeframingFailed
+        length = struct.unpack_from("!I", buffer)[0]
+        if len(buffer) < 4 + length:
+            raise taps.DeframingFailed
+        return context, bytes(buffer[4:4 + length]), 4 + length, True
+
+
+class SyncLengthPrefixFramer(taps.SyncFramer):
+    """ Frames each message with a four byte length, inline
+    """
+
+    def frame(self, data, context, eom):
+        return [struct.pack("!I", len(data)), data]
+
+    def deframe(self, connection):
+        buffer, context, eom = connection.parse()
+        if len(buffer) < 4:
+            raise taps.DeframingFailed
+        length = struct.unpack_from("!I", buffer)[0]
+        if len(buffer) < 4 + length:
+            raise taps.DeframingFailed
+        return context, bytes(buffer[4:4 + length]), 4 + length, True
+
+
+def frame(data):
+    return struct.pack("!I", len(data)) + data
+
+
+def framed_transport(loop, framer, transport_class=TcpTransport):
+    """ Returns a transport of a new connection that
+        is fed data without having a socket
+    """
+    preconnection = taps.Preconnection(
+        transport_properties=taps.TransportProperties(), event_loop=loop)
+    preconnection.add_framer(framer)
+    return transport_class(taps.Connection(preconnection))
+
+
+def deframed(transport):
+    messages = []
+    while transport.framer_buffer:
+        messages.append(transport.next_deframed())
+    return messages
+
+
+def test_deframing_delivers_messages_as_a_batch():
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport = framed_transport(loop, LengthPrefixFramer())
+        data = frame(b"first") + frame(b"second") + frame(b"third")
+        waiter = loop.create_task(transport.await_data())
+        await asyncio.sleep(0)
+        # Two messages and the start of a third arrive at once
+        transport.data_received(data[:-3])
+        assert transport.deframing is not None
+        while transport.deframing is not None:
+            await asyncio.sleep(0)
+        # Waiting readers are woken once for the whole batch
+        await asyncio.wait_for(waiter, 5)
+        assert deframed(transport) == [b"first", b"second"]
+        # The partial frame stays in the buffer until it is complete
+        assert len(transport.recv_buffer) == len(frame(b"third")) - 3
+        assert transport.buffered_bytes() == len(transport.recv_buffer)
+        transport.data_received(data[-3:])
+        while transport.deframing is not None:
+            await asyncio.sleep(0)
+        assert deframed(transport) == [b"third"]
+        assert len(transport.recv_buffer) == 0
+        assert transport.buffered_bytes() == 0
+
+    asyncio.run(run())
+
+
+def test_undeframable_datagrams_are_discarded():
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport = framed_transport(loop, LengthPrefixFramer(),
+                                     UdpTransport)
+        transport.received_from(("127.0.0.1", 9), [
+            frame(b"first"), b"\x00\x00\x00\x09short", frame(b"second")])
+        while transport.deframing is not None:
+            await asyncio.sleep(0)
+        assert deframed(transport) == [b"first", b"second"]
+        assert len(transport.recv_buffer) == 0
+        assert transport.metrics.deframing_failures == 1
+
+    asyncio.run(run())
+
+
+def test_sync_framer_deframes_without_a_task():
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport = framed_transport(loop, SyncLengthPrefixFramer())
+        tasks = len(asyncio.all_tasks())
+        messages = [b"%d" % i * i for i in range(1, 20)]
+        data = b"".join(frame(message) for message in messages)
+        # Deliver the data in odd chunks, so frames span several of them
+        for i in range(0, len(data), 7):
+            transport.data_received(data[i:i + 7])
+        assert transport.deframing is None
+        assert len(asyncio.all_tasks()) == tasks
+        assert deframed(transport) == messages
+        assert len(transport.recv_buffer) == 0
+
+    asyncio.run(run())
+
+
+def test_mixed_batch_is_framed_and_reported_per_message(echo_server,
+                                                        remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote(port), transport_properties=properties,
+            event_loop=loop)
+        preconnection.add_framer(SyncLengthPrefixFramer())
+        ready = loop.create_future()
+        sent = []
+
+        async def handle_ready(connection):
+            ready.set_result(connection)
+
+        async def handle_sent(message_ref, connection):
+            sent.append(message_ref)
+
+        preconnection.on_ready(handle_ready)
+        await preconnection.initiate()
+        connection = await asyncio.wait_for(ready, 5)
+        connection.on_sent(handle_sent)
+        batch = ["text", b"bytes", bytearray(b"buffer"), b"", b"x" * 70000]
+        assert await connection.send_messages(batch) == [1, 2, 3, 4, 5]
+        assert await connection.send_message(b"single") == 6
+        received = []
+        while len(received) < 6:
+            received.append(await asyncio.wait_for(
+                connection.receive_message(), 5))
+        assert received == [b"text", b"bytes", b"buffer", b"", b"x" * 70000,
+                            b"single"]
+        while len(sent) < 6:
+            await asyncio.sleep(0.01)
+        assert sent == [1, 2, 3, 4, 5, 6]
+        assert connection.metrics.messages_sent == 6
+        connection.close()
+
+    echo_server(run)
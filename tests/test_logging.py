@@ -0,0 +1,26 @@
+import logging
+
+import pytaps as taps
+from pytaps.utility import HotPath
+
+
+def test_hot_path_is_gated_and_sampled(caplog):
+    logger = logging.getLogger("pytaps.test_hot_path")
+    hot_path = HotPath(logger)
+    try:
+        taps.configure_logging(level="INFO")
+        assert not hot_path.enabled
+        taps.configure_logging(levels={"pytaps.test_hot_path": "DEBUG"},
+                               sample=3)
+        assert hot_path.enabled
+        with caplog.at_level(logging.DEBUG, logger="pytaps.test_hot_path"):
+            for i in range(9):
+                hot_path.debug("Packet %d", i)
+        assert [record.getMessage() for record in caplog.records] == \
+            ["Packet 2", "Packet 5", "Packet 8"]
+        taps.configure_logging(production=True)
+        assert logging.getLogger("pytaps.transports").getEffectiveLevel() \
+            == logging.WARNING
+    finally:
+        taps.configure_logging(level="INFO", sample=1, production=False,
+                               levels={"pytaps.test_hot_path": "NOTSET"})
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytaps as taps
+
+
+def test_loop_pool_spreads_initiated_connections(echo_server, remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        pool = taps.LoopPool(2)
+        pool.start()
+        ready = asyncio.Queue()
+
+        async def handle_ready(connection):
+            loop.call_soon_threadsafe(ready.put_nowait, connection)
+
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote(port),
+            transport_properties=taps.TransportProperties(),
+            event_loop=loop)
+        preconnection.on_ready(handle_ready)
+        for i in range(4):
+            await pool.initiate(preconnection)
+        connections = [await asyncio.wait_for(ready.get(), 5)
+                       for i in range(4)]
+        assert {connection.loop for connection in connections} == \
+            set(pool.loops)
+        assert pool.stats()["load"] == [2, 2]
+        pool.stop()
+
+    echo_server(run)
+
+
+def test_loop_pool_dispatches_and_hands_off_connections(echo_server,
+                                                        remote):
+    async def run(echo_port):
+        loop = asyncio.get_running_loop()
+        pool = taps.LoopPool(2)
+        pool.start()
+        threads = []
+
+        async def handle_connection_received(connection):
+            threads.append(threading.current_thread().name)
+            await connection.send_message(b"hello")
+
+        local = taps.LocalEndpoint()
+        local.with_address("127.0.0.1")
+        local.with_port(0)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            local_endpoint=local, transport_properties=properties,
+            event_loop=loop)
+        preconnection.on_connection_received(handle_connection_received)
+        listener = await pool.listen(preconnection)
+        port = listener.servers[0].sockets[0].getsockname()[1]
+        writers = []
+        for i in range(2):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            assert await asyncio.wait_for(reader.readexactly(5), 5) == \
+                b"hello"
+            writers.append(writer)
+        assert sorted(threads) == ["pytaps-loop-0", "pytaps-loop-1"]
+        listener.stop()
+        for writer in writers:
+            writer.close()
+
+        # Move a connection of this loop to one of the pool
+        ready = loop.create_future()
+        received = asyncio.Queue()
+
+        async def handle_ready(connection):
+            ready.set_result(connection)
+
+        async def handle_received_partial(data, context, eom, connection):
+            loop.call_soon_threadsafe(received.put_nowait, data)
+
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote(echo_port),
+            transport_properties=taps.TransportProperties(),
+            event_loop=loop)
+        preconnection.on_ready(handle_ready)
+        await preconnection.initiate()
+        connection = await asyncio.wait_for(ready, 5)
+        connection.on_received_partial(handle_received_partial)
+        await pool.hand_off(connection, pool.loops[1])
+        assert connection.loop is pool.loops[1]
+
+        async def echo():
+            await connection.send_message(b"ping")
+            await connection.receive(min_incomplete_length=4)
+        asyncio.run_coroutine_threadsafe(echo(), pool.loops[1])
+        assert await asyncio.wait_for(received.get(), 5) == b"ping"
+        assert pool.stats()["handed_off"] == 1
+        pool.stop()
+
+    echo_server(run)
+
+
+def test_loop_pool_hands_off_received_connections():
+    async def run():
+        loop = asyncio.get_running_loop()
+        pool = taps.LoopPool(1)
+        pool.start()
+        received = loop.create_future()
+
+        async def handle_connection_received(connection):
+            received.set_result(connection)
+
+        local = taps.LocalEndpoint()
+        local.with_address("127.0.0.1")
+        local.with_port(0)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            local_endpoint=local, transport_properties=properties,
+            event_loop=loop)
+        preconnection.on_connection_received(handle_connection_received)
+        listener = await preconnection.listen()
+        while not listener.listening():
+            await asyncio.sleep(0.01)
+        port = listener.servers[0].sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        connection = await asyncio.wait_for(received, 5)
+        await pool.hand_off(connection, pool.loops[0])
+        # Closing the listener's transport does not close the connection
+        await asyncio.sleep(0.05)
+        assert connection.state is taps.ConnectionState.ESTABLISHED
+
+        async def echo():
+            data = await connection.receive_message(min_incomplete_length=4)
+            await connection.send_message(data)
+        echoed = asyncio.run_coroutine_threadsafe(echo(), pool.loops[0])
+        writer.write(b"ping")
+        assert await asyncio.wait_for(reader.readexactly(4), 5) == b"ping"
+        await asyncio.wait_for(asyncio.wrap_future(echoed), 5)
+        writer.close()
+        listener.stop()
+        pool.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytaps as taps
+
+
+def test_listener_metrics_are_exported():
+    async def run():
+        loop = asyncio.get_running_loop()
+
+        async def handle_connection_received(connection):
+            connection.on_received_partial(handle_received_partial)
+            await connection.receive(min_incomplete_length=1)
+
+        async def handle_received_partial(data, context, end_of_message,
+                                          connection):
+            await connection.send_message(data)
+
+        local = taps.LocalEndpoint()
+        local.with_address("127.0.0.1")
+        local.with_port(0)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            local_endpoint=local, transport_properties=properties,
+            event_loop=loop)
+        preconnection.on_connection_received(handle_connection_received)
+        listener = await preconnection.listen()
+        while not listener.listening():
+            await asyncio.sleep(0.01)
+        port = listener.servers[0].sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"hello")
+        assert await asyncio.wait_for(reader.readexactly(5), 5) == b"hello"
+
+        stats = listener.stats()
+        assert stats["bytes_received"] == 5
+        assert stats["bytes_sent"] == 5
+        assert stats["messages_sent"] == 1
+        assert stats["messages_received"] == 1
+
+        exporter = taps.MetricsExporter()
+        text = exporter.render()
+        assert "# TYPE pytaps_sent_bytes_total counter" in text
+        assert 'pytaps_listener_sent_bytes_total{listener="tcp/' \
+            '127.0.0.1:0"} 5' in text
+        assert 'pytaps_listener_open_connections{listener="tcp/' \
+            '127.0.0.1:0"} 1' in text
+
+        server = await exporter.serve(port=0)
+        metrics_port = server.sockets[0].getsockname()[1]
+        metrics_reader, metrics_writer = await asyncio.open_connection(
+            "127.0.0.1", metrics_port)
+        metrics_writer.write(b"GET /metrics HTTP/1.1\r\n\r\n")
+        response = await asyncio.wait_for(metrics_reader.read(), 5)
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"pytaps_received_bytes_total" in response
+        metrics_writer.close()
+        exporter.close()
+        writer.close()
+        listener.stop()
+
+    asyncio.run(run())
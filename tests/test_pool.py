@@ -0,0 +1,80 @@
+import asyncio
+
+import pytaps as taps
+
+
+async def exchange(preconnection):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    received = loop.create_future()
+
+    async def handle_ready(connection):
+        ready.set_result(connection)
+
+    async def handle_received_partial(data, context, eom, connection):
+        received.set_result(data)
+
+    preconnection.on_ready(handle_ready)
+    await preconnection.initiate()
+    connection = await asyncio.wait_for(ready, 5)
+    connection.on_received_partial(handle_received_partial)
+    await connection.send_message(b"ping")
+    await connection.receive(min_incomplete_length=4)
+    assert await asyncio.wait_for(received, 5) == b"ping"
+    connection.release()
+    return connection
+
+
+def test_pool_reuses_released_connection(echo_server, remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        pool = taps.ConnectionPool(max_per_destination=1)
+        connections = []
+        for i in range(3):
+            preconnection = taps.Preconnection(
+                remote_endpoint=remote(port),
+                transport_properties=taps.TransportProperties(),
+                event_loop=loop, pool=pool)
+            connections.append(await exchange(preconnection))
+        assert connections[0] is connections[1] is connections[2]
+        assert pool.stats()["hits"] == 2
+        assert pool.stats()["idle"] == 1
+        pool.close()
+        assert pool.stats()["idle"] == 0
+
+    echo_server(run)
+
+
+def test_pool_discards_connection_with_unsolicited_data(remote):
+    async def run():
+        loop = asyncio.get_running_loop()
+        peers = []
+
+        class Echo(asyncio.Protocol):
+            def connection_made(self, transport):
+                self.transport = transport
+                peers.append(transport)
+
+            def data_received(self, data):
+                self.transport.write(data)
+
+        server = await loop.create_server(Echo, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = taps.ConnectionPool()
+
+        def preconnection():
+            return taps.Preconnection(
+                remote_endpoint=remote(port),
+                transport_properties=taps.TransportProperties(),
+                event_loop=loop, pool=pool)
+        first = await exchange(preconnection())
+        # The peer sends while the connection is idle in the pool
+        peers[0].write(b"late")
+        await asyncio.sleep(0.1)
+        second = await exchange(preconnection())
+        assert second is not first
+        assert pool.stats()["evicted"] == 1
+        pool.close()
+        server.close()
+
+    asyncio.run(run())
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import socket
+import ssl
+
+import pytaps as taps
+from pytaps import racing
+from pytaps.racing import AddressList, RttEstimator, RacingHistory, \
+    MAX_CONNECTION_ATTEMPT_DELAY, MIN_CONNECTION_ATTEMPT_DELAY
+
+
+def test_address_list_interleaves_families():
+    addresses = AddressList()
+    addresses.add(socket.AF_INET, "192.0.2.1")
+    addresses.add(socket.AF_INET, "192.0.2.2")
+    addresses.add(socket.AF_INET6, "2001:db8::1")
+    addresses.add(socket.AF_INET6, "2001:db8::2")
+    addresses.add(socket.AF_INET6, "2001:db8::1")
+    order = [addresses.pop()[1] for i in range(len(addresses))]
+    assert order == ["2001:db8::1", "192.0.2.1", "2001:db8::2", "192.0.2.2"]
+    assert addresses.pop() is None
+
+
+def test_rtt_estimator_bounds_attempt_delay():
+    estimator = RttEstimator()
+    estimator.add_sample(0.0001)
+    assert estimator.attempt_delay() == MIN_CONNECTION_ATTEMPT_DELAY
+    for i in range(20):
+        estimator.add_sample(10)
+    assert estimator.attempt_delay() == MAX_CONNECTION_ATTEMPT_DELAY
+
+
+def test_address_list_starts_with_preferred_address():
+    addresses = AddressList(preferred="192.0.2.2")
+    addresses.add(socket.AF_INET6, "2001:db8::1")
+    addresses.add(socket.AF_INET, "192.0.2.1")
+    addresses.add(socket.AF_INET, "192.0.2.2")
+    assert addresses.pop()[1] == "192.0.2.2"
+    assert addresses.pop()[1] == "2001:db8::1"
+
+
+def test_racing_history_records_outcomes():
+    history = RacingHistory(failure_ttl=60)
+    key = ("example.org", 80, "tcp", None)
+    history.record_failure(key, "2001:db8::1")
+    history.record_win(key, "192.0.2.1", 0.02)
+    assert history.failed_recently(key, "2001:db8::1")
+    assert not history.failed_recently(key, "192.0.2.1")
+    entry = history.entries()[key]
+    assert entry["winner"] == "192.0.2.1"
+    assert entry["srtt"] == 0.02
+    history.flush("example.org")
+    assert history.lookup(key) is None
+
+
+def test_racing_history_entries_expire():
+    history = RacingHistory(ttl=0)
+    key = ("example.org", 80, "tcp", None)
+    history.record_win(key, "192.0.2.1")
+    assert history.entries() == {}
+
+
+class TwoAddressResolver:
+    """ Resolves every name to two loopback addresses
+    """
+
+    async def getaddrinfo(self, host, port, family=0, type=0, proto=0,
+                          flags=0):
+        if family == socket.AF_INET6:
+            return []
+        return [(socket.AF_INET, type, proto, "", (address, port))
+                for address in ("127.0.0.2", "127.0.0.3")]
+
+
+async def start_delaying_proxy(address, port, target_port, delay):
+    """ Accepts TCP connections right away, but only relays them to the
+        target port after delay seconds, which delays the TLS handshake
+    """
+    async def relay(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(reader, writer):
+        await asyncio.sleep(delay)
+        target_reader, target_writer = await asyncio.open_connection(
+            "127.0.0.1", target_port)
+        await asyncio.gather(relay(reader, target_writer),
+                             relay(target_reader, writer))
+
+    return await asyncio.start_server(handle, address, port)
+
+
+def test_race_is_won_by_first_completed_tls_handshake(monkeypatch,
+                                                     echo_server):
+    monkeypatch.setattr(racing, "rtt_estimator", RttEstimator())
+    keys = os.path.join(os.path.dirname(__file__), "keys")
+
+    async def run(target_port):
+        loop = asyncio.get_running_loop()
+        # Both candidates connect at once, but the TLS handshake
+        # of the second one, which starts later, finishes first
+        slow = await start_delaying_proxy("127.0.0.2", 0, target_port, 1.0)
+        port = slow.sockets[0].getsockname()[1]
+        fast = await start_delaying_proxy("127.0.0.3", port, target_port,
+                                          0.1)
+
+        remote_endpoint = taps.RemoteEndpoint()
+        remote_endpoint.with_hostname("localhost")
+        remote_endpoint.with_port(port)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        security = taps.SecurityParameters()
+        security.add_trust_ca(os.path.join(keys, "MyRootCA.pem"))
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote_endpoint, transport_properties=properties,
+            security_parameters=security, event_loop=loop,
+            resolver=TwoAddressResolver())
+        preconnection.tls_sessions = None
+        ready = loop.create_future()
+
+        async def handle_ready(connection):
+            ready.set_result(connection)
+
+        preconnection.on_ready(handle_ready)
+        await preconnection.initiate()
+        connection = await asyncio.wait_for(ready, 3)
+        assert connection.remote_endpoint.address == "127.0.0.3"
+        assert len(connection.transports) == 1
+        await connection.send_message(b"hello")
+        assert await asyncio.wait_for(
+            connection.receive_message(min_incomplete_length=5), 5) == \
+            b"hello"
+        connection.close()
+        fast.close()
+        slow.close()
+
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(os.path.join(keys, "localhost.pem"))
+    echo_server(run, ssl=server_context)
+
+
+class BrokenResolver:
+    """ Fails like asyncio does for a name that is not valid IDNA
+    """
+
+    async def getaddrinfo(self, host, port, family=0, type=0, proto=0,
+                          flags=0):
+        raise UnicodeError("label too long")
+
+
+def test_race_fails_if_resolving_raises():
+    async def run():
+        loop = asyncio.get_running_loop()
+        remote_endpoint = taps.RemoteEndpoint()
+        remote_endpoint.with_hostname("invalid.example")
+        remote_endpoint.with_port(80)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote_endpoint, transport_properties=properties,
+            event_loop=loop, resolver=BrokenResolver())
+        failed = loop.create_future()
+
+        async def handle_initiate_error():
+            failed.set_result(True)
+
+        preconnection.on_initiate_error(handle_initiate_error)
+        await preconnection.initiate()
+        assert await asyncio.wait_for(failed, 3)
+
+    asyncio.run(run())
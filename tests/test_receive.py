@@ -0,0 +1,42 @@
+import asyncio
+
+import pytaps as taps
+from conftest import initiate
+
+
+def test_receive_message(echo_server, remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        connection = await initiate(loop, remote(port), properties)
+        await connection.send_message(b"hello")
+        assert await asyncio.wait_for(
+            connection.receive_message(min_incomplete_length=5), 5) == \
+            b"hello"
+        # Waiting receivers learn that the connection has been closed
+        pending = loop.create_task(connection.receive_message())
+        await asyncio.sleep(0)
+        connection.close()
+        assert await asyncio.wait_for(pending, 5) is None
+
+    echo_server(run)
+
+
+def test_messages(echo_server, remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        properties = taps.TransportProperties()
+        properties.prohibit("reliability")
+        properties.ignore("congestion-control")
+        properties.ignore("preserve-order")
+        connection = await initiate(loop, remote(port), properties)
+        await connection.send_messages([b"a", b"b", b"c"])
+        received = []
+        async for data, context in connection.messages():
+            received.append(data)
+            if len(received) == 3:
+                connection.close()
+        assert received == [b"a", b"b", b"c"]
+
+    echo_server(run, protocol="udp")
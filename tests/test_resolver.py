@@ -0,0 +1,98 @@
+import asyncio
+import socket
+
+import pytest
+
+import pytaps as taps
+from pytaps.resolver import Resolver
+
+ANSWER = [(socket.AF_INET, socket.SOCK_STREAM, 6, "",
+           ("192.0.2.1", 80))]
+
+
+class CountingLoop:
+    """ Wraps an event loop and counts calls to getaddrinfo """
+
+    def __init__(self, loop, fail=False, answer=ANSWER):
+        self.loop = loop
+        self.fail = fail
+        self.answer = answer
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.loop, name)
+
+    async def getaddrinfo(self, host, port, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise socket.gaierror(socket.EAI_NONAME, "Name not known")
+        return self.answer
+
+
+def test_resolver_caches_and_coalesces():
+    async def run():
+        loop = CountingLoop(asyncio.get_running_loop())
+        resolver = Resolver(loop)
+        first, second = await asyncio.gather(
+            resolver.getaddrinfo("example.org", 80),
+            resolver.getaddrinfo("example.org", 80))
+        third = await resolver.getaddrinfo("example.org", 80)
+        assert first == second == third == ANSWER
+        assert loop.calls == 1
+        stats = resolver.stats()
+        assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 1, 1)
+
+    asyncio.run(run())
+
+
+def test_resolver_negative_cache_and_expiry():
+    async def run():
+        loop = CountingLoop(asyncio.get_running_loop(), fail=True)
+        resolver = Resolver(loop, ttl=0.05, negative_ttl=0.05)
+        for _ in range(2):
+            with pytest.raises(socket.gaierror):
+                await resolver.getaddrinfo("invalid.example", 80)
+        assert loop.calls == 1
+        assert resolver.stats()["negative_hits"] == 1
+        await asyncio.sleep(0.06)
+        loop.fail = False
+        assert await resolver.getaddrinfo("invalid.example", 80) == ANSWER
+        assert loop.calls == 2
+
+    asyncio.run(run())
+
+
+def test_resolve_warms_the_cache_for_initiate(echo_server):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        counting = CountingLoop(loop, answer=[
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port)),
+            (socket.AF_INET, socket.SOCK_DGRAM, 17, "", ("127.0.0.1", port))])
+        resolver = Resolver(counting)
+        remote_endpoint = taps.RemoteEndpoint()
+        remote_endpoint.with_hostname("localhost")
+        remote_endpoint.with_port(port)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote_endpoint, transport_properties=properties,
+            event_loop=loop, resolver=resolver)
+        await preconnection.resolve()
+        ready = loop.create_future()
+
+        async def handle_ready(connection):
+            ready.set_result(connection)
+
+        preconnection.on_ready(handle_ready)
+        await preconnection.initiate()
+        connection = await asyncio.wait_for(ready, 5)
+        # The AAAA and A queries of the race are answered from the cache
+        assert counting.calls == 1
+        assert resolver.stats()["hits"] == 2
+        assert await resolver.getaddrinfo(
+            "localhost", port, family=socket.AF_INET,
+            type=socket.SOCK_DGRAM) == [counting.answer[1]]
+        connection.close()
+
+    echo_server(run)
@@ -0,0 +1,53 @@
+import asyncio
+import socket
+
+import pytest
+
+import pytaps as taps
+from pytaps.sharding import sharding_supported
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.skipif(not sharding_supported(),
+                    reason="SO_REUSEPORT or fork() not available")
+def test_sharded_listener_aggregates_workers():
+    async def run():
+        loop = asyncio.get_running_loop()
+        port = free_port()
+        endpoint = taps.LocalEndpoint()
+        endpoint.with_address("127.0.0.1")
+        endpoint.with_port(port)
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            local_endpoint=endpoint, transport_properties=properties,
+            event_loop=loop)
+        listener = await preconnection.listen(workers=2)
+        assert isinstance(listener, taps.ShardedListener)
+        writers = []
+        for i in range(8):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writers.append(writer)
+        for i in range(50):
+            stats = await listener.stats()
+            if stats["connections_received"] == 8:
+                break
+            await asyncio.sleep(0.05)
+        assert stats["connections_received"] == 8
+        assert stats["open_connections"] == 8
+        assert len(stats["per_worker"]) == 2
+        # The clients keep their connections open, so the
+        # workers close them once the grace period is over
+        final = await listener.stop(grace_period=0.2)
+        assert final["connections_received"] == 8
+        assert final["open_connections"] == 0
+        assert not any(process.is_alive() for process in listener.processes)
+        for writer in writers:
+            writer.close()
+
+    asyncio.run(run())
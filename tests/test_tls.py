@@ -0,0 +1,60 @@
+import os
+import shutil
+import ssl
+import time
+from types import SimpleNamespace
+
+from pytaps.securityParameters import SecurityParameters
+from pytaps.tls import ResumingContext, TlsSessionCache, get_security_context
+
+KEYS = os.path.join(os.path.dirname(__file__), "keys")
+
+
+def fake_session(age=0, timeout=300):
+    return SimpleNamespace(time=time.time() - age, timeout=timeout)
+
+
+def test_session_cache_resumes_per_server_and_address():
+    cache = TlsSessionCache()
+    context = ssl.create_default_context()
+    session = fake_session()
+    cache.store("example.org", "192.0.2.1",
+                SimpleNamespace(session=session, context=context))
+    resuming = cache.context_for(context, "example.org", "192.0.2.1")
+    assert isinstance(resuming, ResumingContext)
+    assert resuming.session is session
+    assert resuming.check_hostname == context.check_hostname
+    assert cache.context_for(context, "example.org", "192.0.2.2") is context
+    # Sessions can only be resumed with the context that created them
+    other_context = ssl.create_default_context()
+    assert cache.context_for(other_context, "example.org",
+                             "192.0.2.1") is other_context
+    cache.store("example.org", "192.0.2.1",
+                SimpleNamespace(session=session, context=context))
+    cache.count(SimpleNamespace(session_reused=True))
+    cache.count(SimpleNamespace(session_reused=False))
+    assert cache.stats() == {"resumed": 1, "full_handshakes": 1,
+                             "entries": 1}
+
+
+def test_session_cache_drops_expired_sessions():
+    cache = TlsSessionCache()
+    cache.store("example.org", "192.0.2.1",
+                SimpleNamespace(session=fake_session(age=10, timeout=5),
+                                context=None))
+    assert cache.lookup("example.org", "192.0.2.1") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_security_contexts_are_shared_until_files_change(tmp_path):
+    identity = str(tmp_path / "localhost.pem")
+    shutil.copy(os.path.join(KEYS, "localhost.pem"), identity)
+    parameters = SecurityParameters()
+    parameters.add_identity(identity)
+    parameters.add_trust_ca(os.path.join(KEYS, "MyRootCA.pem"))
+    context = get_security_context(parameters)
+    assert get_security_context(parameters) is context
+    assert get_security_context(parameters, server_side=True) is not context
+    later = os.stat(identity).st_mtime_ns + 10 ** 9
+    os.utime(identity, ns=(later, later))
+    assert get_security_context(parameters) is not context
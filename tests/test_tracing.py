@@ -0,0 +1,48 @@
+import asyncio
+
+import pytaps as taps
+
+
+def test_connection_setup_is_traced(echo_server, remote):
+    async def run(port):
+        loop = asyncio.get_running_loop()
+        properties = taps.TransportProperties()
+        properties.require("reliability")
+        preconnection = taps.Preconnection(
+            remote_endpoint=remote(port), transport_properties=properties,
+            event_loop=loop)
+        recorder = taps.TraceRecorder()
+        preconnection.on_trace(recorder)
+        received = loop.create_future()
+
+        async def handle_ready(connection):
+            await connection.send_message(b"hello")
+            await connection.receive(min_incomplete_length=5)
+
+        async def handle_received_partial(data, context, end_of_message,
+                                          connection):
+            received.set_result(data)
+
+        preconnection.on_ready(handle_ready)
+        connection = await preconnection.initiate()
+        connection.on_received_partial(handle_received_partial)
+        assert await asyncio.wait_for(received, 5) == b"hello"
+
+        names = [event.name for event in recorder.events]
+        for name in ("candidates", "attempt", "race", "ready",
+                     "first_byte_sent", "first_byte_received"):
+            assert names.count(name) == 1, name
+        attempt = recorder.events[names.index("attempt")]
+        assert attempt.attributes["protocol"] == "tcp"
+        assert attempt.attributes["outcome"] == "connected"
+        assert attempt.duration > 0
+        starts = [event.start for event in recorder.events]
+        assert starts[names.index("ready")] <= \
+            starts[names.index("first_byte_received")]
+        assert recorder.durations(connection)["race"] >= \
+            attempt.duration / 1e9
+        # Nothing is reported to the sinks of other preconnections
+        assert not taps.get_tracer().enabled
+        connection.close()
+
+    echo_server(run)